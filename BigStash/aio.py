@@ -0,0 +1,362 @@
+"""
+An asyncio client for the BigStash API, with the resource methods of
+:class:`BigStashAPI` as coroutines, so that many calls can be in flight
+on one event loop instead of one thread each.
+
+Needs Python 3.6 or later and aiohttp, installed with the `aio` extra::
+
+    pip install BigStash[aio]
+
+Usage::
+
+    async with AsyncBigStashAPI(key, secret, settings=settings) as api:
+        async for archive in api.GetArchives():
+            print(archive.key)
+"""
+import os
+import ssl
+import json
+import asyncio
+import logging
+from collections.abc import Mapping
+from BigStash import models
+from BigStash.api import BigStashAPI
+from BigStash.base import BigStashAPIBase, DEFAULT_HEADERS
+from BigStash.conf import BigStashAPISettings
+from BigStash.error import (
+    BigStashError, BigStashForbiddenError, ResourceNotModified)
+from BigStash.serialize import manifest_to_json_chunks, model_to_json
+from BigStash.sign import HTTPSignatureAuth
+from BigStash.structures import CaseInsensitiveDict
+
+try:
+    import aiohttp
+except ImportError:
+    raise ImportError(
+        "the asyncio client needs aiohttp, install BigStash[aio]")
+
+log = logging.getLogger('bigstash.aio')
+
+# connections to the API open at a time
+DEFAULT_LIMIT = 100
+
+
+class _SignableRequest(object):
+    """
+    The parts of a request :class:`HTTPSignatureAuth` signs.
+    """
+
+    def __init__(self, method, url, headers):
+        self.method = method
+        self.url = url
+        self.headers = headers
+
+
+def _ssl_context(verify):
+    """
+    Map the `verify` setting, as requests takes it, to the `ssl` argument
+    of aiohttp: None or True to verify with the default CAs, False not to
+    verify, or the path of a CA bundle file or directory to verify with.
+    """
+    if verify is None or verify is True:
+        return None
+    if verify is False:
+        return False
+    if os.path.isdir(verify):
+        return ssl.create_default_context(capath=verify)
+    return ssl.create_default_context(cafile=verify)
+
+
+async def _chunks(iterable):
+    for chunk in iterable:
+        yield chunk
+        # let other tasks run between the chunks of large bodies
+        await asyncio.sleep(0)
+
+
+class AsyncBigStashAPI(object):
+    USER_DETAIL = BigStashAPI.USER_DETAIL
+    UPLOAD_DETAIL = BigStashAPI.UPLOAD_DETAIL
+    ARCHIVE_DETAIL = BigStashAPI.ARCHIVE_DETAIL
+    ARCHIVE_FILES = BigStashAPI.ARCHIVE_FILES
+    TOKEN_DETAIL = BigStashAPI.TOKEN_DETAIL
+
+    api_url = BigStashAPIBase.api_url
+    add_date = BigStashAPIBase.add_date
+
+    def __init__(self, key=None, secret=None, settings=None, headers=None,
+                 session=None, limit=DEFAULT_LIMIT):
+        """Initialize an :class:`AsyncBigStashAPI` object.
+
+        :param key: API key
+        :param secret: API secret
+        :param settings: optional :class:`BigStashAPISettings` instance to use.
+        :param headers: optional dict of HTTP headers
+        :param session: optional :class:`aiohttp.ClientSession` to share
+            with other clients, left open by :meth:`close`
+        :param limit: connections to open at a time, if no session is given
+        """
+        if key is None or secret is None:
+            raise TypeError("Must provide API key and secret.")
+        self.key = key
+        self.secret = secret
+        self.settings = settings or BigStashAPISettings()
+        if 'base_url' not in self.settings:
+            raise TypeError("Must provide base_url setting")
+        self._base_url = self.settings['base_url'].rstrip('/')
+        self._headers = CaseInsensitiveDict(DEFAULT_HEADERS)
+        self._headers.update(headers or {})
+        self._headers['X-Deepfreeze-Api-Key'] = key
+        self._auth = HTTPSignatureAuth(
+            key_id=key, secret=secret, algorithm='hmac-sha256',
+            headers=['(request-target)', 'date', 'host'])
+        self._session = session
+        self._own_session = session is None
+        self._limit = limit
+        self._root = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the connections of the client, unless its session was
+        given to it.
+        """
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self._limit,
+                    ssl=_ssl_context(self.settings['verify'])),
+                trust_env=bool(self.settings['trust_env']))
+        return self._session
+
+    def _sign(self, method, url, headers):
+        request = _SignableRequest(method, url, headers)
+        self._auth(request)
+        return request.headers
+
+    async def _request(self, method, path, data=None, json_body=None,
+                       headers=None, expect_json=True):
+        """
+        Send a request and return the decoded JSON body and the headers of
+        the response, raising :class:`BigStashError` for errors.
+        """
+        url = self.api_url(path)
+        hdrs = CaseInsensitiveDict(self._headers)
+        hdrs.update(headers or {})
+        self.add_date(hdrs)
+        if json_body is not None:
+            data = json.dumps(json_body)
+        hdrs = self._sign(method, url, hdrs)
+        session = self._get_session()
+        async with session.request(
+                method, url, data=data, headers=dict(hdrs)) as r:
+            ctype = r.headers.get('content-type', 'application/json')
+            if r.status == 304:
+                raise ResourceNotModified()
+            if r.status >= 400:
+                log.debug("error on {}".format(url))
+                text = r.reason
+                body = await r.text()
+                if 'json' in ctype:
+                    try:
+                        body = json.loads(body)
+                    except ValueError:
+                        pass
+                if isinstance(body, Mapping) and 'detail' in body:
+                    text = body['detail']
+                if r.status in (401, 403):
+                    raise BigStashForbiddenError(text, response=r)
+                elif r.status in (400, 500):
+                    raise BigStashError(text)
+                raise BigStashError("{} {} for url: {}".format(
+                    r.status, r.reason, url))
+            if not expect_json:
+                return None, r.headers
+            try:
+                return json.loads(await r.text()), r.headers
+            except ValueError as e:
+                raise BigStashError(e)
+
+    async def _top_resource_url(self, resource):
+        if self._root is None:
+            self._root, _ = await self._request('GET', '')
+        try:
+            return self._root[resource]
+        except Exception:
+            log.error("error getting top resource url", exc_info=True)
+            raise BigStashError("invalid resource '{}'".format(resource))
+
+    async def _pages(self, url, model):
+        while url is not None:
+            body, headers = await self._request('GET', url)
+            for r in body['results']:
+                yield model(**r)
+            url = body['next']
+
+    async def _get_top_list(self, model):
+        url = await self._top_resource_url(model.__name__.lower() + 's')
+        async for obj in self._pages(url, model):
+            yield obj
+
+    async def get_all_objects(self, olist):
+        """
+        Iterate over the objects of an :class:`ObjectList`, fetching the
+        pages after the first one as needed.
+        """
+        for obj in olist:
+            yield obj
+        async for obj in self._pages(olist.next, olist.klass):
+            yield obj
+
+    def GetNotifications(self):
+        """
+            Iterate over all notifications
+        """
+        return self._get_top_list(models.Notification)
+
+    def GetUploads(self):
+        """
+            Iterate over all uploads
+        """
+        return self._get_top_list(models.Upload)
+
+    def GetArchives(self):
+        """
+            Iterate over all archives
+        """
+        return self._get_top_list(models.Archive)
+
+    async def GetUser(self):
+        """Get the user resource"""
+        body, headers = await self._request('GET', self.USER_DETAIL)
+        return models.User(meta=headers, **body)
+
+    async def GetArchive(self, archive_id):
+        """ Get details for an archive
+
+        :param archive_id: the archive id
+        """
+        body, headers = await self._request(
+            'GET', self.ARCHIVE_DETAIL.format(id=archive_id))
+        return models.Archive(meta=headers, **body)
+
+    def GetArchiveFiles(self, archive_id):
+        """ Iterate over the files of an archive
+
+        :param archive_id: the archive id
+        """
+        return self._pages(
+            self.ARCHIVE_FILES.format(id=archive_id), models.File)
+
+    async def GetUpload(self, upload_id):
+        """ Get details for an upload
+
+        :param upload_id: the upload id
+        """
+        body, headers = await self._request(
+            'GET', self.UPLOAD_DETAIL.format(id=upload_id))
+        return models.Upload(meta=headers, **body)
+
+    async def CreateArchive(self, title=None, size=None):
+        """ Create a new archive. Returns an Archive instance.
+
+        :param title: the archive title
+        :param size: the archive size in bytes
+        """
+        body, headers = await self._request(
+            'POST', await self._top_resource_url('archives'),
+            json_body={'title': title, 'size': size})
+        return models.Archive(meta=headers, **body)
+
+    async def RefreshUploadStatus(self, upload):
+        """ Fetch an upload again, returning it as it was if it hasn't
+        been modified since.
+
+        :param upload: the upload model instance
+        """
+        headers = {}
+        lm = upload.get_meta('last-modified')
+        if lm is not None:
+            headers['If-Modified-Since'] = lm
+        try:
+            body, headers = await self._request(
+                'GET', upload.url, headers=headers)
+            return upload.__class__(meta=headers, **body)
+        except ResourceNotModified:
+            return upload
+
+    async def RefreshUploadToken(self, upload):
+        """ Fetch an upload again for new S3 credentials. Returns the new
+        :class:`models.BucketToken`, which also replaces `upload.s3`.
+
+        :param upload: the upload model instance
+        """
+        body, headers = await self._request('GET', upload.url)
+        upload.s3 = models.Upload(meta=headers, **body).s3
+        return upload.s3
+
+    async def CreateUpload(self, archive=None, manifest=None):
+        """ Create a new upload for an archive
+
+        :param archive: the archive model instance
+        :param manifest: the upload manifest
+        """
+        if archive is not None:
+            url = archive.upload
+        else:
+            url = await self._top_resource_url('uploads')
+        # stream the manifest, it can be too large to encode in memory
+        body, headers = await self._request(
+            'POST', url, data=_chunks(manifest_to_json_chunks(manifest)))
+        return models.Upload(meta=headers, **body)
+
+    async def UpdateUploadFiles(self, upload, files=None):
+        """ Add files to the manifest of an upload that hasn't been marked
+        as uploaded yet. Files with the id of one already in the manifest
+        replace it.
+
+        :param upload: the upload model instance
+        :param files: the manifest entries to add or replace
+        """
+        return await self._request(
+            'PATCH', upload.url,
+            data=model_to_json({'files': list(files or ())}))
+
+    async def UpdateUploadStatus(self, upload, status):
+        """ Update an upload's status
+
+        :param upload: the upload model instance
+        :param status: the new upload status
+        """
+        patch = {"status": status}
+        body, headers = await self._request(
+            'PATCH', upload.url, json_body=patch)
+        upload.update(patch, headers)
+
+    async def CancelUpload(self, upload_id):
+        """ Cancel an upload
+
+        :param upload_id: the upload id
+        """
+        await self._request(
+            'DELETE', self.UPLOAD_DETAIL.format(id=upload_id),
+            expect_json=False)
+
+    async def DestroyAPIKey(self, token_id):
+        """ Delete an API key
+
+        :param token_id: the token id
+        """
+        await self._request(
+            'DELETE', self.TOKEN_DETAIL.format(id=token_id),
+            expect_json=False)
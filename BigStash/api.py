@@ -4,7 +4,7 @@ from BigStash.decorators import json_response, no_content_response
 from BigStash.error import BigStashError, ResourceNotModified
 from cached_property import cached_property
 from BigStash import models
-from BigStash.serialize import model_to_json
+from BigStash.serialize import manifest_to_json_chunks, model_to_json
 from BigStash.sign import HTTPSignatureAuth
 from itertools import chain
 import logging
@@ -183,6 +183,20 @@ class BigStashAPI(BigStashAPIBase):
         log.debug("Refreshed upload {}".format(upload))
         return upload
 
+    def RefreshUploadToken(self, upload):
+        """ Fetch an upload again for new S3 credentials, before the ones
+        it has expire. Returns the new :class:`models.BucketToken`, which
+        also replaces `upload.s3`.
+
+        :param upload: the upload model instance
+        """
+        body, headers = json_response(self.get)(upload.url)
+        token = models.Upload(meta=headers, **body).s3
+        log.debug("Refreshed credentials of {}, expiring {}".format(
+            upload, getattr(token, 'token_expiration', None)))
+        upload.s3 = token
+        return token
+
     def CreateUpload(self, archive=None, manifest=None, **kwargs):
         """ Create a new upload for an archive
 
@@ -193,13 +207,22 @@ class BigStashAPI(BigStashAPIBase):
             url = archive.upload
         else:
             url = self._top_resource_url('uploads')
-        kwargs['data'] = model_to_json(manifest)
+        # stream the manifest, it can be too large to encode in memory
+        kwargs['data'] = manifest_to_json_chunks(manifest)
         body, headers = json_response(self.post)(url, **kwargs)
         return models.Upload(meta=headers, **body)
 
     @json_response
     def UpdateUploadFiles(self, upload, files=None):
-        pass
+        """ Add files to the manifest of an upload that hasn't been marked
+        as uploaded yet. Files with the id of one already in the manifest
+        replace it.
+
+        :param upload: the upload model instance
+        :param files: the manifest entries to add or replace
+        """
+        return self.patch(
+            upload.url, data=model_to_json({'files': list(files or ())}))
 
     def UpdateUploadStatus(self, upload, status):
         """ Update an upload's status
@@ -20,7 +20,7 @@ class BigStashAuth(BigStashAPIBase):
         return self.post('tokens', auth=auth, json={"name": name})
 
 
-def get_api_credentials(settings, username=None, password=None):
+def get_api_credentials(settings, username=None, password=None, pool=None):
     k = s = None
     if all(e in os.environ for e in ('BS_API_KEY', 'BS_API_SECRET')):
         k, s = (os.environ['BS_API_KEY'], os.environ['BS_API_SECRET'])
@@ -31,7 +31,7 @@ def get_api_credentials(settings, username=None, password=None):
         except Exception:
             log.debug("error reading config file", exc_info=True)
             print("No saved credentials found")
-            auth = BigStashAuth(settings=settings)
+            auth = BigStashAuth(settings=settings, pool=pool)
             r, _ = auth.GetAPIKey(username or input("Username: "),
                                   password or getpass("Password: "))
             if input("Save api key to settings? (y/N) ").lower() == "y":
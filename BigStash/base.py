@@ -6,6 +6,7 @@ import os.path
 
 from BigStash import __version__
 from .conf import BigStashAPISettings
+from .pool import APIConnectionPool
 from requests import Session
 from requests.sessions import merge_setting
 from six.moves.urllib.parse import urlparse
@@ -33,13 +34,15 @@ DEFAULT_HEADERS = CaseInsensitiveDict({
 
 
 class BigStashAPIBase(object):
-    def __init__(self, auth=None, settings=None, headers=None,
+    def __init__(self, auth=None, settings=None, headers=None, pool=None,
                  *args, **kwargs):
         """
         Initialize the Base API client functions
         :param auth: optional authentication tuple or object for request
         :param settings: optional :class:`BigStashAPISettings` instance to use.
         :param headers: optional dict  of HTTP Headers
+        :param pool: optional :class:`APIConnectionPool` to share with other
+            clients, by default one configured by the settings
         """
         self.settings = settings or BigStashAPISettings()
         if 'base_url' not in self.settings:
@@ -56,6 +59,8 @@ class BigStashAPIBase(object):
         if 'auth' is not None:
             self._auth = auth
 
+        self.pool = pool or APIConnectionPool.from_settings(self.settings)
+
         # setup requests session
         self._session = self._setup_session()
 
@@ -98,6 +103,8 @@ class BigStashAPIBase(object):
             s.trust_env = self.settings['trust_env']
         if self._auth is not None:
             s.auth = self._auth
+        s.mount('http://', self.pool)
+        s.mount('https://', self.pool)
 
         s.headers = merge_setting(  # add our headers to requests' default set
             self._headers, s.headers, dict_class=CaseInsensitiveDict)
@@ -0,0 +1,163 @@
+import os
+import time
+import logging
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+log = logging.getLogger('bigstash.cache')
+
+DEFAULT_CACHE_FILE = 'digests.db'
+
+DEFAULT_MAX_ENTRIES = 1000000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime)
+);
+CREATE INDEX IF NOT EXISTS digests_atime ON digests (atime);
+"""
+
+
+def stat_key(st):
+    """
+    Return the cache key for a stat result.
+    """
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1000000000)
+    return (st.st_dev, st.st_ino, st.st_size, mtime)
+
+
+class DigestCache(object):
+    """
+    A persistent cache of file digests, keyed by device, inode, size and
+    modification time, so that unchanged files don't need to be hashed
+    again. Entries are evicted in least recently used order once there are
+    more than `max_entries` of them.
+
+    The cache is an sqlite database, so several processes can use the
+    same file at the same time.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, timeout=60,
+                 batch_size=1000):
+        """
+        :param path: the cache database file
+        :param max_entries: maximum number of cached digests
+        :param timeout: seconds to wait for other processes' locks
+        :param batch_size: number of updates to write per transaction
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=timeout, check_same_thread=False)
+        try:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            log.debug("couldn't enable WAL journal", exc_info=True)
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Open the cache configured in the settings profile. Returns None if
+        caching is disabled or not available.
+        """
+        if not settings['hash_cache'] or sqlite3 is None:
+            return None
+        if not os.path.exists(settings.config_root):
+            os.makedirs(settings.config_root)
+        path = settings.get_config_file(DEFAULT_CACHE_FILE)
+        try:
+            return cls(path, max_entries=int(
+                settings['hash_cache_size'] or DEFAULT_MAX_ENTRIES))
+        except sqlite3.Error:
+            log.warn("error opening digest cache {}".format(path),
+                     exc_info=True)
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, st):
+        """
+        Return the cached digest for a file's stat result, or None.
+        """
+        if not st.st_ino:
+            # no inode number (e.g. scandir on windows), can't be cached
+            self.misses += 1
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest FROM digests WHERE '
+                'dev = ? AND ino = ? AND size = ? AND mtime = ?',
+                stat_key(st)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, st, digest):
+        """
+        Store the digest for a file's stat result. Storing a digest that is
+        already cached marks it as recently used.
+        """
+        if not st.st_ino:
+            return
+        with self._lock:
+            self._pending.append(stat_key(st) + (digest, time.time()))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO digests '
+                '(dev, ino, size, mtime, digest, atime) '
+                'VALUES (?, ?, ?, ?, ?, ?)', self._pending)
+        self._pending = []
+
+    def _evict(self):
+        count, = self._conn.execute('SELECT COUNT(*) FROM digests').fetchone()
+        if count <= self.max_entries:
+            return
+        with self._conn:
+            self._conn.execute(
+                'DELETE FROM digests WHERE rowid IN ('
+                'SELECT rowid FROM digests ORDER BY atime LIMIT ?)',
+                (count - self.max_entries,))
+        log.debug("evicted {} digests from cache".format(
+            count - self.max_entries))
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._flush()
+                self._evict()
+            finally:
+                self._conn.close()
+                self._conn = None
@@ -6,7 +6,31 @@ DEFAULT_SETTINGS = {
     'base_url': 'https://www.bigstash.co/api/',
     'trust_env': False,
     'verify': True,
-    'log_level': 'ERROR'
+    'log_level': 'ERROR',
+    'hash_cache': True,
+    'hash_cache_size': 1000000,
+    'multipart_threshold': 8 * 1024 * 1024,
+    # None to tune automatically while uploading
+    'multipart_chunksize': None,
+    'max_concurrency': None,
+    # bytes per second, or rates by time of day like '09:00-18:00=1M,10M'
+    'limit_rate': None,
+    # an S3 compatible service to upload to instead of AWS
+    's3_endpoint_url': None,
+    # 'auto', 'virtual' or 'path' style bucket URLs
+    's3_addressing_style': None,
+    # None to size the pool for the upload concurrency
+    's3_max_pool_connections': None,
+    # hosts to keep API connections to, and idle connections to each
+    'api_pool_connections': 10,
+    'api_pool_maxsize': 10,
+    # wait for a free connection instead of opening more than the maximum
+    'api_pool_block': False,
+    # seconds, None to wait forever
+    'api_connect_timeout': 10,
+    'api_read_timeout': 120,
+    # times to retry failed attempts to connect to the API
+    'api_connect_retries': 3
 }
 
 DEFAULT_CONFIG_ROOT = os.path.expanduser(
@@ -32,6 +56,8 @@ class BigStashAPISettings(collections.MutableMapping):
             'BS_CONFIG_ROOT', DEFAULT_CONFIG_ROOT)
         if 'BS_API_URL' in os.environ:
             self['base_url'] = os.environ['BS_API_URL']
+        if 'BS_S3_ENDPOINT_URL' in os.environ:
+            self['s3_endpoint_url'] = os.environ['BS_S3_ENDPOINT_URL']
         self['log_level'] = os.environ.get("BS_LOG_LEVEL", "error").upper()
 
     @property
@@ -1,5 +1,7 @@
 from requests.exceptions import RequestException
-from .error import BigStashError, BigStashForbiddenError, ResourceNotModified
+from .error import (
+    BigStashError, BigStashConnectionError, BigStashForbiddenError,
+    ResourceNotModified)
 from wrapt import decorator
 from collections import Mapping
 import logging
@@ -8,6 +10,20 @@ import logging
 log = logging.getLogger('bigstash.api')
 
 
+def _error(e, ctype):
+    text = e.response.reason
+    body = e.response.json() if 'json' in ctype else e.response.text
+    log.debug("error on {}".format(e.request.url), exc_info=True)
+    if isinstance(body, Mapping) and 'detail' in body:
+        text = body['detail']
+    if e.response.status_code in (401, 403):
+        return BigStashForbiddenError(
+            text, request=e.request, response=e.response)
+    elif e.response.status_code in (400, 500):
+        return BigStashError(text)
+    return BigStashError(e)
+
+
 @decorator
 def json_response(wrapped, instance, args, kwargs):
     exc = None
@@ -19,18 +35,11 @@ def json_response(wrapped, instance, args, kwargs):
             raise ResourceNotModified()
         return r.json(), r.headers
     except RequestException as e:
-        text = e.response.reason
-        body = e.response.json() if 'json' in ctype else e.response.text
-        log.debug("error on {}".format(r.request.url), exc_info=True)
-        if isinstance(body, Mapping) and 'detail' in body:
-            text = body['detail']
-        if e.response.status_code in (401, 403):
-            exc = BigStashForbiddenError(
-                text, request=e.request, response=e.response)
-        elif e.response.status_code in (400, 500):
-            exc = BigStashError(text)
+        if e.response is None:
+            log.debug("error connecting", exc_info=True)
+            exc = BigStashConnectionError(e, request=e.request)
         else:
-            exc = BigStashError(e)
+            exc = _error(e, ctype)
     except ValueError as e:
         exc = BigStashError(e)
     raise exc
@@ -42,4 +51,6 @@ def no_content_response(wrapped, instance, args, kwargs):
         r = wrapped(*args, **kwargs)
         r.raise_for_status()
     except RequestException as e:
+        if e.response is None:
+            raise BigStashConnectionError(e, request=e.request)
         raise BigStashError(e)
@@ -0,0 +1,31 @@
+import io
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path, algorithm='md5', chunk_size=CHUNK_SIZE, buf=None):
+    """
+    Return the hex digest of the file at 'path', reading it in fixed size
+    chunks so that memory use doesn't depend on the file size.
+
+    :param path: the file to hash
+    :param algorithm: any algorithm name known to :mod:`hashlib`
+    :param chunk_size: size of each read, ignored if `buf` is given
+    :param buf: optional preallocated `bytearray` to read into
+    """
+    if buf is None:
+        buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    h = hashlib.new(algorithm)
+    with io.open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def md5_file(path, **kwargs):
+    return file_digest(path, algorithm='md5', **kwargs)
@@ -14,6 +14,11 @@ class BigStashClientError(BigStashError):
         super(BigStashClientError, self).__init__(*args, **kwargs)
 
 
+class BigStashConnectionError(BigStashClientError):
+    """ The API could not be reached, or didn't respond in time """
+    pass
+
+
 class BigStashForbiddenError(BigStashClientError):
     pass
 
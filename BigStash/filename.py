@@ -3,10 +3,11 @@ import six
 import re
 import sys
 import os.path
+import stat
 import posixpath
-import fnmatch
 from functools import partial
 from operator import contains
+from BigStash.ignore import GitIgnore
 
 # from: https://github.com/longaccess/deepfreeze.io/blob/dev/docs/api.md
 
@@ -55,22 +56,21 @@ IGNORED_FILE_NAMES = [
 
 IGNORE_TESTS = {
     'small system file': partial(contains, IGNORED_FILE_NAMES),
-    'is link': os.path.islink
 }
 
+IGNORE_STAT_TESTS = {
+    'is link': lambda st: stat.S_ISLNK(st.st_mode),
+    'not a regular file': lambda st: not (
+        stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)),
+}
 
-class FnMatches(object):
-    def __init__(self, patterns=[]):
-        self.patterns = patterns
 
-    def __call__(self, path):
-        return any(map(partial(fnmatch.fnmatch, path), self.patterns))
+IGNORE_MATCHERS = {}
 
 
 def setup_user_ignore(ignorefile):
-    with open(os.path.expanduser(ignorefile)) as ignorefile:
-        p = list(l.strip() for l in ignorefile if not l.startswith('#'))
-        IGNORE_TESTS['is user ignored'] = FnMatches(p)
+    IGNORE_MATCHERS['is user ignored'] = GitIgnore.from_file(
+        os.path.expanduser(ignorefile))
 
 
 def splitpath(path):
@@ -98,14 +98,41 @@ def toposix(path):
     return posixpath.join(*components)
 
 
-def get_validator(tests={}, search={}, match={}):
+def get_validator(tests={}, search={}, match={}, stat_tests={}):
     validators = [(m, re.compile(p).search) for m, p in six.iteritems(search)]
     validators += [(m, re.compile(p).match) for m, p in six.iteritems(match)]
     validators += [(m, f) for m, f in six.iteritems(tests)]
-
-    return lambda path: ((m, f, p) for p in splitpath(path)
-                         for m, f in validators if p != os.sep and f(p))
-
-should_ignore = lambda: get_validator(tests=IGNORE_TESTS)
+    stat_validators = list(six.iteritems(stat_tests))
+
+    def validator(path, st=None, components=None):
+        if components is None:
+            components = splitpath(path)
+        for p in components:
+            for m, f in validators:
+                if p != os.sep and f(p):
+                    yield (m, f, p)
+        if st is not None:
+            for m, f in stat_validators:
+                if f(st):
+                    yield (m, f, path)
+    return validator
+
+
+def get_path_validator(matchers={}):
+    """
+    Return a validator for paths relative to the root of a walk, checked
+    by matchers such as :class:`GitIgnore` that need the whole path.
+    """
+    matchers = list(six.iteritems(matchers))
+
+    def validator(relpath, is_dir=False):
+        for m, f in matchers:
+            if f(relpath, is_dir):
+                yield (m, f, relpath)
+    return validator
+
+should_ignore_path = lambda: get_path_validator(IGNORE_MATCHERS)
+should_ignore = lambda: get_validator(
+    tests=IGNORE_TESTS, stat_tests=IGNORE_STAT_TESTS)
 is_invalid = lambda: get_validator(
     search=SEARCH_PATTERNS, match=MATCH_PATTERNS)
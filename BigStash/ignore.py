@@ -0,0 +1,204 @@
+from __future__ import unicode_literals
+import re
+import io
+
+_GLOB_CHARS = re.compile(r'[*?\[\\]')
+
+
+def _translate(pattern):
+    """
+    Translate a gitignore glob into a regular expression that matches
+    whole posix style paths.
+    """
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if (pattern[i:i+2] == '**' and (i == 0 or pattern[i-1] == '/')
+                    and (i + 2 == n or pattern[i+2] == '/')):
+                if i + 2 == n:
+                    res.append('.*')
+                else:
+                    res.append('(?:.*/)?')
+                    i += 1
+                i += 2
+                continue
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                res.append(re.escape(c))
+            else:
+                stuff = pattern[i+1:j].replace('\\', '\\\\')
+                if stuff[0] in '!^':
+                    stuff = '^' + stuff[1:]
+                res.append('[{}]'.format(stuff))
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            res.append(re.escape(pattern[i]))
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return ''.join(res)
+
+
+class Pattern(object):
+    """
+    A single parsed gitignore pattern.
+    """
+    __slots__ = ('pattern', 'negated', 'dir_only', 'anchored', 'glob')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.negated = pattern.startswith('!')
+        if self.negated:
+            pattern = pattern[1:]
+        elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        self.anchored = '/' in pattern
+        self.glob = pattern.lstrip('/')
+
+    @classmethod
+    def parse(cls, line):
+        """
+        Parse a line of a gitignore file, returns None for blank lines and
+        comments.
+        """
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('#'):
+            return None
+        stripped = line.rstrip(' ')
+        if stripped.endswith('\\') and len(stripped) < len(line):
+            stripped += ' '
+        if not stripped or stripped in ('!', '/'):
+            return None
+        return cls(stripped)
+
+
+def _literal_prefix(glob):
+    m = _GLOB_CHARS.search(glob)
+    return glob if m is None else glob[:m.start()]
+
+
+class _Index(object):
+    """
+    Finds the highest numbered pattern matching a path. Literal names,
+    paths and suffixes are looked up in dicts, the remaining patterns are
+    bucketed by the first character of their literal prefix and compiled
+    into combined regular expressions.
+    """
+
+    # python 2 limits regular expressions to 100 groups
+    MAX_GROUPS = 99
+
+    def __init__(self, patterns):
+        self.names = {}
+        self.paths = {}
+        self.suffixes = {}
+        # the last of the patterns that match everything, like '*'
+        self.everything = -1
+        self.name_regexes = {}
+        self.path_regexes = {}
+        name_globs = {}
+        path_globs = {}
+        for i, p in patterns:
+            glob = p.glob
+            prefix = _literal_prefix(glob)
+            if prefix == glob:
+                target = self.paths if p.anchored else self.names
+                target[glob] = i
+            elif (not p.anchored and glob.startswith('*') and
+                    _literal_prefix(glob[1:]) == glob[1:]):
+                if glob == '*':
+                    self.everything = i
+                else:
+                    self.suffixes[glob[1:]] = i
+            else:
+                globs = path_globs if p.anchored else name_globs
+                globs.setdefault(prefix[:1], []).append((i, glob))
+        self.suffix_lengths = sorted(set(map(len, self.suffixes)))
+        for globs, regexes in ((name_globs, self.name_regexes),
+                               (path_globs, self.path_regexes)):
+            for key, items in globs.items():
+                regexes[key] = list(self._compile(items))
+
+    @classmethod
+    def _compile(cls, items):
+        # alternatives are tried in order, so put the highest numbered
+        # patterns first and the first group that matches is the answer
+        items = sorted(items, reverse=True)
+        for n in range(0, len(items), cls.MAX_GROUPS):
+            chunk = items[n:n+cls.MAX_GROUPS]
+            regex = re.compile('(?:{})\\Z'.format('|'.join(
+                '({})'.format(_translate(g)) for _, g in chunk)), re.DOTALL)
+            yield (chunk[0][0], regex.match, [i for i, _ in chunk])
+
+    @staticmethod
+    def _search(regexes, key, s, best):
+        for k in (key, ''):
+            for top, match, indexes in regexes.get(k, ()):
+                if top <= best:
+                    break
+                m = match(s)
+                if m is not None:
+                    best = max(best, indexes[m.lastindex - 1])
+                    break
+        return best
+
+    def __call__(self, path, name):
+        best = max(self.names.get(name, -1), self.paths.get(path, -1),
+                   self.everything)
+        for n in self.suffix_lengths:
+            best = max(best, self.suffixes.get(name[-n:], -1))
+        best = self._search(self.name_regexes, name[:1], name, best)
+        best = self._search(self.path_regexes, path[:1], path, best)
+        return best
+
+
+class GitIgnore(object):
+    """
+    A compiled set of gitignore patterns.
+
+    Supports negation, anchoring, `**` and directory only patterns. As in
+    git, the last pattern that matches a path decides whether it is
+    ignored. Literal names, paths and extensions are found with dict
+    lookups, and the remaining patterns are compiled into a few combined
+    regular expressions, so the cost of matching grows slowly with the
+    number of patterns.
+
+    Paths are matched on their own; files under an ignored directory are
+    expected to be skipped by not descending into that directory.
+    """
+
+    def __init__(self, lines=()):
+        self.patterns = list(filter(None, map(Pattern.parse, lines)))
+        numbered = list(enumerate(self.patterns))
+        self._files = _Index((i, p) for i, p in numbered if not p.dir_only)
+        self._dirs = _Index(numbered)
+
+    @classmethod
+    def from_file(cls, path):
+        with io.open(path, encoding='utf-8') as f:
+            return cls(f)
+
+    def __call__(self, path, is_dir=False):
+        """
+        Return True if the posix style relative `path` is ignored.
+
+        :param path: path relative to the directory the patterns apply to
+        :param is_dir: whether the path is a directory
+        """
+        name = path.rsplit('/', 1)[-1]
+        i = (self._dirs if is_dir else self._files)(path, name)
+        return i >= 0 and not self.patterns[i].negated
@@ -0,0 +1,223 @@
+import io
+import os
+import json
+import errno
+import hashlib
+import logging
+import threading
+from BigStash.manifest import Manifest
+
+log = logging.getLogger('bigstash.journal')
+
+JOURNAL_DIR = 'journal'
+
+
+class TransferJournal(object):
+    """
+    An append only log of the progress of an upload, so that it can be
+    resumed after bgst is interrupted. It records the files of the
+    manifest, which of them have been uploaded, and the parts uploaded so
+    far of large files.
+
+    Journals are kept under the config root, named after the upload URL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.url = None
+        self.title = None
+        self.base = None
+        # the files were still being found when the journal was written
+        self.scanning = False
+        self._files = []
+        self._done = set()
+        self._digests = {}
+        self._multipart = {}
+        self._lock = threading.Lock()
+        self._fp = None
+        # whether this is the journal of an interrupted transfer
+        self.resumed = os.path.exists(path)
+        if self.resumed:
+            self._load()
+
+    @staticmethod
+    def path_for(settings, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return settings.get_config_file(os.path.join(JOURNAL_DIR, name))
+
+    @classmethod
+    def create(cls, settings, upload, manifest, files=None, scanning=False):
+        """
+        Start a new journal for an upload of `manifest`.
+
+        :param files: the files to record, by default all of the manifest
+        :param scanning: more files will be added, until `scan_done`
+        """
+        path = cls.path_for(settings, upload.url)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if os.path.exists(path):
+            os.remove(path)
+        journal = cls(path)
+        journal.url = upload.url
+        journal.title = manifest.title
+        journal.base = manifest._base
+        journal.scanning = scanning
+        journal._write({'type': 'upload', 'url': upload.url,
+                        'title': manifest.title, 'base': journal.base,
+                        'scanning': scanning})
+        journal.add_files(manifest if files is None else files)
+        return journal
+
+    @classmethod
+    def load(cls, settings, url):
+        """
+        Open the journal of the upload at `url`. Returns None if there is
+        no journal for it.
+        """
+        path = cls.path_for(settings, url)
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def _load(self):
+        end = 0
+        with io.open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # a partially written last line
+                    log.debug("ignoring journal line {!r}".format(line))
+                    break
+                end += len(line)
+                try:
+                    r = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    log.debug("ignoring journal line {!r}".format(line))
+                    continue
+                kind = r.get('type')
+                if kind == 'upload':
+                    self.url, self.title = r['url'], r['title']
+                    self.base = r.get('base')
+                    self.scanning = r.get('scanning', False)
+                elif kind == 'scanned':
+                    self.scanning = False
+                elif kind == 'file':
+                    self._files.append((
+                        r['id'], r['path'], r['size'], r['mtime'], r['md5']))
+                elif kind == 'done':
+                    self._done.add(r['id'])
+                    if r.get('md5') is not None:
+                        self._digests[r['id']] = r['md5']
+                    self._multipart.pop(r['id'], None)
+                elif kind == 'multipart':
+                    self._multipart[r['id']] = (
+                        r['upload_id'], r.get('part_size'), {})
+                elif kind == 'part' and r['id'] in self._multipart:
+                    self._multipart[r['id']][2][r['part']] = r['etag']
+        if end < os.path.getsize(self.path):
+            # records are appended, so cut off what would prefix the next
+            with io.open(self.path, 'r+b') as f:
+                f.truncate(end)
+
+    def add_files(self, files):
+        """
+        Record files registered with the upload.
+        """
+        with self._lock:
+            for f in files:
+                self._write({
+                    'type': 'file', 'id': f.id, 'path': f.original_path,
+                    'size': f.size, 'mtime': f.mtime, 'md5': f.md5})
+                self._files.append(
+                    (f.id, f.original_path, f.size, f.mtime, f.md5))
+            self._flush()
+
+    def scan_done(self):
+        """
+        Record that all of the files of the upload have been added.
+        """
+        self._record({'type': 'scanned'})
+        self.scanning = False
+
+    def _write(self, record):
+        if self._fp is None:
+            self._fp = io.open(self.path, 'a', encoding='utf-8')
+        line = json.dumps(record)
+        if not isinstance(line, type(u'')):
+            line = line.decode('utf-8')
+        self._fp.write(line + u'\n')
+
+    def _flush(self):
+        if self._fp is not None:
+            self._fp.flush()
+
+    def _record(self, record):
+        with self._lock:
+            self._write(record)
+            self._flush()
+
+    def manifest(self):
+        """
+        Rebuild the manifest of the upload.
+        """
+        manifest = Manifest(title=self.title, base=self.base)
+        for key, path, size, mtime, md5 in self._files:
+            manifest._add(path, size, mtime, md5, key=key)
+        return manifest
+
+    def is_done(self, key):
+        return key in self._done
+
+    @property
+    def done_count(self):
+        return len(self._done)
+
+    def digest(self, key):
+        """
+        Return the digest computed while uploading a file, if any.
+        """
+        return self._digests.get(key)
+
+    def file_done(self, key, md5=None):
+        record = {'type': 'done', 'id': key}
+        if md5 is not None:
+            record['md5'] = md5
+            self._digests[key] = md5
+        self._record(record)
+        self._done.add(key)
+        self._multipart.pop(key, None)
+
+    def multipart(self, key):
+        """
+        Return the (upload_id, part_size, {part_number: etag}) of a
+        multipart upload in progress for the file, or (None, None, {}).
+        """
+        return self._multipart.get(key, (None, None, {}))
+
+    def multipart_started(self, key, upload_id, part_size=None):
+        self._record({'type': 'multipart', 'id': key,
+                      'upload_id': upload_id, 'part_size': part_size})
+        self._multipart[key] = (upload_id, part_size, {})
+
+    def part_done(self, key, part_number, etag):
+        self._record({'type': 'part', 'id': key, 'part': part_number,
+                      'etag': etag})
+        with self._lock:
+            self._multipart[key][2][part_number] = etag
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+    def remove(self):
+        """
+        Delete the journal, once the upload is complete.
+        """
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
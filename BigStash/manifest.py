@@ -1,59 +1,343 @@
 from __future__ import unicode_literals, print_function
 import os
-import hashlib
+import stat
 import logging
+import threading
+import math
+import calendar
+import binascii
 import collections
 import os.path
+import posixpath
 import six
+from array import array
 from datetime import datetime
 from cached_property import cached_property
 from functools import partial
 from BigStash import filename, models
-from six.moves import filter, map
+from BigStash.digest import md5_file, CHUNK_SIZE
+from BigStash.parallel import imap_ordered, get_executor
+from BigStash.walk import walk
+from six import moves
+from six.moves import map
 from itertools import starmap, chain
 
 
 log = logging.getLogger('bigstash.manifest')
 
+_local = threading.local()
+
+
+def _hash_entry(entry):
+    # module level so that it can be pickled for process pools
+    path, st, md5 = entry
+    if md5 is None:
+        if not hasattr(_local, 'buf'):
+            _local.buf = bytearray(CHUNK_SIZE)
+        md5 = md5_file(path, buf=_local.buf)
+    return (path, st, md5)
+
+
+try:
+    array('q')
+    _INT64 = 'q'
+except ValueError:
+    # no long long arrays before python 3.3, doubles are exact up to 2**53
+    _INT64 = 'd'
+
+_DIGEST_SIZE = 16
+
+_NO_DIGEST = bytes(bytearray(_DIGEST_SIZE))
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return (calendar.timegm(value.utctimetuple()) +
+                value.microsecond / 1000000.0)
+    return value
+
+
+def _split_dir(path):
+    drive, path = os.path.splitdrive(path)
+    return [drive] + filename.splitpath(path)
+
+
+def _join_dir(parts):
+    drive, parts = parts[0], parts[1:]
+    return drive + os.path.join(*parts) if parts else drive
+
+
+def _common_length(a, b):
+    common = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        common += 1
+    return common
+
+
+class FileStore(object):
+    """
+    Column oriented storage of manifest file records. Directory names are
+    interned, and sizes, modification times and digests are held in
+    compact arrays, which takes a fraction of the memory of one
+    :class:`models.File` per file.
+    """
+
+    def __init__(self):
+        self.dirs = []
+        self._dir_ids = {}
+        self.dir_ids = array('l')
+        self.names = []
+        self.sizes = array(_INT64)
+        self.mtimes = array('d')
+        self.digests = bytearray()
+        self.missing_digests = set()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _intern_dir(self, path):
+        try:
+            return self._dir_ids[path]
+        except KeyError:
+            i = self._dir_ids[path] = len(self.dirs)
+            self.dirs.append(path)
+            return i
+
+    def append(self, path, size, mtime, md5):
+        """
+        Add a record and return its row number. Check `len(store.dirs)` to
+        find out if the record added a new directory.
+        """
+        head, tail = os.path.split(path)
+        self.dir_ids.append(self._intern_dir(head))
+        self.names.append(tail)
+        self.sizes.append(size)
+        self.mtimes.append(float('nan') if mtime is None else mtime)
+        if md5 is None:
+            self.missing_digests.add(len(self.names) - 1)
+            self.digests.extend(_NO_DIGEST)
+        else:
+            self.digests.extend(binascii.unhexlify(md5))
+        return len(self.names) - 1
+
+    def set_md5(self, row, md5):
+        offset = row * _DIGEST_SIZE
+        if md5 is None:
+            self.missing_digests.add(row)
+            self.digests[offset:offset+_DIGEST_SIZE] = _NO_DIGEST
+        else:
+            self.missing_digests.discard(row)
+            self.digests[offset:offset+_DIGEST_SIZE] = binascii.unhexlify(md5)
+
+    def path(self, row):
+        return os.path.join(self.dirs[self.dir_ids[row]], self.names[row])
+
+    def size(self, row):
+        return int(self.sizes[row])
+
+    def mtime(self, row):
+        mtime = self.mtimes[row]
+        return None if math.isnan(mtime) else mtime
+
+    def md5(self, row):
+        if row in self.missing_digests:
+            return None
+        offset = row * _DIGEST_SIZE
+        return binascii.hexlify(
+            bytes(self.digests[offset:offset+_DIGEST_SIZE])).decode('ascii')
+
+
+class ManifestEntry(object):
+    """
+    A lightweight view of a file in a :class:`Manifest`.
+    """
+    __slots__ = ('_manifest', '_row', 'id')
+
+    _slots = ['id', 'original_path', 'size', 'last_modified', 'md5', 'path']
+
+    def __init__(self, manifest, row, id):
+        self._manifest = manifest
+        self._row = row
+        self.id = id
+
+    @property
+    def original_path(self):
+        return self._manifest._store.path(self._row)
+
+    @property
+    def size(self):
+        return self._manifest._store.size(self._row)
+
+    @property
+    def mtime(self):
+        return self._manifest._store.mtime(self._row)
+
+    @property
+    def last_modified(self):
+        mtime = self._manifest._store.mtime(self._row)
+        if mtime is None:
+            return None
+        return datetime.fromtimestamp(mtime, tz=models.utc)
+
+    @property
+    def md5(self):
+        return self._manifest._store.md5(self._row)
+
+    @property
+    def path(self):
+        return self._manifest._relative_path(self._row)
+
+    def items(self):
+        for slot in self._slots:
+            yield (slot, getattr(self, slot))
+
+    def __repr__(self):
+        return "<ManifestEntry {}: {}>".format(self.id, self.original_path)
+
 
 class Manifest(models.ModelBase, collections.MutableMapping):
-    def __init__(self, files=None, title=None, *args, **kwargs):
+    def __init__(self, files=None, title=None, base=None, *args, **kwargs):
+        """
+        :param files: optional :class:`models.File` objects to add
+        :param title: optional manifest title
+        :param base: optional directory containing all files, by default
+            the common directory of the files added
+        """
         super(Manifest, self).__init__(
             size=0, *args, **kwargs)
-        self._base = None
+        # the common directory of all files, as a list of components
+        self._base_parts = None
+        # a base given up front doesn't change as files are added, so the
+        # paths of files already added are final
+        self._fixed_base = base is not None
+        if base is not None:
+            self._base_parts = _split_dir(os.path.abspath(base))
+        # posix paths of each interned directory relative to the base
+        self._reldirs = []
         self._slots.append('source')
-        self._store = dict()
+        self._store = FileStore()
+        # maps keys to rows, None while keys are 1, 2, 3.. in row order
+        self._index = None
         self._slots.append('title')
         self._title = title
         self._slots.append('files')
-        for i, f in enumerate(files, start=1):
+        for i, f in enumerate(files or (), start=1):
             self[i] = f
 
+    def _row(self, key):
+        if self._index is not None:
+            return self._index[key]
+        if (isinstance(key, six.integer_types) and
+                0 < key <= len(self._store)):
+            return key - 1
+        raise KeyError(key)
+
+    def _materialize_index(self):
+        if self._index is None:
+            self._index = dict(
+                (row + 1, row) for row in range(len(self._store)))
+
     def __getitem__(self, key):
-        return models.ManifestFile(
-            base=self._base, id=key, **dict(self._store[key].items()))
+        return ManifestEntry(self, self._row(key), key)
 
     def __delitem__(self, key):
-        del self._store[key]
+        row = self._row(key)
+        self._materialize_index()
+        del self._index[key]
+        self.size -= self._store.size(row)
+
+    def __contains__(self, key):
+        try:
+            self._row(key)
+            return True
+        except KeyError:
+            return False
 
     def __setitem__(self, key, value):
         if not isinstance(value, models.File):
             raise ValueError("Manifest values must be File objects")
-        if key in self._store:
+        if key in self:
             raise ValueError("Manifest values can only be written once")
-        self.size += value.size
-        if self._base is None:
-            self._base = value.original_path
-        self._base = os.path.dirname(
-            os.path.commonprefix([self._base, value.original_path]))
-        self._store[key] = value
+        self._add(value.original_path, value.size,
+                  _timestamp(getattr(value, 'last_modified', None)),
+                  getattr(value, 'md5', None), key)
+
+    def _add(self, path, size, mtime, md5, key=None):
+        if key is None:
+            key = len(self._store) + 1
+        if self._index is None and key != len(self._store) + 1:
+            self._materialize_index()
+        self.size += size
+        ndirs = len(self._store.dirs)
+        row = self._store.append(path, size, mtime, md5)
+        if len(self._store.dirs) > ndirs:
+            self._add_dir(self._store.dirs[-1])
+        if self._index is not None:
+            self._index[key] = row
+        return key
+
+    def _update_base(self, dirname):
+        """
+        Shorten the base to a directory of `dirname`, returns True if it
+        changed.
+        """
+        if self._fixed_base:
+            return False
+        parts = _split_dir(dirname)
+        if self._base_parts is None:
+            self._base_parts = parts
+            return True
+        common = _common_length(self._base_parts, parts)
+        if common < len(self._base_parts):
+            self._base_parts = self._base_parts[:common]
+            return True
+        return False
+
+    def _reldir(self, dirname):
+        return posixpath.join(
+            *_split_dir(dirname)[len(self._base_parts):] or [''])
+
+    def _add_dir(self, dirname):
+        # relative directories are converted here, by the thread adding
+        # files, as upload threads read paths while files are added
+        if self._update_base(dirname):
+            self._reldirs = [self._reldir(d) for d in self._store.dirs]
+        else:
+            self._reldirs.append(self._reldir(dirname))
+
+    def _relative_path(self, row):
+        store = self._store
+        reldir = self._reldirs[store.dir_ids[row]]
+        name = store.names[row]
+        return posixpath.join(reldir, name) if reldir else name
+
+    @property
+    def _base(self):
+        if self._base_parts is None:
+            return None
+        return _join_dir(self._base_parts)
+
+    def set_md5(self, key, md5):
+        """
+        Replace the digest of a file, once it is known or if it changed.
+        """
+        self._store.set_md5(self._row(key), md5)
+
+    def keys(self):
+        if self._index is None:
+            return moves.range(1, len(self._store) + 1)
+        return self._index.keys()
 
     def __iter__(self):
-        for k in self._store.keys():
+        for k in self.keys():
             yield self[k]
 
     def __len__(self):
-        return len(self._store)
+        if self._index is None:
+            return len(self._store)
+        return len(self._index)
 
     @property
     def base(self):
@@ -77,52 +361,136 @@ class Manifest(models.ModelBase, collections.MutableMapping):
         return list(self)
 
     @classmethod
-    def from_paths(cls, paths, title=''):
+    def from_paths(cls, paths, title='', workers=None, processes=False,
+                   cache=None, hashing=True):
+        """
+        Build a manifest from a list of files and directories. Returns a
+        (manifest, errors, ignored) tuple.
+
+        :param paths: files and directories to include
+        :param title: optional manifest title
+        :param workers: number of files to hash concurrently
+        :param processes: hash in a process pool instead of a thread pool
+        :param cache: optional :class:`DigestCache` of previous digests
+        :param hashing: hash files that aren't cached, or leave their digest
+            empty
+        """
         errors = []
-        ignored_files = []
+        ignored = []
+        manifest = cls(title=title)
+        for path, st, md5 in scan(paths, errors, ignored, workers=workers,
+                                  processes=processes, cache=cache,
+                                  hashing=hashing):
+            manifest._add(path, st.st_size, st.st_mtime, md5)
+        return (manifest, errors, ignored)
 
-        def ignored(path, reason, *args):
-            ignored_files.append((path, reason))
-            log.debug("Ignoring {}: {}".format(path, reason))
-            return True
 
-        def invalid(path, reason, *args):
-            errors.append((path, reason))
-            log.debug("Invalid file {}: {}".format(path, reason))
-            return True
+def common_dir(paths):
+    """
+    Return the directory that contains all files found under `paths`, the
+    base of the paths in a manifest built from them.
+    """
+    parts = None
+    for path in map(os.path.abspath, paths):
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+        path = _split_dir(path)
+        if parts is None:
+            parts = path
+        else:
+            del parts[_common_length(parts, path):]
+    return None if parts is None else _join_dir(parts)
+
+
+def scan(paths, errors, ignored_files, workers=None, processes=False,
+         cache=None, hashing=True):
+    """
+    Find and hash the files under `paths`, yielding a (path, stat, md5)
+    tuple for each file to include, in a stable order. Invalid and ignored
+    files are appended to `errors` and `ignored_files` as (path, reason)
+    tuples.
+
+    :param paths: files and directories to include
+    :param errors: list to append invalid files to
+    :param ignored_files: list to append ignored files to
+    :param workers: number of files to hash concurrently
+    :param processes: hash in a process pool instead of a thread pool
+    :param cache: optional :class:`DigestCache` of previous digests
+    :param hashing: hash files that aren't cached, or leave their digest None
+    """
+    def ignored(path, reason, *args):
+        ignored_files.append((path, reason))
+        log.debug("Ignoring {}: {}".format(path, reason))
+        return True
+
+    def invalid(path, reason, *args):
+        errors.append((path, reason))
+        log.debug("Invalid file {}: {}".format(path, reason))
+        return True
+
+    validators = {
+        ignored: filename.should_ignore(),
+        invalid: filename.is_invalid()
+    }
+
+    def _include(path, st=None, components=None):
+        validations = [starmap(partial(c, path), v(path, st, components))
+                       for c, v in six.iteritems(validators)]
+
+        return not any(chain(*validations))
+
+    path_validator = filename.should_ignore_path()
+
+    def _include_relpath(path, relpath, is_dir=False):
+        validations = starmap(
+            partial(ignored, path), path_validator(relpath, is_dir))
+        return not any(validations)
+
+    def _include_entry(root, path, st=None):
+        # parent directories have already been validated
+        if not _include(path, st, [os.path.basename(path)]):
+            return False
+        relpath = path[len(root):].lstrip(os.sep)
+        if os.sep != posixpath.sep:
+            relpath = relpath.replace(os.sep, posixpath.sep)
+        return _include_relpath(path, relpath, st is None)
+
+    def _walk_dirs(paths):
+        for path in map(os.path.abspath, paths):
+            try:
+                st = os.stat(path)
+            except OSError:
+                invalid(path, "File doesn't exist")
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                if not _include(path):
+                    continue
+                include = partial(_include_entry, path)
+                for p, st in walk(path, include_dir=include):
+                    if include(p, st):
+                        yield (p, st)
+            elif (_include(path, st) and
+                    _include_relpath(path, os.path.basename(path))):
+                yield (path, st)
+
+    def _lookup(path, st):
+        md5 = cache.get(st) if cache is not None else None
+        return (path, st, md5)
+
+    def _hashed(path, st, md5):
+        if cache is not None and md5 is not None:
+            cache.set(st, md5)
+        return (path, st, md5)
+
+    entries = starmap(_lookup, _walk_dirs(paths))
 
-        validators = {
-            ignored: filename.should_ignore(),
-            invalid: filename.is_invalid()
-        }
-
-        def _include_file(path):
-            if not os.path.exists(path):
-                return invalid(path, "File doesn't exist")
-            validations = [starmap(partial(c, path), v(path))
-                           for c, v in six.iteritems(validators)]
-
-            return not any(chain(*validations))
-
-        def _walk_dirs(paths):
-            for path in paths:
-                if os.path.isdir(path):
-                    for r, _, files in os.walk(path):
-                        absfiles = (os.path.abspath(os.path.join(r, p))
-                                    for p in files)
-                        for p in filter(_include_file, absfiles):
-                            yield p
-                else:
-                    path = os.path.abspath(path)
-                    if _include_file(path):
-                        yield path
-
-        def _tofile(path):
-            return models.File(
-                original_path=path, size=os.path.getsize(path),
-                last_modified=os.path.getmtime(path),
-                md5=hashlib.md5(open(path, 'rb').read()).hexdigest())
-
-        files = map(_tofile, map(os.path.abspath, _walk_dirs(paths)))
-
-        return (cls(title=title, files=files), errors, ignored_files)
+    if not hashing:
+        for entry in entries:
+            yield _hashed(*entry)
+    elif not workers or workers < 2:
+        for entry in map(_hash_entry, entries):
+            yield _hashed(*entry)
+    else:
+        with get_executor(workers, processes) as executor:
+            for entry in imap_ordered(executor, _hash_entry, entries):
+                yield _hashed(*entry)
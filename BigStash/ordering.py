@@ -0,0 +1,120 @@
+"""
+Orders in which the upload scheduler sends the files of a manifest.
+
+Each ordering is a function taking an iterable of manifest entries and
+returning them as a list, in the order to upload them.
+"""
+import os
+import sys
+import array
+import struct
+import logging
+
+log = logging.getLogger('bigstash.ordering')
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# FS_IOC_FIEMAP, _IOWR('f', 11, struct fiemap), Linux only
+FS_IOC_FIEMAP = 0xC020660B
+
+# struct fiemap, followed by a single struct fiemap_extent
+_FIEMAP = struct.Struct('=QQLLLL')
+_FIEMAP_EXTENT = struct.Struct('=QQQQQLLLL')
+
+# extents not yet allocated, like those of recently written files on file
+# systems with delayed allocation, have no meaningful offset
+FIEMAP_EXTENT_UNKNOWN = 0x2
+FIEMAP_EXTENT_DELALLOC = 0x4
+
+
+def manifest_order(files):
+    """
+    The order the files were added to the manifest in.
+    """
+    return list(files)
+
+
+def largest_first(files):
+    """
+    Largest files first, so that a big file found last doesn't keep
+    uploading alone after every other worker is done.
+    """
+    return sorted(files, key=lambda f: f.size, reverse=True)
+
+
+def _inode(f):
+    try:
+        st = os.stat(f.original_path)
+    except OSError:
+        return (0, 0)
+    return (st.st_dev, st.st_ino)
+
+
+def by_inode(files):
+    """
+    Files by device and inode number, which on most file systems roughly
+    follows where their data is on disk, to reduce seeking on spinning
+    disks.
+    """
+    return sorted(files, key=_inode)
+
+
+def physical_offset(path):
+    """
+    Return the offset on disk of the first extent of the file at `path`,
+    or None if the file system doesn't tell.
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return None
+    # Python 2 only takes a mutable buffer for ioctl from an array
+    buf = array.array('B', [0] * (_FIEMAP.size + _FIEMAP_EXTENT.size))
+    # map the whole file, asking for one extent
+    _FIEMAP.pack_into(buf, 0, 0, 2 ** 64 - 1, 0, 0, 1, 0)
+    try:
+        with open(path, 'rb') as fp:
+            fcntl.ioctl(fp.fileno(), FS_IOC_FIEMAP, buf, True)
+    except (IOError, OSError):
+        log.debug("no extents for {}".format(path), exc_info=True)
+        return None
+    mapped = _FIEMAP.unpack_from(buf, 0)[3]
+    if not mapped:
+        return None
+    extent = _FIEMAP_EXTENT.unpack_from(buf, _FIEMAP.size)
+    if extent[5] & (FIEMAP_EXTENT_UNKNOWN | FIEMAP_EXTENT_DELALLOC):
+        return None
+    return extent[1]
+
+
+def by_extent(files):
+    """
+    Files by where their first extent is on disk, where the file system
+    can tell, and by inode after those where it can't.
+    """
+    def key(f):
+        dev, ino = _inode(f)
+        offset = physical_offset(f.original_path)
+        if offset is None:
+            return (dev, 1, ino)
+        return (dev, 0, offset)
+    return sorted(files, key=key)
+
+
+ORDERINGS = {
+    'manifest': manifest_order,
+    'largest': largest_first,
+    'inode': by_inode,
+    'extent': by_extent,
+}
+
+
+def get_ordering(name):
+    """
+    Return the ordering function called `name`.
+    """
+    try:
+        return ORDERINGS[name]
+    except KeyError:
+        raise ValueError("Unknown upload order: {}".format(name))
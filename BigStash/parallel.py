@@ -0,0 +1,217 @@
+import sys
+import threading
+import collections
+from concurrent import futures
+from six import reraise
+from six.moves import queue
+
+# items of each lane :func:`imap_routed` reads ahead of the calls
+ROUTE_BUFFER = 10000
+
+
+def imap_ordered(executor, fn, iterable, window=None):
+    """
+    Like `map(fn, iterable)` but calls `fn` concurrently on `executor`.
+
+    Results are yielded in input order. At most `window` calls are
+    pending at any time, so `iterable` is consumed lazily and can be
+    arbitrarily long.
+    """
+    if window is None:
+        window = 2 * getattr(executor, '_max_workers', 1)
+    pending = collections.deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for f in pending:
+            f.cancel()
+
+
+def imap_unordered(executor, fn, iterable, window=None):
+    """
+    Call `fn` concurrently on `executor` for each item of `iterable`,
+    keeping at most `window` calls pending, and yield an
+    (item, result, exception) tuple for each call as it completes.
+    """
+    if window is None:
+        window = getattr(executor, '_max_workers', 1)
+    return imap_lanes([(executor, fn, iterable, window)])
+
+
+def imap_lanes(lanes):
+    """
+    Like :func:`imap_unordered` for several (executor, fn, iterable,
+    window) lanes at once, each with its own limit of pending calls.
+    Results from all lanes are yielded as they complete. A window can be
+    a function, to change the limit while the calls are running.
+    """
+    lanes = [(executor, fn, iter(iterable), window, set())
+             for executor, fn, iterable, window in lanes]
+    pending = {}
+    try:
+        while True:
+            for executor, fn, iterator, window, running in lanes:
+                if callable(window):
+                    window = window()
+                while len(running) < window:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                    f = executor.submit(fn, item)
+                    running.add(f)
+                    pending[f] = (item, running)
+            if not pending:
+                return
+            done, _ = futures.wait(
+                pending, return_when=futures.FIRST_COMPLETED)
+            for f in done:
+                item, running = pending.pop(f)
+                running.discard(f)
+                if f.exception() is not None:
+                    yield (item, None, f.exception())
+                else:
+                    yield (item, f.result(), None)
+    finally:
+        for f in pending:
+            f.cancel()
+
+
+def imap_routed(iterable, route, lanes, buffer=ROUTE_BUFFER):
+    """
+    Like :func:`imap_lanes` for a single `iterable`, whose items go to the
+    (executor, fn, window) lane at the index `route(item)` returns.
+
+    The iterable is consumed by a separate thread into a queue of at most
+    `buffer` items per lane, so that a lane never waits for the next item
+    of another lane, and results are yielded while the iterable blocks.
+    Exceptions raised by `iterable` are raised again in the caller.
+    """
+    lock = threading.Condition()
+    queues = [collections.deque() for _ in lanes]
+    state = {'arrival': futures.Future(), 'done': False, 'exc_info': None,
+             'closed': False}
+
+    def produce():
+        try:
+            for item in iterable:
+                q = queues[route(item)]
+                with lock:
+                    while len(q) >= buffer and not state['closed']:
+                        lock.wait()
+                    if state['closed']:
+                        return
+                    q.append(item)
+                    if not state['arrival'].done():
+                        state['arrival'].set_result(None)
+        except BaseException:
+            state['exc_info'] = sys.exc_info()
+        with lock:
+            state['done'] = True
+            if not state['arrival'].done():
+                state['arrival'].set_result(None)
+
+    t = threading.Thread(target=produce)
+    t.daemon = True
+    t.start()
+    lanes = [(executor, fn, window, q, set())
+             for (executor, fn, window), q in zip(lanes, queues)]
+    pending = {}
+    try:
+        while True:
+            with lock:
+                for executor, fn, window, q, running in lanes:
+                    if callable(window):
+                        window = window()
+                    while q and len(running) < window:
+                        item = q.popleft()
+                        f = executor.submit(fn, item)
+                        running.add(f)
+                        pending[f] = (item, running)
+                lock.notify()
+                arrival = state['arrival']
+                if arrival.done():
+                    arrival = state['arrival'] = futures.Future()
+                finished = state['done'] and not any(queues)
+            if finished and not pending:
+                if state['exc_info'] is not None:
+                    reraise(*state['exc_info'])
+                return
+            wait = list(pending) if finished else list(pending) + [arrival]
+            done, _ = futures.wait(wait, return_when=futures.FIRST_COMPLETED)
+            for f in done:
+                if f is arrival:
+                    continue
+                item, running = pending.pop(f)
+                running.discard(f)
+                if f.exception() is not None:
+                    yield (item, None, f.exception())
+                else:
+                    yield (item, f.result(), None)
+    finally:
+        for f in pending:
+            f.cancel()
+        with lock:
+            state['closed'] = True
+            lock.notify()
+        t.join()
+
+
+class _Stop(object):
+    def __init__(self, exc_info=None):
+        self.exc_info = exc_info
+
+
+def background(iterable, maxsize):
+    """
+    Consume `iterable` in a separate thread, yielding its items through a
+    queue of at most `maxsize` items, so that producing the next items
+    overlaps with the caller's work on the previous ones. Exceptions
+    raised by `iterable` are raised again in the caller.
+    """
+    items = queue.Queue(maxsize)
+    closed = threading.Event()
+
+    def put(item):
+        while not closed.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_Stop())
+        except BaseException:
+            put(_Stop(sys.exc_info()))
+
+    t = threading.Thread(target=produce)
+    t.daemon = True
+    t.start()
+    try:
+        while True:
+            item = items.get()
+            if isinstance(item, _Stop):
+                if item.exc_info is not None:
+                    reraise(*item.exc_info)
+                return
+            yield item
+    finally:
+        closed.set()
+        t.join()
+
+
+def get_executor(workers, processes=False):
+    if processes:
+        return futures.ProcessPoolExecutor(max_workers=workers)
+    return futures.ThreadPoolExecutor(max_workers=workers)
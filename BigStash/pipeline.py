@@ -0,0 +1,175 @@
+import sys
+import logging
+import threading
+from six import reraise, iteritems
+from six.moves import queue
+from BigStash.parallel import background
+from BigStash.journal import TransferJournal
+
+log = logging.getLogger('bigstash.pipeline')
+
+DEFAULT_BATCH_SIZE = 1000
+
+DEFAULT_QUEUE_SIZE = 2000
+
+_DONE = object()
+
+
+def correct_digests(api, upload, manifest, digests,
+                    batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Update the manifest, locally and with the API, with the digests
+    computed while uploading, for files that were registered without a
+    digest or with a different one. Returns the files updated.
+
+    :param api: a :class:`BigStashAPI` instance
+    :param upload: the upload the manifest was registered with
+    :param manifest: the :class:`Manifest` of the upload
+    :param digests: a dict of md5 digests keyed by manifest id
+    :param batch_size: number of files to update at a time
+    """
+    changed = []
+    for key, md5 in iteritems(digests):
+        if manifest[key].md5 != md5:
+            manifest.set_md5(key, md5)
+            changed.append(manifest[key])
+    for i in range(0, len(changed), batch_size):
+        api.UpdateUploadFiles(upload, changed[i:i + batch_size])
+    return changed
+
+
+class StreamingUpload(object):
+    """
+    Uploads files while the rest are still being scanned and hashed, so
+    that reading the disk and sending to S3 overlap instead of taking
+    turns. The work is split in three stages joined by bounded queues:
+
+    1. finding and hashing files (see :func:`manifest.scan`) in a
+       background thread
+    2. adding them to the manifest and registering them with the API in
+       batches, the first one with `CreateUpload` and the rest with
+       `UpdateUploadFiles`
+    3. uploading registered files with an :class:`UploadScheduler`, in
+       another thread
+
+    Paths in the manifest must not change once files are registered, so
+    the manifest should be created with a fixed `base`.
+
+    Since files are uploaded before all of them are found, an `ordering`
+    function from :mod:`BigStash.ordering` only orders the files of each
+    batch.
+    """
+
+    def __init__(self, api, manifest, scheduler_factory, settings=None,
+                 progress=None, batch_size=DEFAULT_BATCH_SIZE,
+                 queue_size=DEFAULT_QUEUE_SIZE, ordering=None):
+        """
+        :param api: a :class:`BigStashAPI` instance
+        :param manifest: an empty :class:`Manifest` with a fixed base
+        :param scheduler_factory: called with the upload and its journal
+            to create the :class:`UploadScheduler`
+        :param settings: optional settings to keep a transfer journal in
+        :param progress: optional :class:`UploadProgress` to notify of
+            each batch of registered files
+        :param batch_size: number of files to register at a time
+        :param queue_size: maximum number of files waiting between stages
+        :param ordering: optional function to order each batch with
+        """
+        self.api = api
+        self.manifest = manifest
+        self.scheduler_factory = scheduler_factory
+        self.settings = settings
+        self.progress = progress
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.ordering = ordering
+        self.upload = None
+        self.journal = None
+        self.scheduler = None
+        self.failures = []
+        self._registered = queue.Queue(queue_size)
+        self._uploader = None
+        self._exc_info = None
+
+    def _register(self, batch):
+        if self.upload is None:
+            self.upload = self.api.CreateUpload(manifest=self.manifest)
+            if self.settings is not None:
+                self.journal = TransferJournal.create(
+                    self.settings, self.upload, self.manifest,
+                    scanning=True)
+            self._uploader = threading.Thread(target=self._upload)
+            self._uploader.daemon = True
+            self._uploader.start()
+        else:
+            self.api.UpdateUploadFiles(self.upload, batch)
+            if self.journal is not None:
+                self.journal.add_files(batch)
+        if self.progress is not None:
+            self.progress.queued(batch)
+        if self.ordering is not None:
+            batch = self.ordering(batch)
+        for f in batch:
+            self._put(f)
+
+    def _put(self, item):
+        while True:
+            if not self._uploader.is_alive():
+                self._raise()
+                return
+            try:
+                self._registered.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _raise(self):
+        if self._exc_info is not None:
+            reraise(*self._exc_info)
+
+    def _registered_files(self):
+        while True:
+            f = self._registered.get()
+            if f is _DONE:
+                return
+            yield f
+
+    def _upload(self):
+        try:
+            self.scheduler = self.scheduler_factory(self.upload, self.journal)
+            self.failures = self.scheduler.run(self._registered_files())
+        except BaseException:
+            self._exc_info = sys.exc_info()
+
+    def run(self, entries, errors=()):
+        """
+        Add, register and upload the files of `entries`, the (path, stat,
+        md5) tuples of :func:`manifest.scan`. Stops early, letting the
+        files already registered finish uploading, if anything is
+        appended to `errors`. Returns a list of (file, exception) tuples
+        for the files that failed to upload.
+        """
+        batch = []
+        try:
+            for path, st, md5 in background(entries, self.queue_size):
+                if errors:
+                    break
+                key = self.manifest._add(path, st.st_size, st.st_mtime, md5)
+                batch.append(self.manifest[key])
+                if len(batch) >= self.batch_size:
+                    self._register(batch)
+                    batch = []
+            if batch and not errors:
+                self._register(batch)
+            if self.journal is not None and not errors:
+                # a resumed upload can't be finished without all its files
+                self.journal.scan_done()
+        finally:
+            if self._uploader is not None:
+                if self._uploader.is_alive():
+                    self._put(_DONE)
+                self._uploader.join()
+            if self.journal is not None:
+                self.journal.close()
+        self._raise()
+        return self.failures
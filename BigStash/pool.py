@@ -0,0 +1,157 @@
+from __future__ import division
+import time
+import threading
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.poolmanager import PoolManager
+from requests.packages.urllib3.util.retry import Retry
+
+# seconds to back off by between connection attempts, doubling each time
+CONNECT_BACKOFF = 0.25
+
+
+class PoolStats(object):
+    """
+    Counters of the connections to the API, shared by the clients of a
+    pool.
+    """
+
+    def __init__(self):
+        # connections taken from the pools, one per request
+        self.requests = 0
+        # new connections opened
+        self.connections = 0
+        # requests that waited for a connection to be returned to a full
+        # pool, and the seconds they waited altogether
+        self.waits = 0
+        self.wait_time = 0.0
+        # connections closed because the pool already had as many idle
+        self.discarded = 0
+        self._lock = threading.Lock()
+
+    def _add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def reuse_ratio(self):
+        """
+        The share of requests that went over a connection opened for an
+        earlier one, None before any requests.
+        """
+        if not self.requests:
+            return None
+        return max(self.requests - self.connections, 0) / self.requests
+
+    def __repr__(self):
+        return ('<PoolStats requests={} connections={} waits={} '
+                'wait_time={:.3f} discarded={}>'.format(
+                    self.requests, self.connections, self.waits,
+                    self.wait_time, self.discarded))
+
+
+def _instrument(pool, stats):
+    """
+    Count the connections `pool` hands out, opens, waits for and discards.
+    """
+    get_conn = pool._get_conn
+    put_conn = pool._put_conn
+    new_conn = pool._new_conn
+
+    def _get_conn(timeout=None):
+        # the queue is empty only once maxsize connections are in use
+        if not (pool.block and pool.pool is not None and pool.pool.empty()):
+            stats._add(requests=1)
+            return get_conn(timeout)
+        start = time.time()
+        try:
+            return get_conn(timeout)
+        finally:
+            stats._add(requests=1, waits=1, wait_time=time.time() - start)
+
+    def _put_conn(conn):
+        if pool.pool is not None and pool.pool.full():
+            stats._add(discarded=1)
+        return put_conn(conn)
+
+    def _new_conn():
+        stats._add(connections=1)
+        return new_conn()
+
+    pool._get_conn, pool._put_conn, pool._new_conn = \
+        _get_conn, _put_conn, _new_conn
+
+
+class _PoolManager(PoolManager):
+    def __init__(self, stats, *args, **kwargs):
+        self.stats = stats
+        super(_PoolManager, self).__init__(*args, **kwargs)
+
+    def connection_from_host(self, *args, **kwargs):
+        pool = super(_PoolManager, self).connection_from_host(
+            *args, **kwargs)
+        if not getattr(pool, '_instrumented', False):
+            _instrument(pool, self.stats)
+            pool._instrumented = True
+        return pool
+
+
+class APIConnectionPool(HTTPAdapter):
+    """
+    Connection pools to the API, with default timeouts, retries of
+    failed connection attempts and :class:`PoolStats` of their use. Pass
+    the same instance to several clients to share their connections.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, connect_timeout=None, read_timeout=None,
+                 connect_retries=0):
+        """
+        :param pool_connections: the number of hosts to keep pools for
+        :param pool_maxsize: idle connections to keep to each host
+        :param pool_block: wait for a connection to be returned instead of
+            opening more than `pool_maxsize` to a host
+        :param connect_timeout: seconds to wait for a connection, None to
+            wait forever
+        :param read_timeout: seconds to wait for the server to send
+            anything, None to wait forever
+        :param connect_retries: times to retry failed connection attempts
+        """
+        self.stats = PoolStats()
+        self.timeout = None
+        if connect_timeout is not None or read_timeout is not None:
+            self.timeout = (connect_timeout, read_timeout)
+        # requests that failed after they were sent are not retried, they
+        # may not be idempotent
+        retries = Retry(total=connect_retries, connect=connect_retries,
+                        read=0, backoff_factor=CONNECT_BACKOFF)
+        super(APIConnectionPool, self).__init__(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            pool_block=pool_block, max_retries=retries)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Create a pool as configured by a :class:`BigStashAPISettings`.
+        """
+        return cls(pool_connections=settings['api_pool_connections'],
+                   pool_maxsize=settings['api_pool_maxsize'],
+                   pool_block=bool(settings['api_pool_block']),
+                   connect_timeout=settings['api_connect_timeout'],
+                   read_timeout=settings['api_read_timeout'],
+                   connect_retries=settings['api_connect_retries'] or 0)
+
+    def init_poolmanager(self, connections, maxsize, block=False,
+                         **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _PoolManager(
+            self.stats, num_pools=connections, maxsize=maxsize, block=block,
+            **pool_kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super(APIConnectionPool, self).send(
+            request, timeout=timeout, **kwargs)
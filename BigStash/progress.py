@@ -0,0 +1,256 @@
+from __future__ import division
+import sys
+import json
+import time
+import threading
+import collections
+
+# renders per second
+DEFAULT_RATE = 10
+
+# seconds over which the throughput is averaged
+RATE_WINDOW = 5.0
+
+
+class UploadProgress(object):
+    """
+    Receives progress notifications from an :class:`UploadScheduler`. The
+    methods may be called from several threads at once.
+    """
+
+    def queued(self, files):
+        """
+        Called with more files to expect, when they are added after the
+        upload has started.
+        """
+        pass
+
+    def start(self, f):
+        pass
+
+    def update(self, f, bytes_amount):
+        pass
+
+    def done(self, f, error=None):
+        pass
+
+
+def format_size(size):
+    for unit in ('', 'K', 'M', 'G', 'T'):
+        if size < 1024:
+            break
+        size /= 1024.0
+    return '{:.1f}{}'.format(size, unit) if unit else '{:.0f}'.format(size)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+class ShardedCounter(object):
+    """
+    A counter that threads add to without contending for a lock: each
+    thread adds to a shard of its own, and reading the value sums them.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [0]
+            with self._lock:
+                self._shards.append(shard)
+        # only this thread ever writes to its shard
+        shard[0] += n
+
+    @property
+    def value(self):
+        return sum(shard[0] for shard in list(self._shards))
+
+
+class ProgressReporter(UploadProgress):
+    """
+    Collects the progress of an :class:`UploadScheduler` and renders it
+    `rate` times a second from a thread of its own, so that the upload
+    threads only add to counters however often they report.
+
+    Call :meth:`close` when the upload is over, to render a last time.
+    """
+
+    def __init__(self, renderer, files=0, size=0, rate=DEFAULT_RATE,
+                 clock=time.time):
+        """
+        :param renderer: a :class:`TextRenderer` or
+            :class:`JsonLinesRenderer`
+        :param files: the number of files to upload
+        :param size: the total size of the files
+        :param rate: renders per second
+        :param clock: function returning the current time in seconds
+        """
+        self.renderer = renderer
+        self.files_total = files
+        self.bytes_total = size
+        self.current = None
+        self._bytes = ShardedCounter()
+        self._done = ShardedCounter()
+        self._failed = ShardedCounter()
+        self._events = collections.deque()
+        self._clock = clock
+        self._started = clock()
+        self._samples = collections.deque([(self._started, 0)])
+        self._interval = 1.0 / rate
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def queued(self, files):
+        for f in files:
+            self.files_total += 1
+            self.bytes_total += f.size
+
+    def start(self, f):
+        self.current = f
+
+    def update(self, f, bytes_amount):
+        self._bytes.add(bytes_amount)
+
+    def done(self, f, error=None):
+        if error is None:
+            self._done.add()
+        else:
+            self._failed.add()
+        self._events.append((f, error))
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.render()
+
+    def snapshot(self):
+        """
+        Return the progress so far as a dict.
+        """
+        now = self._clock()
+        sent = self._bytes.value
+        samples = self._samples
+        samples.append((now, sent))
+        while len(samples) > 2 and now - samples[1][0] >= RATE_WINDOW:
+            samples.popleft()
+        elapsed = now - samples[0][0]
+        rate = None
+        if elapsed > 0:
+            rate = max(sent - samples[0][1], 0) / elapsed
+        remaining = max(self.bytes_total - sent, 0)
+        eta = None
+        if rate:
+            eta = remaining / rate
+        elif not remaining:
+            eta = 0
+        current = self.current
+        return {
+            'files_done': self._done.value,
+            'files_failed': self._failed.value,
+            'files_total': self.files_total,
+            'bytes': sent,
+            'bytes_total': self.bytes_total,
+            'rate': rate,
+            'eta': eta,
+            'elapsed': now - self._started,
+            'current': current.path if current is not None else None,
+        }
+
+    def render(self):
+        while self._events:
+            self.renderer.file_done(*self._events.popleft())
+        self.renderer.progress(self.snapshot())
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.render()
+        self.renderer.close(self.snapshot())
+
+
+class TextRenderer(object):
+    """
+    Renders progress as a line rewritten in place on a terminal, with a
+    line of its own for each file uploaded.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._width = 0
+
+    def _write(self, line, end=''):
+        self.stream.write(u"\r{}{}".format(line.ljust(self._width), end))
+        self.stream.flush()
+        self._width = 0 if end else len(line)
+
+    def file_done(self, f, error):
+        self._write(u"{}..{}".format(
+            f.path, "FAILED" if error else "OK"), end="\n")
+
+    def progress(self, p):
+        percentage = 100
+        if p['bytes_total'] > 0:
+            percentage = p['bytes'] / p['bytes_total'] * 100
+        rate = '?' if p['rate'] is None else format_size(p['rate'])
+        eta = '?' if p['eta'] is None else format_duration(p['eta'])
+        self._write(u"[{}/{}] {} / {} ({:.2f}%) {}/s ETA {} {}".format(
+            p['files_done'] + p['files_failed'], p['files_total'],
+            format_size(p['bytes']), format_size(p['bytes_total']),
+            percentage, rate, eta, p['current'] or ''))
+
+    def close(self, p):
+        self._write(u"{} in {}, {}/s".format(
+            format_size(p['bytes']), format_duration(p['elapsed']),
+            format_size(p['bytes'] / p['elapsed'] if p['elapsed'] else 0)),
+            end="\n")
+
+
+class JsonLinesRenderer(object):
+    """
+    Renders progress as one JSON object per line, for other programs to
+    follow. Objects have a `type` of 'progress', with the fields of
+    :meth:`ProgressReporter.snapshot`, 'file' when a file is uploaded, or
+    'summary' once at the end.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._last = None
+
+    def _write(self, obj):
+        self.stream.write(json.dumps(obj, sort_keys=True) + '\n')
+        self.stream.flush()
+
+    def file_done(self, f, error):
+        self._write({
+            'type': 'file', 'path': f.path, 'size': f.size,
+            'status': 'failed' if error else 'ok',
+            'error': None if error is None else str(error)})
+
+    def progress(self, p):
+        # don't repeat the same line while nothing happens
+        key = (p['bytes'], p['files_done'], p['files_failed'],
+               p['files_total'])
+        if key == self._last:
+            return
+        self._last = key
+        self._write(dict(p, type='progress'))
+
+    def close(self, p):
+        self._write(dict(p, type='summary'))
+
+
+RENDERERS = {
+    'text': TextRenderer,
+    'jsonl': JsonLinesRenderer,
+}
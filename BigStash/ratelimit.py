@@ -0,0 +1,186 @@
+from __future__ import division
+import re
+import time
+import threading
+from datetime import datetime
+
+_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+_RATE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*$',
+                   re.IGNORECASE)
+
+_PERIOD = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$')
+
+# the most bytes granted at a time, so that concurrent transfers take turns
+QUANTUM = 64 * 1024
+
+# seconds between checks of the schedule for a new rate
+SCHEDULE_CHECK_INTERVAL = 1.0
+
+
+def parse_rate(value):
+    """
+    Parse a rate in bytes per second, like '500k', '2M' or '1.5MB/s'.
+    Returns None for no limit.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value or None
+    m = _RATE.match(value)
+    if m is None:
+        raise ValueError("Invalid rate: {}".format(value))
+    return float(m.group(1)) * _UNITS[m.group(2).lower()] or None
+
+
+class Schedule(object):
+    """
+    Rates by time of day. A period applies from its start time up to, but
+    not including, its end time, and may wrap around midnight. The first
+    period that matches wins, and the default rate applies otherwise.
+    """
+
+    def __init__(self, periods=(), default=None):
+        """
+        :param periods: a list of (start, end, rate) tuples, with start
+            and end in minutes since midnight
+        :param default: the rate outside of the periods, None for no limit
+        """
+        self.periods = list(periods)
+        self.default = default
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Parse a schedule like '09:00-18:00=1M,10M', for 1MB/s during
+        office hours and 10MB/s the rest of the day. A plain rate is a
+        schedule with no periods.
+        """
+        if value is None or isinstance(value, (int, float)):
+            return cls(default=parse_rate(value))
+        periods = []
+        default = None
+        for item in value.split(','):
+            if '=' not in item:
+                default = parse_rate(item)
+                continue
+            period, rate = item.split('=', 1)
+            m = _PERIOD.match(period)
+            if m is None:
+                raise ValueError("Invalid time period: {}".format(period))
+            h1, m1, h2, m2 = map(int, m.groups())
+            if h1 > 24 or h2 > 24 or m1 > 59 or m2 > 59:
+                raise ValueError("Invalid time period: {}".format(period))
+            periods.append((h1 * 60 + m1, h2 * 60 + m2, parse_rate(rate)))
+        return cls(periods, default)
+
+    def rate_at(self, when):
+        """
+        Return the rate at the datetime `when`, None for no limit.
+        """
+        minute = when.hour * 60 + when.minute
+        for start, end, rate in self.periods:
+            if start <= end:
+                if start <= minute < end:
+                    return rate
+            elif minute >= start or minute < end:
+                return rate
+        return self.default
+
+
+class TokenBucket(object):
+    """
+    Limits the rate of a byte stream shared by several threads, allowing
+    bursts of up to `burst` bytes.
+
+    Bytes are granted in quanta of at most `QUANTUM` bytes, each one
+    reserved in the order callers ask for them, so that concurrent
+    transfers share the rate evenly instead of the quickest one taking
+    most of it.
+    """
+
+    def __init__(self, rate, burst=QUANTUM, clock=time.time,
+                 sleep=time.sleep, now=datetime.now):
+        """
+        :param rate: bytes per second, or a :class:`Schedule` of rates
+        :param burst: the most bytes to grant without waiting
+        :param clock: function returning the current time in seconds
+        :param sleep: function to sleep for some seconds
+        :param now: function returning the local datetime, for schedules
+        """
+        if not isinstance(rate, Schedule):
+            rate = Schedule(default=rate)
+        self.schedule = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._now = now
+        self._lock = threading.Lock()
+        # the time the bytes reserved so far will have been sent
+        self._next = None
+        self._rate = None
+        self._checked = None
+
+    @property
+    def rate(self):
+        """
+        The current rate, None for no limit.
+        """
+        now = self._clock()
+        if (self._checked is None or
+                now - self._checked >= SCHEDULE_CHECK_INTERVAL):
+            self._rate = self.schedule.rate_at(self._now())
+            self._checked = now
+        return self._rate
+
+    def consume(self, size):
+        """
+        Wait until `size` more bytes may be sent.
+        """
+        while size > 0:
+            n = min(size, QUANTUM)
+            size -= n
+            with self._lock:
+                rate = self.rate
+                now = self._clock()
+                if rate is None:
+                    self._next = None
+                    continue
+                start = now - self.burst / rate
+                if self._next is not None:
+                    start = max(self._next, start)
+                self._next = start + n / rate
+                wait = self._next - now
+            if wait > 0:
+                self._sleep(wait)
+
+
+class ThrottledReader(object):
+    """
+    A file object wrapper that consumes tokens from a
+    :class:`TokenBucket` for the bytes read through it.
+    """
+
+    def __init__(self, raw, bucket):
+        self.raw = raw
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bucket.consume(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def from_settings(settings):
+    """
+    Create the token bucket for the `limit_rate` setting of the profile.
+    Returns None if there is no limit.
+    """
+    value = settings['limit_rate']
+    if not value:
+        return None
+    schedule = Schedule.parse(value)
+    if schedule.default is None and not schedule.periods:
+        return None
+    return TokenBucket(schedule)
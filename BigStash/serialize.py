@@ -1,12 +1,17 @@
 import json
 from BigStash import models
+from BigStash.manifest import ManifestEntry
 from datetime import datetime
 
+CHUNK_SIZE = 64 * 1024
+
 
 class ModelEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, models.ModelBase):
             return dict((k, getattr(obj, k)) for k in obj._slots)
+        elif isinstance(obj, ManifestEntry):
+            return dict(obj.items())
         elif isinstance(obj, datetime):
             return obj.isoformat()
         return super(ModelEncoder, self).default(obj)
@@ -14,3 +19,44 @@ class ModelEncoder(json.JSONEncoder):
 
 def model_to_json(obj):
     return json.dumps(obj, cls=ModelEncoder)
+
+
+def _iter_manifest_json(manifest, encode):
+    yield '{'
+    for i, slot in enumerate(manifest._slots):
+        if i > 0:
+            yield ', '
+        yield encode(slot)
+        yield ': '
+        if slot != 'files':
+            yield encode(getattr(manifest, slot))
+            continue
+        # encode files one at a time instead of building a list of them
+        yield '['
+        for j, f in enumerate(manifest):
+            if j > 0:
+                yield ', '
+            yield encode(f)
+        yield ']'
+    yield '}'
+
+
+def manifest_to_json_chunks(manifest, chunk_size=CHUNK_SIZE):
+    """
+    Encode a manifest incrementally, yielding UTF-8 encoded chunks of at
+    least `chunk_size` bytes (except for the last one). The output decodes
+    to the same JSON as `model_to_json(manifest)`, but memory use doesn't
+    grow with the number of files. Suitable as a streamed request body.
+    """
+    encode = ModelEncoder().encode
+    parts = []
+    size = 0
+    for part in _iter_manifest_json(manifest, encode):
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    if parts:
+        yield ''.join(parts).encode('utf-8')
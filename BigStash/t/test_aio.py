@@ -0,0 +1,186 @@
+import sys
+import json
+import threading
+from six.moves import BaseHTTPServer, socketserver
+from testtools.testcase import TestCase
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline(), 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    return body
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _signed(self):
+        from BigStash.sign import HTTPSignatureAuth
+        from BigStash.structures import CaseInsensitiveDict
+
+        class Request(object):
+            method = self.command
+            url = 'http://{}{}'.format(self.headers['Host'], self.path)
+            headers = CaseInsensitiveDict(
+                (k, v) for k, v in self.headers.items()
+                if k.lower() != 'authorization')
+        auth = HTTPSignatureAuth(
+            key_id='key', secret='secret', algorithm='hmac-sha256',
+            headers=['(request-target)', 'date', 'host'])
+        return (auth(Request()).headers['Authorization'] ==
+                self.headers['Authorization'])
+
+    def _reply(self, status, body=None):
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        base = 'http://{}/api/v1/'.format(self.headers['Host'])
+        body = self._body()
+        self.requests.append((self.command, self.path, body))
+        if not self._signed():
+            return self._reply(403, {'detail': 'Bad signature.'})
+        upload = {'url': base + 'uploads/1/', 'status': 'pending',
+                  'archive': {'key': 'A1'}}
+        routes = {
+            ('GET', '/api/v1/'): {'archives': base + 'archives/',
+                                  'uploads': base + 'uploads/'},
+            ('GET', '/api/v1/archives/'): {
+                'next': base + 'archives/?page=2',
+                'results': [{'key': 'A1'}, {'key': 'A2'}]},
+            ('GET', '/api/v1/archives/?page=2'): {
+                'next': None, 'results': [{'key': 'A3'}]},
+            ('GET', '/api/v1/archives/3/'): {'key': 'A3', 'title': 't'},
+            ('GET', '/api/v1/archives/3/files/'): {
+                'next': base + 'archives/3/files/?page=2',
+                'results': [{'path': 'a', 'size': 1}]},
+            ('GET', '/api/v1/archives/3/files/?page=2'): {
+                'next': None, 'results': [{'path': 'b', 'size': 2}]},
+            ('POST', '/api/v1/uploads/'): upload,
+            ('GET', '/api/v1/uploads/1/'): dict(upload, status='completed'),
+            ('PATCH', '/api/v1/uploads/1/'): dict(upload, status='uploaded'),
+        }
+        if (self.command, self.path) == ('DELETE', '/api/v1/uploads/1/'):
+            return self._reply(204)
+        if (self.command, self.path) not in routes:
+            return self._reply(404, {'detail': 'Not found.'})
+        self._reply(201 if self.command == 'POST' else 200,
+                    routes[(self.command, self.path)])
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class AsyncAPITestCase(TestCase):
+    def setUp(self):
+        super(AsyncAPITestCase, self).setUp()
+        if sys.version_info < (3, 6):
+            self.skipTest("the asyncio client needs Python 3.6")
+        try:
+            import aiohttp  # noqa
+        except ImportError:
+            self.skipTest("aiohttp is not installed")
+        import asyncio
+        self.requests = []
+        handler = type('H', (Handler,), {'requests': self.requests})
+        server = Server(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        from BigStash.aio import AsyncBigStashAPI
+        from BigStash.conf import BigStashAPISettings
+        settings = BigStashAPISettings()
+        self.addCleanup(settings.update, dict(settings))
+        settings['base_url'] = 'http://127.0.0.1:{}/api/v1/'.format(
+            server.server_address[1])
+        self.api = AsyncBigStashAPI('key', 'secret', settings=settings)
+        self.addCleanup(self.wait, self.api.close())
+
+    def wait(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def collect(self, iterator):
+        items = []
+        while True:
+            try:
+                items.append(self.wait(iterator.__anext__()))
+            except StopAsyncIteration:  # noqa
+                return items
+
+    def test_archives(self):
+        archives = self.collect(self.api.GetArchives())
+        self.assertEqual(['A1', 'A2', 'A3'], [a.key for a in archives])
+        archive = self.wait(self.api.GetArchive(3))
+        self.assertEqual('t', archive.title)
+        files = self.collect(self.api.GetArchiveFiles(3))
+        self.assertEqual([('a', 1), ('b', 2)],
+                         [(f.path, f.size) for f in files])
+
+    def test_upload(self):
+        import asyncio
+        from BigStash.manifest import Manifest
+        manifest = Manifest(title='test')
+        manifest._add('/tmp/a', 1, 0.0, 'd41d8cd98f00b204e9800998ecf8427e')
+        upload = self.wait(self.api.CreateUpload(manifest=manifest))
+        self.assertEqual('A1', upload.archive.key)
+        method, path, body = self.requests[-1]
+        self.assertEqual(['/tmp/a'], [
+            f['original_path'] for f in json.loads(body)['files']])
+        self.wait(self.api.UpdateUploadStatus(upload, 'uploaded'))
+        self.assertEqual('uploaded', upload.status)
+        upload = self.wait(self.api.GetUpload(1))
+        self.assertEqual('completed', upload.status)
+        self.assertEqual('A1', upload.archive.key)
+        # many polls at once, on one loop
+        uploads = self.wait(asyncio.gather(*[
+            self.api.RefreshUploadStatus(upload) for _ in range(50)]))
+        self.assertEqual(set(['completed']), set(u.status for u in uploads))
+        self.wait(self.api.CancelUpload(1))
+        self.assertEqual('DELETE', self.requests[-1][0])
+
+    def test_errors(self):
+        from BigStash.error import BigStashError, BigStashForbiddenError
+        e = self.assertRaises(
+            BigStashError, self.wait, self.api.GetArchive(4))
+        self.assertIn('404', str(e))
+        self.api = type(self.api)('key', 'wrong', settings=self.api.settings)
+        self.addCleanup(self.wait, self.api.close())
+        e = self.assertRaises(
+            BigStashForbiddenError, self.wait, self.api.GetArchive(3))
+        self.assertEqual('Bad signature.', str(e))
+
+    def test_verify(self):
+        import ssl
+        from requests.certs import where
+        from BigStash.aio import _ssl_context
+        self.assertIs(None, _ssl_context(None))
+        self.assertIs(None, _ssl_context(True))
+        self.assertIs(False, _ssl_context(False))
+        # a CA bundle still verifies, against its own CAs
+        context = _ssl_context(where())
+        self.assertEqual(ssl.CERT_REQUIRED, context.verify_mode)
+        self.assertTrue(context.check_hostname)
+        self.assertNotEqual([], context.get_ca_certs())
+        self.assertRaises(IOError, _ssl_context, '/nonexistent/ca.pem')
@@ -0,0 +1,27 @@
+import os
+from testtools.testcase import TestCase
+
+
+class FilenameTestCase(TestCase):
+    def test_validator(self):
+        from BigStash.filename import is_invalid
+        validator = is_invalid()
+        path = os.path.join(os.sep, 'a', 'b:c', 'y?', 'f2|')
+        self.assertEqual(
+            ['b:c', 'y?', 'f2|'], [c for _, _, c in validator(path)])
+        # only the components given are checked
+        self.assertEqual(
+            ['f2|'], [c for _, _, c in validator(path, components=['f2|'])])
+
+    def test_ignore_everything(self):
+        from BigStash.ignore import GitIgnore
+        self.assertTrue(GitIgnore(['*'])('foo'))
+        self.assertTrue(GitIgnore(['*'])('a/foo', True))
+        self.assertFalse(GitIgnore(['*/'])('foo'))
+        self.assertTrue(GitIgnore(['*/'])('foo', True))
+        ignore = GitIgnore(['*', '!keep'])
+        self.assertFalse(ignore('keep'))
+        self.assertFalse(ignore('a/keep'))
+        self.assertTrue(ignore('other'))
+        # a later '*' wins over an earlier negation
+        self.assertTrue(GitIgnore(['!keep', '*'])('keep'))
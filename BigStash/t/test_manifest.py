@@ -0,0 +1,296 @@
+import os
+import json
+import shutil
+import calendar
+import hashlib
+import tempfile
+from testtools.testcase import TestCase
+
+
+class ManifestTestCase(TestCase):
+    def setUp(self):
+        super(ManifestTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _write(self, path, data):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _from_paths(self, *args, **kwargs):
+        from BigStash.manifest import Manifest
+        return Manifest.from_paths(*args, **kwargs)
+
+    def test_file_digest_chunked(self):
+        from BigStash.digest import file_digest
+        data = os.urandom(100000)
+        path = self._write('data', data)
+        expected = hashlib.md5(data).hexdigest()
+        self.assertEqual(expected, file_digest(path, chunk_size=4096))
+        self.assertEqual(expected, file_digest(path, buf=bytearray(7)))
+        self.assertEqual(hashlib.sha256(data).hexdigest(),
+                         file_digest(path, algorithm='sha256'))
+
+    def test_from_paths_digests(self):
+        contents = {'a.txt': b'alpha', 'sub/b.txt': b'beta', 'empty': b''}
+        for p, d in contents.items():
+            self._write(p, d)
+        manifest, errors, ignored = self._from_paths([self.root])
+        self.assertEqual([], errors)
+        self.assertEqual(3, len(manifest))
+        digests = dict((f.path, f.md5) for f in manifest)
+        self.assertEqual(
+            dict((p, hashlib.md5(d).hexdigest())
+                 for p, d in contents.items()), digests)
+        self.assertEqual(self.root, manifest.base)
+        self.assertEqual(os.path.basename(self.root), manifest.title)
+        self.assertEqual(sum(len(d) for d in contents.values()),
+                         manifest.size)
+
+    def test_from_paths_parallel_order(self):
+        for i in range(50):
+            self._write('d{}/f{}'.format(i % 5, i), os.urandom(i * 100))
+        self._write('desktop.ini', b'')
+        self._write('d1/bad:name', b'')
+        serial, errors, ignored = self._from_paths([self.root])
+        self.assertEqual(1, len(errors))
+        self.assertEqual(1, len(ignored))
+        for processes in (False, True):
+            parallel, perrors, pignored = self._from_paths(
+                [self.root], workers=4, processes=processes)
+            self.assertEqual(
+                [(f.original_path, f.md5) for f in serial],
+                [(f.original_path, f.md5) for f in parallel])
+            self.assertEqual(errors, perrors)
+            self.assertEqual(ignored, pignored)
+
+    def test_imap_ordered(self):
+        from BigStash.parallel import imap_ordered, get_executor
+        with get_executor(3) as executor:
+            self.assertEqual(
+                [i * i for i in range(100)],
+                list(imap_ordered(executor, lambda i: i * i, range(100),
+                                  window=5)))
+
+    def test_imap_routed(self):
+        import time
+        from BigStash.parallel import imap_routed, get_executor
+        started = {}
+        start = time.time()
+
+        def files():
+            yield 'L'
+            yield 's1'
+            # the next batch is still being scanned
+            time.sleep(1)
+            yield 's2'
+
+        def upload(f):
+            started[f] = time.time() - start
+            return f
+        with get_executor(2) as small, get_executor(1) as large:
+            results = list(imap_routed(
+                files(), lambda f: 1 if f == 'L' else 0,
+                [(small, upload, 2), (large, upload, 1)]))
+        self.assertEqual(set(['L', 's1', 's2']),
+                         set(f for f, _, _ in results))
+        self.assertLess(started['L'], 0.5)
+        self.assertLess(started['s1'], 0.5)
+
+        def failing():
+            yield 's1'
+            raise ValueError()
+        with get_executor(1) as executor:
+            results = imap_routed(failing(), lambda f: 0,
+                                  [(executor, upload, 1)])
+            self.assertRaises(ValueError, list, results)
+
+    def test_from_paths_digest_cache(self):
+        from BigStash.cache import DigestCache
+        for i in range(10):
+            self._write('f{}'.format(i), os.urandom(100))
+        cachefile = os.path.join(self.root, 'cache.db')
+        with DigestCache(cachefile) as cache:
+            first, _, _ = self._from_paths(
+                [os.path.join(self.root, 'f{}'.format(i))
+                 for i in range(10)], cache=cache)
+            self.assertEqual((0, 10), (cache.hits, cache.misses))
+        with DigestCache(cachefile, max_entries=5) as cache:
+            second, _, _ = self._from_paths(
+                [os.path.join(self.root, 'f{}'.format(i))
+                 for i in range(10)], workers=3, cache=cache)
+            self.assertEqual((10, 0), (cache.hits, cache.misses))
+        self.assertEqual([f.md5 for f in first], [f.md5 for f in second])
+        with DigestCache(cachefile) as cache:
+            self.assertEqual(5, sum(
+                cache.get(os.stat(f.original_path)) is not None
+                for f in first))
+
+    def test_from_paths_links_and_missing(self):
+        target = self._write('sub/target', b'data')
+        os.symlink(target, os.path.join(self.root, 'link'))
+        os.symlink(os.path.join(self.root, 'sub'),
+                   os.path.join(self.root, 'dirlink'))
+        missing = os.path.join(self.root, 'missing')
+        manifest, errors, ignored = self._from_paths([self.root, missing])
+        self.assertEqual([target], [f.original_path for f in manifest])
+        self.assertEqual([(missing, "File doesn't exist")], errors)
+        self.assertEqual(
+            sorted([(os.path.join(self.root, 'link'), 'is link'),
+                    (os.path.join(self.root, 'dirlink'), 'is link')]),
+            sorted(ignored))
+
+    def test_walk_order(self):
+        from BigStash.walk import walk
+        for p in ('a/b/c', 'a/d', 'e', 'f/g/h/i', 'f/j'):
+            self._write(p, b'')
+        expected = [os.path.join(r, f) for r, _, files in os.walk(self.root)
+                    for f in files]
+        self.assertEqual(expected, [p for p, _ in walk(self.root)])
+
+    def test_from_paths_prunes_directories(self):
+        for i in range(5):
+            self._write('keep/f{}'.format(i), b'')
+            self._write('desktop.ini/f{}'.format(i), b'')
+            self._write('bad:dir/sub/f{}'.format(i), b'')
+        manifest, errors, ignored = self._from_paths([self.root])
+        self.assertEqual(5, len(manifest))
+        self.assertEqual(
+            [(os.path.join(self.root, 'desktop.ini'), 'small system file')],
+            ignored)
+        self.assertEqual(
+            [(os.path.join(self.root, 'bad:dir'), 'restricted characters')],
+            errors)
+
+    def test_from_paths_user_ignore(self):
+        from BigStash import filename
+        for p in ('a.log', 'keep.log', 'node_modules/x', 'src/node_modules/y',
+                  'build/z', 'src/build/w', 'src/main.c'):
+            self._write(p, b'')
+        ignorefile = self._write(
+            'ignore', b'*.log\n!keep.log\nnode_modules/\n/build\nignore\n')
+        filename.setup_user_ignore(ignorefile)
+        self.addCleanup(filename.IGNORE_MATCHERS.clear)
+        manifest, errors, ignored = self._from_paths([self.root])
+        self.assertEqual(
+            sorted(os.path.join(self.root, p) for p in
+                   ('keep.log', 'src/build/w', 'src/main.c')),
+            sorted(f.original_path for f in manifest))
+        self.assertEqual(5, len(ignored))
+
+    def test_gitignore(self):
+        from BigStash.ignore import GitIgnore
+        g = GitIgnore(['*.log', '!keep.log', 'tmp/', '/build', 'a/**/b',
+                       '[ab]?.c', '# comment', '', '\\#name', 'x/**'])
+        self.assertTrue(g('x.tar.log'))
+        self.assertFalse(g('d/keep.log'))
+        self.assertTrue(g('d/tmp', is_dir=True))
+        self.assertFalse(g('d/tmp'))
+        self.assertTrue(g('build', is_dir=True))
+        self.assertFalse(g('d/build', is_dir=True))
+        self.assertTrue(g('a/b'))
+        self.assertTrue(g('a/x/y/b'))
+        self.assertTrue(g('d/bx.c'))
+        self.assertFalse(g('d/cx.c'))
+        self.assertTrue(g('#name'))
+        self.assertTrue(g('x/y/z'))
+        self.assertFalse(g('x', is_dir=True))
+
+    def test_manifest_mapping(self):
+        from BigStash import models
+        from BigStash.manifest import Manifest
+
+        def _file(name, size):
+            return models.File(
+                original_path=os.path.join(self.root, name), size=size,
+                last_modified=1400000000,
+                md5=hashlib.md5(name.encode('ascii')).hexdigest())
+        manifest = Manifest(files=[_file('a', 1), _file('b', 2)])
+        self.assertEqual(3, manifest.size)
+        self.assertIn(2, manifest)
+        self.assertNotIn(3, manifest)
+        manifest['x'] = _file('c', 4)
+        self.assertRaises(ValueError, manifest.__setitem__, 'x', _file('d', 8))
+        self.assertRaises(ValueError, manifest.__setitem__, 'y', object())
+        del manifest[1]
+        self.assertRaises(KeyError, manifest.__getitem__, 1)
+        self.assertEqual(2, len(manifest))
+        self.assertEqual(6, manifest.size)
+        entry = manifest['x']
+        self.assertEqual(os.path.join(self.root, 'c'), entry.original_path)
+        self.assertEqual(hashlib.md5(b'c').hexdigest(), entry.md5)
+        self.assertEqual(4, entry.size)
+        self.assertEqual(1400000000, calendar.timegm(
+            entry.last_modified.utctimetuple()))
+        self.assertEqual([2, 'x'], [f.id for f in manifest])
+
+    def test_manifest_base(self):
+        from BigStash import models
+        from BigStash.manifest import Manifest
+        manifest = Manifest()
+        paths = ['/a/b/c/d', '/a/b/c/e', '/a/b/cx/f', '/a/b/c/g/h']
+        for p in paths:
+            manifest[len(manifest) + 1] = models.File(
+                original_path=p, size=0, last_modified=0, md5=None)
+            if p == '/a/b/c/e':
+                self.assertEqual('/a/b/c', manifest.base)
+                self.assertEqual(['d', 'e'], [f.path for f in manifest])
+        self.assertEqual('/a/b', manifest.base)
+        self.assertEqual({'prefix': '/a/b'}, manifest.source)
+        self.assertEqual(['c/d', 'c/e', 'cx/f', 'c/g/h'],
+                         [f.path for f in manifest])
+
+    def test_manifest_json_chunks(self):
+        from BigStash.serialize import model_to_json, manifest_to_json_chunks
+        for i in range(20):
+            self._write('d{}/f{}'.format(i % 3, i), os.urandom(i))
+        manifest, _, _ = self._from_paths([self.root], title='title')
+        chunks = list(manifest_to_json_chunks(manifest, chunk_size=100))
+        self.assertTrue(len(chunks) > 10)
+        self.assertTrue(all(len(c) >= 100 for c in chunks[:-1]))
+        # keys may be in another order, dicts aren't ordered on python 2
+        self.assertEqual(json.loads(model_to_json(manifest)),
+                         json.loads(b''.join(chunks).decode('utf-8')))
+
+    def test_fixed_base(self):
+        from BigStash.manifest import Manifest, common_dir
+        self._write('a/b/c', b'c')
+        manifest = Manifest(base=self.root)
+        manifest._add(os.path.join(self.root, 'a', 'b', 'c'), 1, None, None)
+        self.assertEqual('a/b/c', manifest[1].path)
+        self.assertEqual(self.root, common_dir([
+            os.path.join(self.root, 'a'), os.path.join(self.root, 'x')]))
+
+    def test_paths_threaded(self):
+        import threading
+        from BigStash.manifest import Manifest
+        manifest = Manifest(base=self.root)
+        expected = {}
+        errors = []
+
+        def add(start, stop):
+            for i in range(start, stop):
+                path = 'd{}/e{}/f{}'.format(i, i % 7, i)
+                expected[manifest._add(
+                    os.path.join(self.root, *path.split('/')), 1, None,
+                    None)] = path
+
+        def read(keys):
+            for k in keys:
+                if manifest[k].path != expected[k]:
+                    errors.append((manifest[k].path, expected[k]))
+        add(0, 2000)
+        # upload threads read paths while the scan adds more files
+        threads = [threading.Thread(target=read, args=(list(expected),))
+                   for _ in range(8)]
+        threads.append(threading.Thread(target=add, args=(2000, 4000)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        read(list(expected))
+        self.assertEqual([], errors)
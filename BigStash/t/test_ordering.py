@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+from testtools.testcase import TestCase
+
+
+class OrderingTestCase(TestCase):
+    def setUp(self):
+        super(OrderingTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for i, size in enumerate([3, 10, 0, 7]):
+            with open(os.path.join(self.root, 'f{}'.format(i)), 'wb') as f:
+                f.write(b'x' * size)
+        from BigStash.manifest import Manifest
+        self.manifest, _, _ = Manifest.from_paths([self.root])
+
+    def _paths(self, files):
+        return [f.path for f in files]
+
+    def test_largest_first(self):
+        from BigStash.ordering import largest_first
+        self.assertEqual(['f1', 'f3', 'f0', 'f2'],
+                         self._paths(largest_first(self.manifest)))
+
+    def test_by_inode(self):
+        from BigStash.ordering import by_inode
+        inodes = dict((f.path, os.stat(f.original_path).st_ino)
+                      for f in self.manifest)
+        self.assertEqual(sorted(inodes, key=inodes.get),
+                         self._paths(by_inode(self.manifest)))
+
+    def test_by_extent(self):
+        from BigStash.ordering import by_extent, physical_offset
+        files = by_extent(self.manifest)
+        self.assertEqual(sorted(self._paths(self.manifest)),
+                         sorted(self._paths(files)))
+        offset = physical_offset(os.path.join(self.root, 'f1'))
+        self.assertTrue(offset is None or offset >= 0)
+
+    def test_get_ordering(self):
+        from BigStash.ordering import get_ordering, manifest_order
+        self.assertIs(manifest_order, get_ordering('manifest'))
+        self.assertRaises(ValueError, get_ordering, 'random')
@@ -0,0 +1,111 @@
+import json
+import time
+import socket
+import threading
+from six.moves import BaseHTTPServer, socketserver
+from testtools.testcase import TestCase
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.delay)
+        data = json.dumps({'key': 'key', 'secret': 'secret'}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = _handle
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class PoolTestCase(TestCase):
+    def setUp(self):
+        super(PoolTestCase, self).setUp()
+        from BigStash.conf import BigStashAPISettings
+
+        # a class of its own, for each test to set the delay of
+        class H(Handler):
+            pass
+        self.handler = H
+        server = Server(('127.0.0.1', 0), self.handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.settings = BigStashAPISettings()
+        self.addCleanup(self.settings.update, dict(self.settings))
+        self.settings['base_url'] = 'http://127.0.0.1:{}/api/v1/'.format(
+            server.server_address[1])
+
+    def test_shared(self):
+        from BigStash import BigStashAuth, BigStashAPI
+        from BigStash.pool import APIConnectionPool
+        pool = APIConnectionPool.from_settings(self.settings)
+        auth = BigStashAuth(settings=self.settings, pool=pool)
+        api = BigStashAPI('key', 'secret', settings=self.settings, pool=pool)
+        for _ in range(3):
+            auth.GetAPIKey('user', 'password')
+            api.GetUser()
+        self.assertEqual(6, pool.stats.requests)
+        self.assertEqual(1, pool.stats.connections)
+        self.assertEqual(5 / 6.0, pool.stats.reuse_ratio)
+        # each client has a pool of its own by default
+        self.assertIsNot(BigStashAuth(settings=self.settings).pool,
+                         BigStashAuth(settings=self.settings).pool)
+
+    def test_read_timeout(self):
+        from BigStash import BigStashAuth
+        from BigStash.error import BigStashConnectionError
+        self.settings['api_read_timeout'] = 0.1
+        self.handler.delay = 1
+        auth = BigStashAuth(settings=self.settings)
+        start = time.time()
+        self.assertRaises(BigStashConnectionError,
+                          auth.GetAPIKey, 'user', 'password')
+        self.assertLess(time.time() - start, 1)
+        # the request was sent, so it wasn't retried
+        self.assertEqual(1, auth.pool.stats.requests)
+
+    def test_connect_retries(self):
+        from BigStash import BigStashAuth
+        from BigStash.error import BigStashConnectionError
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        self.addCleanup(s.close)
+        self.settings['base_url'] = 'http://127.0.0.1:{}/'.format(
+            s.getsockname()[1])
+        self.settings['api_connect_retries'] = 1
+        auth = BigStashAuth(settings=self.settings)
+        self.assertRaises(BigStashConnectionError,
+                          auth.GetAPIKey, 'user', 'password')
+        self.assertEqual(2, auth.pool.stats.connections)
+
+    def test_block(self):
+        from BigStash import BigStashAuth
+        self.settings['api_pool_maxsize'] = 1
+        self.settings['api_pool_block'] = True
+        self.handler.delay = 0.1
+        auth = BigStashAuth(settings=self.settings)
+        threads = [threading.Thread(target=auth.GetAPIKey,
+                                    args=('user', 'password'))
+                   for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, auth.pool.stats.connections)
+        self.assertEqual(2, auth.pool.stats.waits)
+        self.assertGreater(auth.pool.stats.wait_time, 0.1)
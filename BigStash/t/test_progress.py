@@ -0,0 +1,70 @@
+import json
+from six import StringIO
+from testtools.testcase import TestCase
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class File(object):
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+
+class ProgressTestCase(TestCase):
+    def test_sharded_counter(self):
+        import threading
+        from BigStash.progress import ShardedCounter
+        counter = ShardedCounter()
+
+        def add():
+            for _ in range(1000):
+                counter.add(2)
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(8000, counter.value)
+
+    def test_jsonl_progress(self):
+        from BigStash.progress import ProgressReporter, JsonLinesRenderer
+        out = StringIO()
+        clock = Clock()
+        progress = ProgressReporter(
+            JsonLinesRenderer(out), rate=0.001, clock=clock)
+        a, b = File(u'a', 100), File(u'b', 300)
+        progress.queued([a, b])
+        progress.start(a)
+        progress.update(a, 100)
+        progress.done(a)
+        clock.now = 1.0
+        progress.render()
+        progress.render()
+        progress.start(b)
+        progress.update(b, 300)
+        progress.done(b, Exception('oops'))
+        clock.now = 2.0
+        progress.close()
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            ['file', 'progress', 'file', 'progress', 'summary'],
+            [line['type'] for line in lines])
+        self.assertEqual('ok', lines[0]['status'])
+        self.assertEqual(100, lines[1]['bytes'])
+        self.assertEqual(100, lines[1]['rate'])
+        self.assertEqual(3, lines[1]['eta'])
+        self.assertEqual('failed', lines[2]['status'])
+        self.assertEqual('oops', lines[2]['error'])
+        summary = lines[-1]
+        self.assertEqual(1, summary['files_done'])
+        self.assertEqual(1, summary['files_failed'])
+        self.assertEqual(2, summary['files_total'])
+        self.assertEqual(400, summary['bytes_total'])
+        self.assertEqual(2.0, summary['elapsed'])
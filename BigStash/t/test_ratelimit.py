@@ -0,0 +1,63 @@
+from datetime import datetime
+from testtools.testcase import TestCase
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimitTestCase(TestCase):
+    def test_parse_rate(self):
+        from BigStash.ratelimit import parse_rate
+        self.assertEqual(500 * 1024, parse_rate('500k'))
+        self.assertEqual(1.5 * 1024 * 1024, parse_rate('1.5MB/s'))
+        self.assertEqual(1000, parse_rate('1000'))
+        self.assertEqual(None, parse_rate('0'))
+        self.assertRaises(ValueError, parse_rate, 'fast')
+
+    def test_schedule(self):
+        from BigStash.ratelimit import Schedule
+        s = Schedule.parse('09:00-18:00=1M,22:00-06:00=0,10M')
+
+        def at(hour, minute=0):
+            return s.rate_at(datetime(2016, 1, 1, hour, minute))
+        self.assertEqual(1024 ** 2, at(9))
+        self.assertEqual(1024 ** 2, at(17, 59))
+        self.assertEqual(10 * 1024 ** 2, at(18))
+        self.assertEqual(None, at(23))
+        self.assertEqual(None, at(5, 59))
+        self.assertEqual(10 * 1024 ** 2, at(6))
+        self.assertRaises(ValueError, Schedule.parse, '9-18=1M')
+
+    def test_token_bucket(self):
+        from BigStash.ratelimit import TokenBucket
+        clock = Clock()
+        bucket = TokenBucket(100 * 1024, clock=clock, sleep=clock.sleep)
+        bucket.consume(64 * 1024)
+        self.assertEqual(0, clock.now)
+        bucket.consume(1024 * 1024)
+        self.assertEqual(10.24, round(clock.now, 2))
+        # unused time doesn't accumulate beyond the burst
+        clock.now += 100
+        bucket.consume(128 * 1024)
+        self.assertEqual(110.88, round(clock.now, 2))
+
+    def test_schedule_change(self):
+        from BigStash.ratelimit import TokenBucket, Schedule
+        clock = Clock()
+        now = [datetime(2016, 1, 1, 12)]
+        bucket = TokenBucket(
+            Schedule.parse('09:00-18:00=1k,0'), burst=1024, clock=clock,
+            sleep=clock.sleep, now=lambda: now[0])
+        bucket.consume(10 * 1024)
+        self.assertEqual(9.0, clock.now)
+        now[0] = datetime(2016, 1, 1, 19)
+        bucket.consume(10 * 1024 * 1024)
+        self.assertEqual(9.0, clock.now)
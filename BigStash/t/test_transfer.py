@@ -0,0 +1,350 @@
+import os
+import shutil
+import tempfile
+from testtools.testcase import TestCase
+from BigStash import models
+
+try:
+    from moto import mock_s3
+except ImportError:
+    from moto import mock_aws as mock_s3
+
+
+class TransferTestCase(TestCase):
+    def setUp(self):
+        super(TransferTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        mock = mock_s3()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.token = models.BucketToken(
+            bucket='bucket', prefix='upload/1/', region='us-east-1',
+            token_access_key='key', token_secret_key='secret',
+            token_session='session')
+        from BigStash.transfer import get_s3_client
+        self.client = get_s3_client(self.token)
+        self.client.create_bucket(Bucket='bucket')
+
+    def _manifest(self, files):
+        from BigStash.manifest import Manifest
+        for name, data in files.items():
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(data)
+        manifest, _, _ = Manifest.from_paths([self.root])
+        return manifest
+
+    def _get(self, key):
+        return self.client.get_object(
+            Bucket='bucket', Key=key)['Body'].read()
+
+    def test_upload_scheduler(self):
+        from BigStash.transfer import UploadScheduler, UploadProgress
+        files = dict(('d{}/f{}'.format(i % 3, i), os.urandom(i * 1000))
+                     for i in range(20))
+        manifest = self._manifest(files)
+        events = []
+
+        class Progress(UploadProgress):
+            def done(self, f, error=None):
+                events.append((f.path, error))
+
+        os.remove(os.path.join(self.root, 'd1/f4'))
+        scheduler = UploadScheduler(
+            self.client, self.token, workers=4, progress=Progress())
+        failures = scheduler.run(manifest)
+        self.assertEqual(['d1/f4'], [f.path for f, _ in failures])
+        self.assertEqual(20, len(events))
+        for name, data in files.items():
+            if name != 'd1/f4':
+                self.assertEqual(data, self._get('upload/1/' + name))
+
+    def test_small_and_large_files(self):
+        from boto3.s3.transfer import TransferConfig
+        from BigStash.transfer import UploadScheduler
+        files = dict(('f{}'.format(i), os.urandom(i * 1000))
+                     for i in range(10))
+        manifest = self._manifest(files)
+        scheduler = UploadScheduler(
+            self.client, self.token, workers=2, small_workers=3,
+            config=TransferConfig(multipart_threshold=5000))
+        self.assertEqual(5, len([f for f in manifest
+                                 if scheduler.is_small(f)]))
+        self.assertEqual([], scheduler.run(manifest))
+        for name, data in files.items():
+            self.assertEqual(data, self._get('upload/1/' + name))
+
+    def test_small_file_content_md5(self):
+        from BigStash.transfer import UploadScheduler
+        manifest = self._manifest({'f': b'data'})
+        headers = []
+
+        def capture(request, **kwargs):
+            headers.append(request.headers.get('Content-MD5'))
+        self.client.meta.events.register(
+            'before-send.s3.PutObject', capture)
+        self.assertEqual(
+            [], UploadScheduler(self.client, self.token).run(manifest))
+        self.assertEqual(['jXd/OF09/siBXSD3SWAm3A=='], [
+            h.decode('ascii') if isinstance(h, bytes) else h
+            for h in headers])
+
+    def test_resume_multipart_upload(self):
+        from boto3.s3.transfer import TransferConfig
+        from BigStash.conf import BigStashAPISettings
+        from BigStash.journal import TransferJournal
+        from BigStash.transfer import UploadScheduler
+        chunk = 5 * 1024 * 1024
+        data = os.urandom(2 * chunk + 1000)
+        manifest = self._manifest({'big': data, 'small': b'x'})
+        settings = BigStashAPISettings(root=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, settings.config_root)
+        upload = models.Upload(url='http://example.com/uploads/1/')
+        config = TransferConfig(
+            multipart_threshold=chunk, multipart_chunksize=chunk,
+            max_concurrency=1)
+        parts = []
+
+        def upload_part(params, **kwargs):
+            parts.append(params['PartNumber'])
+            if params['PartNumber'] == 3 and len(parts) < 4:
+                raise IOError('interrupted')
+        self.client.meta.events.register(
+            'provide-client-params.s3.UploadPart', upload_part)
+
+        journal = TransferJournal.create(settings, upload, manifest)
+        failures = UploadScheduler(
+            self.client, self.token, config=config, journal=journal).run(
+                manifest)
+        journal.close()
+        self.assertEqual(['big'], [f.path for f, _ in failures])
+        self.assertEqual([1, 2, 3], parts)
+
+        journal = TransferJournal.load(settings, upload.url)
+        manifest = journal.manifest()
+        self.assertEqual(1, journal.done_count)
+        self.assertEqual([], UploadScheduler(
+            self.client, self.token, config=config, journal=journal).run(
+                manifest))
+        self.assertEqual([1, 2, 3, 3], parts)
+        self.assertEqual(data, self._get('upload/1/big'))
+        self.assertEqual(b'x', self._get('upload/1/small'))
+        journal.remove()
+        self.assertIsNone(TransferJournal.load(settings, upload.url))
+
+    def test_resume_changed_file(self):
+        from BigStash.conf import BigStashAPISettings
+        from BigStash.error import BigStashError
+        from BigStash.journal import TransferJournal
+        from BigStash.transfer import UploadScheduler
+        manifest = self._manifest({'a': b'a', 'b': b'b', 'c': b'c'})
+        settings = BigStashAPISettings(root=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, settings.config_root)
+        upload = models.Upload(url='http://example.com/uploads/1/')
+        TransferJournal.create(settings, upload, manifest).close()
+        with open(os.path.join(self.root, 'b'), 'ab') as f:
+            f.write(b'b')
+        st = os.stat(os.path.join(self.root, 'c'))
+        os.utime(os.path.join(self.root, 'c'),
+                 (st.st_atime, st.st_mtime + 10))
+        journal = TransferJournal.load(settings, upload.url)
+        self.assertTrue(journal.resumed)
+        failures = UploadScheduler(
+            self.client, self.token, journal=journal).run(journal.manifest())
+        journal.close()
+        self.assertEqual(['b', 'c'], sorted(f.path for f, _ in failures))
+        for _, e in failures:
+            self.assertIsInstance(e, BigStashError)
+            self.assertIn('changed since the upload started', str(e))
+        self.assertEqual(b'a', self._get('upload/1/a'))
+
+    def test_journal_torn_line(self):
+        from BigStash.conf import BigStashAPISettings
+        from BigStash.journal import TransferJournal
+        manifest = self._manifest({'a': b'a', 'b': b'b'})
+        settings = BigStashAPISettings(root=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, settings.config_root)
+        upload = models.Upload(url='http://example.com/uploads/1/')
+        journal = TransferJournal.create(settings, upload, manifest)
+        a, b = sorted(manifest, key=lambda f: f.path)
+        journal.file_done(a.id)
+        journal.close()
+        # interrupted while writing a record
+        with open(journal.path, 'ab') as f:
+            f.write(b'{"type": "done", "id"')
+        journal = TransferJournal.load(settings, upload.url)
+        self.assertEqual(1, journal.done_count)
+        journal.file_done(b.id)
+        journal.close()
+        journal = TransferJournal.load(settings, upload.url)
+        self.assertTrue(journal.is_done(a.id))
+        self.assertTrue(journal.is_done(b.id))
+
+    def test_streaming_upload(self):
+        from BigStash.conf import BigStashAPISettings
+        from BigStash.journal import TransferJournal
+        from BigStash.manifest import Manifest, scan
+        from BigStash.pipeline import StreamingUpload
+        from BigStash.transfer import UploadScheduler
+        files = dict(('d{}/f{}'.format(i % 2, i), os.urandom(i * 100))
+                     for i in range(7))
+        self._manifest(files)
+        registered = []
+
+        class API(object):
+            def CreateUpload(self, manifest):
+                registered.append([f.path for f in manifest])
+                return models.Upload(url='http://example.com/uploads/1/')
+
+            def UpdateUploadFiles(self, upload, files):
+                registered.append([f.path for f in files])
+
+        def scheduler(upload, journal):
+            return UploadScheduler(self.client, self.token, journal=journal)
+        manifest = Manifest(base=self.root)
+        settings = BigStashAPISettings(root=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, settings.config_root)
+        pipeline = StreamingUpload(
+            API(), manifest, scheduler, settings=settings, batch_size=3)
+        errors = []
+        failures = pipeline.run(scan([self.root], errors, []), errors)
+        self.assertEqual([], failures)
+        self.assertEqual([3, 3, 1], [len(b) for b in registered])
+        self.assertEqual(sorted(files), sorted(sum(registered, [])))
+        for name, data in files.items():
+            self.assertEqual(data, self._get('upload/1/' + name))
+        url = pipeline.upload.url
+        self.assertFalse(TransferJournal.load(settings, url).scanning)
+        # interrupted before all the files were found
+        pipeline = StreamingUpload(
+            API(), Manifest(base=self.root), scheduler, settings=settings,
+            batch_size=3)
+
+        def entries():
+            for i, entry in enumerate(scan([self.root], [], [])):
+                if i == 4:
+                    raise KeyboardInterrupt()
+                yield entry
+        self.assertRaises(KeyboardInterrupt, pipeline.run, entries())
+        journal = TransferJournal.load(settings, url)
+        self.assertTrue(journal.scanning)
+        self.assertEqual(3, len(journal.manifest()))
+
+    def test_single_read(self):
+        import hashlib
+        from boto3.s3.transfer import TransferConfig
+        from BigStash.manifest import Manifest
+        from BigStash.pipeline import correct_digests
+        from BigStash.transfer import UploadScheduler
+        chunk = 5 * 1024 * 1024
+        files = {'big': os.urandom(chunk + 1000), 'small': b'small'}
+        self._manifest(files)
+        manifest, _, _ = Manifest.from_paths([self.root], hashing=False)
+        self.assertEqual([None, None], [f.md5 for f in manifest])
+        scheduler = UploadScheduler(
+            self.client, self.token, single_read=True,
+            config=TransferConfig(
+                multipart_threshold=chunk, multipart_chunksize=chunk))
+        self.assertEqual([], scheduler.run(manifest))
+        for name, data in files.items():
+            self.assertEqual(data, self._get('upload/1/' + name))
+        # the part buffers are dropped with the last file using them
+        self.assertEqual({}, scheduler._part_buffers)
+        updated = []
+
+        class API(object):
+            def UpdateUploadFiles(self, upload, files):
+                updated.extend(f.path for f in files)
+        correct_digests(API(), None, manifest, scheduler.digests)
+        self.assertEqual(['big', 'small'], sorted(updated))
+        for f in manifest:
+            self.assertEqual(
+                hashlib.md5(files[f.path]).hexdigest(), f.md5)
+
+    def test_limit_rate(self):
+        from BigStash.ratelimit import TokenBucket
+        from BigStash.transfer import UploadScheduler
+        files = {'a': os.urandom(100000), 'b': os.urandom(1000)}
+        manifest = self._manifest(files)
+        consumed = []
+
+        class Bucket(TokenBucket):
+            def consume(self, size):
+                consumed.append(size)
+        scheduler = UploadScheduler(
+            self.client, self.token, limiter=Bucket(1024))
+        self.assertEqual([], scheduler.run(manifest))
+        # bytes sent, including any chunked encoding framing
+        self.assertTrue(101000 <= sum(consumed) < 102000)
+        for name, data in files.items():
+            self.assertEqual(data, self._get('upload/1/' + name))
+        # the limiter doesn't stay on the client after the upload
+        del consumed[:]
+        self.assertEqual([], UploadScheduler(self.client, self.token).run(
+            self._manifest({'c': b'data'})))
+        self.assertEqual([], consumed)
+
+    def test_refresh_credentials(self):
+        from datetime import datetime, timedelta
+        from BigStash.error import BigStashError
+        from BigStash.transfer import get_s3_client, UploadScheduler
+
+        def token(minutes, prefix='upload/1/'):
+            expiration = datetime.utcnow() + timedelta(minutes=minutes)
+            return models.BucketToken(
+                bucket='bucket', prefix=prefix, region='us-east-1',
+                token_access_key='key', token_secret_key='secret',
+                token_session='session',
+                token_expiration=expiration.strftime('%Y-%m-%dT%H:%M:%SZ'))
+        refreshed = []
+
+        def refresh():
+            refreshed.append(token(60))
+            return refreshed[-1]
+        manifest = self._manifest({'f': b'data'})
+        # about to expire, refreshed before the first request
+        client = get_s3_client(token(1), refresh=refresh)
+        self.assertEqual(
+            [], UploadScheduler(client, self.token).run(manifest))
+        self.assertEqual(1, len(refreshed))
+        self.assertEqual(b'data', self._get('upload/1/f'))
+        # credentials for another location fail the uploads
+        client = get_s3_client(
+            token(1), refresh=lambda: token(60, prefix='upload/2/'))
+        failures = UploadScheduler(client, self.token).run(
+            self._manifest({'g': b'data'}))
+        self.assertNotEqual([], failures)
+        for _, error in failures:
+            self.assertIsInstance(error, BigStashError)
+            self.assertIn('upload/2/', str(error))
+
+    def test_cached_client(self):
+        from boto3.s3.transfer import TransferConfig
+        from BigStash.conf import BigStashAPISettings
+        from BigStash.transfer import cached_s3_client, UploadScheduler
+        client = cached_s3_client(self.token)
+        self.assertIs(client, cached_s3_client(self.token))
+        other = cached_s3_client(
+            self.token, endpoint_url='http://localhost:9000',
+            addressing_style='path')
+        self.assertIsNot(client, other)
+        self.assertEqual('http://localhost:9000', other.meta.endpoint_url)
+        self.assertEqual('path', other.meta.config.s3['addressing_style'])
+        settings = BigStashAPISettings(root=self.root)
+        self.addCleanup(settings.update, dict(settings))
+        settings['s3_endpoint_url'] = 'http://localhost:9000'
+        settings['s3_addressing_style'] = 'path'
+        settings['s3_max_pool_connections'] = 10
+        upload = models.Upload(
+            url='http://x/uploads/1/', s3=dict(self.token.items()))
+        scheduler = UploadScheduler.for_upload(upload, settings=settings)
+        self.assertIs(other, scheduler.client)
+        # a connection for each small file and part in flight
+        scheduler = UploadScheduler.for_upload(
+            upload, workers=2, small_workers=3, config=TransferConfig(
+                max_concurrency=5))
+        self.assertEqual(
+            13, scheduler.client.meta.config.max_pool_connections)
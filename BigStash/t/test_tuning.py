@@ -0,0 +1,61 @@
+from testtools.testcase import TestCase
+
+MB = 1024 * 1024
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TuningTestCase(TestCase):
+    def test_fit_part_size(self):
+        from BigStash.tuning import fit_part_size, MAX_PARTS
+        self.assertEqual(8 * MB, fit_part_size(100 * MB, 8 * MB))
+        self.assertEqual(5 * MB, fit_part_size(100 * MB, 1 * MB))
+        size = 8 * MB * MAX_PARTS + 1
+        self.assertEqual(16 * MB, fit_part_size(size, 8 * MB))
+        self.assertTrue(
+            fit_part_size(5 * 1024 ** 4, 8 * MB) * MAX_PARTS >= 5 * 1024 ** 4)
+
+    def _run(self, tuner, clock, throughput):
+        # one interval of ten seconds, at `throughput` MB/s, with each part
+        # taking one second
+        for _ in range(10):
+            clock.now += 1
+            tuner.part_done(throughput * MB, 1.0)
+
+    def test_concurrency_hill_climbing(self):
+        from BigStash.tuning import AutoTuner
+        clock = Clock()
+        tuner = AutoTuner(concurrency=4, max_concurrency=8, interval=10,
+                          tune_part_size=False, clock=clock)
+        self._run(tuner, clock, 10)
+        self.assertEqual(5, tuner.concurrency())
+        self._run(tuner, clock, 20)
+        self.assertEqual(6, tuner.concurrency())
+        # no better, stay
+        self._run(tuner, clock, 20)
+        self.assertEqual(6, tuner.concurrency())
+        # worse, turn back
+        self._run(tuner, clock, 10)
+        self.assertEqual(5, tuner.concurrency())
+
+    def test_part_size_grows_with_rtt(self):
+        from BigStash.tuning import AutoTuner
+        clock = Clock()
+        tuner = AutoTuner(part_size=8 * MB, interval=10,
+                          tune_concurrency=False, clock=clock)
+        tuner.request_done(0.1)
+        # a part takes one second, ten round trips
+        self._run(tuner, clock, 10)
+        self.assertEqual(16 * MB, tuner.part_size)
+        self.assertEqual(4, tuner.concurrency())
+        tuner = AutoTuner(part_size=8 * MB, interval=10,
+                          tune_concurrency=False, clock=clock)
+        tuner.request_done(0.01)
+        self._run(tuner, clock, 10)
+        self.assertEqual(8 * MB, tuner.part_size)
@@ -0,0 +1,691 @@
+import io
+import os
+import base64
+import hashlib
+import logging
+import binascii
+import time
+import posixpath
+import threading
+import collections
+from functools import partial
+from six.moves import queue
+from boto3.session import Session
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
+from botocore.session import get_session
+from botocore.exceptions import ClientError
+from BigStash.parallel import imap_routed, imap_unordered, get_executor
+from BigStash.progress import UploadProgress
+from BigStash import tuning, ratelimit
+from BigStash.error import BigStashError
+from BigStash.tuning import Tuner
+
+log = logging.getLogger('bigstash.transfer')
+
+DEFAULT_WORKERS = 4
+
+DEFAULT_SMALL_FILE_WORKERS = 16
+
+# PUT requests of objects up to this size are used to estimate the RTT
+RTT_PROBE_SIZE = 16 * 1024
+
+DEFAULT_TRANSFER_CONFIG = {
+    'multipart_threshold': 8 * 1024 * 1024,
+    'multipart_chunksize': 8 * 1024 * 1024,
+    'max_concurrency': 10,
+}
+
+
+def _token_metadata(token):
+    return {
+        'access_key': token.token_access_key,
+        'secret_key': token.token_secret_key,
+        'token': token.token_session,
+        'expiry_time': token.token_expiration,
+    }
+
+
+# clients kept by :func:`cached_s3_client` for reuse
+MAX_CACHED_CLIENTS = 8
+
+_clients = collections.OrderedDict()
+_clients_lock = threading.Lock()
+_data_loader = None
+
+
+def _botocore_session():
+    """
+    Create a botocore session sharing the data loader of the sessions
+    created before, so that the S3 service model is loaded from disk once
+    per process instead of once per client.
+    """
+    global _data_loader
+    session = get_session()
+    with _clients_lock:
+        if _data_loader is None:
+            _data_loader = session.get_component('data_loader')
+        else:
+            session.register_component('data_loader', _data_loader)
+    return session
+
+
+def get_s3_client(token, max_pool_connections=10, refresh=None,
+                  endpoint_url=None, addressing_style=None):
+    """
+    Create an S3 client using the temporary credentials of an upload.
+
+    If `refresh` is given and the credentials have an expiration time, it
+    is called to get a new :class:`models.BucketToken` shortly before
+    they expire, so that requests made after that, including the parts of
+    multipart uploads already in progress, are signed with the new ones.
+    Requests fail with a :class:`BigStashError` if the new token is for
+    another bucket or prefix.
+
+    :param token: the :class:`models.BucketToken` of an upload
+    :param max_pool_connections: size of the client's connection pool
+    :param refresh: optional function returning a new token
+    :param endpoint_url: optional URL of an S3 compatible service to use
+        instead of AWS
+    :param addressing_style: optional 'auto', 'virtual' or 'path' style
+        of bucket URLs
+    """
+    botocore_session = _botocore_session()
+    if refresh is not None and getattr(token, 'token_expiration', None):
+        def refresh_metadata():
+            new = refresh()
+            if (new.bucket, new.prefix) != (token.bucket, token.prefix):
+                # uploads in progress can't move, and the new credentials
+                # wouldn't allow writing to the old location
+                raise BigStashError(
+                    "upload location changed from {}/{} to {}/{}".format(
+                        token.bucket, token.prefix, new.bucket, new.prefix))
+            log.info("refreshed upload credentials, expiring {}".format(
+                new.token_expiration))
+            return _token_metadata(new)
+        credentials = RefreshableCredentials.create_from_metadata(
+            metadata=_token_metadata(token), refresh_using=refresh_metadata,
+            method='bigstash-upload')
+        botocore_session._credentials = credentials
+    else:
+        botocore_session.set_credentials(
+            token.token_access_key, token.token_secret_key,
+            token.token_session)
+    s3_config = None
+    if addressing_style:
+        s3_config = {'addressing_style': addressing_style}
+    return Session(botocore_session=botocore_session).client(
+        's3', region_name=token.region, endpoint_url=endpoint_url,
+        config=Config(max_pool_connections=max_pool_connections,
+                      s3=s3_config))
+
+
+def cached_s3_client(token, max_pool_connections=10, refresh=None,
+                     endpoint_url=None, addressing_style=None):
+    """
+    Like :func:`get_s3_client`, but return the client created before for
+    the same credentials and options, if there is one. Clients are safe
+    to share between threads, and reusing one saves creating it and
+    opening new connections.
+    """
+    key = (token.token_access_key, token.token_secret_key,
+           token.token_session, token.region, max_pool_connections,
+           refresh is not None, endpoint_url, addressing_style)
+    with _clients_lock:
+        client = _clients.pop(key, None)
+        if client is not None:
+            _clients[key] = client
+            return client
+    client = get_s3_client(
+        token, max_pool_connections=max_pool_connections, refresh=refresh,
+        endpoint_url=endpoint_url, addressing_style=addressing_style)
+    with _clients_lock:
+        _clients[key] = client
+        while len(_clients) > MAX_CACHED_CLIENTS:
+            _clients.popitem(last=False)
+    return client
+
+
+class BufferReader(io.RawIOBase):
+    """
+    A seekable file object reading from a memoryview, to pass a pooled
+    buffer to boto without copying it into a `bytes` object first.
+    """
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, min(offset, len(self._view)))
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos+n]
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+
+class FileChunkReader(io.RawIOBase):
+    """
+    A seekable file object reading `length` bytes of a file from `offset`,
+    used as the body of one part of a multipart upload.
+    """
+
+    def __init__(self, path, offset, length):
+        self._fp = io.open(path, 'rb', buffering=0)
+        self._offset = offset
+        self._length = length
+        self._pos = 0
+        self._fp.seek(offset)
+
+    def __len__(self):
+        return self._length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._pos = max(0, min(offset, self._length))
+        self._fp.seek(self._offset + self._pos)
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self._length - self._pos)
+        if n <= 0:
+            return 0
+        n = self._fp.readinto(memoryview(b)[:n])
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._length - self._pos:
+            size = self._length - self._pos
+        b = bytearray(size)
+        n = self.readinto(b)
+        return bytes(b[:n])
+
+    def close(self):
+        self._fp.close()
+        super(FileChunkReader, self).close()
+
+
+class BufferPool(object):
+    """
+    A pool of reusable, equally sized `bytearray` buffers. If `limit` is
+    given, no more than that many buffers are allocated and `get` waits
+    for one to be returned.
+    """
+
+    def __init__(self, size, limit=None):
+        self.size = size
+        self.limit = limit
+        self._allocated = 0
+        self._lock = threading.Lock()
+        self._free = queue.LifoQueue()
+
+    def get(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            allocate = self.limit is None or self._allocated < self.limit
+            if allocate:
+                self._allocated += 1
+        if allocate:
+            return bytearray(self.size)
+        return self._free.get()
+
+    def put(self, buf):
+        self._free.put(buf)
+
+
+def readinto_full(fp, buf):
+    """
+    Read from `fp` until `buf` is full or the end of the file, and return
+    the number of bytes read.
+    """
+    view = memoryview(buf)
+    n = 0
+    while n < len(buf):
+        read = fp.readinto(view[n:])
+        if not read:
+            break
+        n += read
+    return n
+
+
+def content_md5(md5):
+    """
+    Convert a hex md5 digest to the base64 form of the Content-MD5 header.
+    """
+    return base64.b64encode(binascii.unhexlify(md5)).decode('ascii')
+
+
+class UploadScheduler(object):
+    """
+    Uploads the files of a manifest to an upload's S3 bucket, keeping up
+    to `workers` files in flight at a time over one shared S3 client.
+
+    Files smaller than the multipart threshold take a separate, more
+    concurrent path: each one is read once into a pooled buffer and sent
+    with a single PUT request. Larger files are sent as multipart uploads,
+    with the part size and number of parts in flight chosen by a
+    :class:`Tuner`, by default the ones of the transfer config.
+
+    If a :class:`TransferJournal` is given, completed files and parts are
+    recorded in it and skipped when the upload is run again.
+
+    If a :class:`TokenBucket` is given, request bodies are throttled to
+    its rate as they are sent.
+
+    With `single_read`, files are hashed from the same buffers they are
+    uploaded from instead of being read again, and the digests are left
+    in `digests`, keyed by manifest id. Parts of large files are then
+    read in order, into at most `workers + max_concurrency` buffers of
+    each part size.
+
+    If an `ordering` function from :mod:`BigStash.ordering` is given,
+    files are uploaded in the order it returns instead of the order they
+    are passed in.
+    """
+
+    def __init__(self, client, token, workers=DEFAULT_WORKERS,
+                 config=None, progress=None,
+                 small_workers=DEFAULT_SMALL_FILE_WORKERS, journal=None,
+                 single_read=False, tuner=None, limiter=None,
+                 ordering=None):
+        """
+        :param client: a boto3 S3 client
+        :param token: the :class:`models.BucketToken` of the upload
+        :param workers: number of large files to upload concurrently
+        :param config: optional :class:`TransferConfig`
+        :param progress: optional :class:`UploadProgress` instance
+        :param small_workers: number of small files to upload concurrently
+        :param journal: optional :class:`TransferJournal` of the upload
+        :param single_read: compute the digests of files while uploading
+        :param tuner: optional :class:`Tuner` for multipart uploads
+        :param limiter: optional :class:`TokenBucket` to limit the rate
+        :param ordering: optional function to order the files with
+        """
+        self.client = client
+        self.bucket = token.bucket
+        self.prefix = token.prefix
+        self.workers = workers
+        self.small_workers = small_workers
+        self.config = config or TransferConfig(**DEFAULT_TRANSFER_CONFIG)
+        self.progress = progress or UploadProgress()
+        self.journal = journal
+        self.single_read = single_read
+        self.tuner = tuner or Tuner(
+            self.config.multipart_chunksize, self.config.max_concurrency)
+        self._buffers = BufferPool(self.config.multipart_threshold)
+        self.limiter = limiter
+        self.ordering = ordering
+        self._part_buffers = {}
+        self._lock = threading.Lock()
+        self._part_executor = None
+        self.digests = {}
+        self.failures = []
+
+    @classmethod
+    def for_upload(cls, upload, workers=DEFAULT_WORKERS, config=None,
+                   progress=None, small_workers=DEFAULT_SMALL_FILE_WORKERS,
+                   journal=None, single_read=False, tuner=None,
+                   settings=None, limiter=None, api=None, ordering=None):
+        """
+        Create a scheduler with a client for the credentials of `upload`.
+        If `settings` are given, the multipart threshold and the S3
+        endpoint, addressing style and connection pool size are taken
+        from them, multipart uploads are tuned and the rate is limited as
+        they configure. If `api` is given, it is used to renew the
+        credentials before they expire.
+
+        The S3 client is shared with schedulers created before for the
+        same credentials and options.
+        """
+        endpoint_url = addressing_style = pool_size = None
+        if settings is not None:
+            endpoint_url = settings['s3_endpoint_url']
+            addressing_style = settings['s3_addressing_style']
+            pool_size = settings['s3_max_pool_connections']
+            if limiter is None:
+                limiter = ratelimit.from_settings(settings)
+            if config is None:
+                config = TransferConfig(**dict(
+                    DEFAULT_TRANSFER_CONFIG,
+                    multipart_threshold=settings['multipart_threshold']))
+            if tuner is None:
+                tuner = tuning.from_settings(settings)
+        config = config or TransferConfig(**DEFAULT_TRANSFER_CONFIG)
+        max_concurrency = config.max_concurrency
+        if tuner is not None:
+            max_concurrency = tuner.max_concurrency
+        refresh = None
+        if api is not None:
+            refresh = partial(api.RefreshUploadToken, upload)
+        # small files and the parts of large ones are sent at the same time
+        client = cached_s3_client(
+            upload.s3, max_pool_connections=pool_size or (
+                small_workers + workers * max_concurrency),
+            refresh=refresh, endpoint_url=endpoint_url,
+            addressing_style=addressing_style)
+        return cls(client, upload.s3, workers=workers, config=config,
+                   progress=progress, small_workers=small_workers,
+                   journal=journal, single_read=single_read, tuner=tuner,
+                   limiter=limiter, ordering=ordering)
+
+    def key(self, f):
+        return posixpath.join(self.prefix, f.path)
+
+    def _throttle(self, request, **kwargs):
+        body = request.body
+        if hasattr(body, 'read'):
+            if not isinstance(body, ratelimit.ThrottledReader):
+                request.body = ratelimit.ThrottledReader(body, self.limiter)
+        elif body:
+            self.limiter.consume(len(body))
+
+    def is_small(self, f):
+        return f.size < self.config.multipart_threshold
+
+    def _multipart_state(self, f):
+        if self.journal is None:
+            return (None, None, {})
+        upload_id, part_size, parts = self.journal.multipart(f.id)
+        return (upload_id, part_size, dict(parts))
+
+    def _timed(self, method, **kwargs):
+        start = time.time()
+        r = method(**kwargs)
+        self.tuner.request_done(time.time() - start)
+        return r
+
+    def _check_unchanged(self, f):
+        # the manifest of a resumed upload, and the parts uploaded before
+        # it was interrupted, are of the file as it was scanned then
+        if self.journal is None or not self.journal.resumed:
+            return
+        st = os.stat(f.original_path)
+        if st.st_size != f.size or (
+                f.mtime is not None and st.st_mtime != f.mtime):
+            raise BigStashError("{} changed since the upload started".format(
+                f.original_path))
+
+    def upload_file(self, f):
+        self.progress.start(f)
+        self._check_unchanged(f)
+        upload_id, part_size, parts = self._multipart_state(f)
+        if upload_id is not None:
+            # journals written before part sizes were recorded
+            part_size = part_size or self.config.multipart_chunksize
+            try:
+                return self._upload_parts(f, upload_id, part_size, parts)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchUpload':
+                    raise
+                log.info("multipart upload of {} expired, restarting".format(
+                    f.original_path))
+                self.progress.update(f, -sum(
+                    self._part_size(f, part_size, n) for n in parts))
+        part_size = self.tuner.part_size_for(f.size)
+        upload_id = self._timed(
+            self.client.create_multipart_upload,
+            Bucket=self.bucket, Key=self.key(f))['UploadId']
+        if self.journal is not None:
+            self.journal.multipart_started(f.id, upload_id, part_size)
+        try:
+            self._upload_parts(f, upload_id, part_size, {})
+        except Exception:
+            if self.journal is None:
+                # nothing can resume it, don't leave the parts behind
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key(f), UploadId=upload_id)
+            raise
+
+    def _part_count(self, f, part_size):
+        return max(1, (f.size + part_size - 1) // part_size)
+
+    def _part_size(self, f, part_size, part_number):
+        return min(part_size, f.size - (part_number - 1) * part_size)
+
+    def _send_part(self, f, upload_id, part_number, body, length):
+        start = time.time()
+        r = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key(f), UploadId=upload_id,
+            PartNumber=part_number, Body=body)
+        self.tuner.part_done(length, time.time() - start)
+        if self.journal is not None:
+            self.journal.part_done(f.id, part_number, r['ETag'])
+        self.progress.update(f, length)
+        return r['ETag']
+
+    def _upload_part(self, f, upload_id, part_size, part_number):
+        length = self._part_size(f, part_size, part_number)
+        offset = (part_number - 1) * part_size
+        with FileChunkReader(f.original_path, offset, length) as body:
+            return self._send_part(f, upload_id, part_number, body, length)
+
+    def _upload_parts(self, f, upload_id, part_size, parts):
+        for n in parts:
+            self.progress.update(f, self._part_size(f, part_size, n))
+        if self.single_read:
+            results = self._upload_read_parts(
+                f, upload_id, part_size, parts)
+        else:
+            missing = [n for n in range(1, self._part_count(f, part_size) + 1)
+                       if n not in parts]
+
+            def upload_part(n):
+                return self._upload_part(f, upload_id, part_size, n)
+            results = imap_unordered(
+                self._part_executor, upload_part, missing,
+                self.tuner.concurrency)
+        for n, etag, error in results:
+            if error is not None:
+                raise error
+            parts[n] = etag
+        self._timed(
+            self.client.complete_multipart_upload,
+            Bucket=self.bucket, Key=self.key(f), UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': n, 'ETag': parts[n]} for n in sorted(parts)]})
+
+    def _acquire_buffers(self, part_size):
+        with self._lock:
+            pool, users = self._part_buffers.get(part_size, (None, 0))
+            if pool is None:
+                pool = BufferPool(
+                    part_size, limit=self.workers + self.tuner.max_concurrency)
+            self._part_buffers[part_size] = (pool, users + 1)
+            return pool
+
+    def _release_buffers(self, part_size):
+        # the tuner may not pick a part size again, so drop its buffers
+        # once no file is using them
+        with self._lock:
+            pool, users = self._part_buffers[part_size]
+            if users > 1:
+                self._part_buffers[part_size] = (pool, users - 1)
+            else:
+                del self._part_buffers[part_size]
+
+    def _upload_read_parts(self, f, upload_id, part_size, parts):
+        # read the parts in order, hashing each one before it is sent.
+        # Parts uploaded before a resume are read for the digest only.
+        digest = hashlib.md5()
+        buffers = self._acquire_buffers(part_size)
+        # buffers of parts read but not picked up by a worker yet, to
+        # give back to the pool if the upload fails and they never are
+        unclaimed = {}
+        lock = threading.Lock()
+
+        def read_parts(fp):
+            for n in range(1, self._part_count(f, part_size) + 1):
+                buf = buffers.get()
+                length = readinto_full(fp, buf)
+                digest.update(memoryview(buf)[:length])
+                if n in parts:
+                    buffers.put(buf)
+                    continue
+                with lock:
+                    unclaimed[n] = buf
+                yield (n, length)
+
+        def upload_part(part):
+            n, length = part
+            with lock:
+                buf = unclaimed.pop(n, None)
+            if buf is None:
+                return None
+            try:
+                body = BufferReader(memoryview(buf)[:length])
+                return self._send_part(f, upload_id, n, body, length)
+            finally:
+                buffers.put(buf)
+
+        try:
+            with io.open(f.original_path, 'rb', buffering=0) as fp:
+                results = imap_unordered(
+                    self._part_executor, upload_part, read_parts(fp),
+                    self.tuner.concurrency)
+                try:
+                    for (n, _), etag, error in results:
+                        yield (n, etag, error)
+                finally:
+                    results.close()
+                    with lock:
+                        for buf in unclaimed.values():
+                            buffers.put(buf)
+                        unclaimed.clear()
+        finally:
+            self._release_buffers(part_size)
+        self.digests[f.id] = digest.hexdigest()
+
+    def upload_small_file(self, f):
+        self.progress.start(f)
+        self._check_unchanged(f)
+        buf = self._buffers.get()
+        try:
+            with io.open(f.original_path, 'rb', buffering=0) as fp:
+                n = readinto_full(fp, buf)
+            if n == len(buf):
+                # the file grew past the threshold since it was scanned
+                return self.upload_file(f)
+            data = memoryview(buf)[:n]
+            md5 = f.md5
+            if self.single_read:
+                md5 = self.digests[f.id] = hashlib.md5(data).hexdigest()
+            kwargs = {}
+            if md5 is not None:
+                kwargs['ContentMD5'] = content_md5(md5)
+            put_object = self.client.put_object
+            if n <= RTT_PROBE_SIZE:
+                # tiny objects take about one round trip
+                put_object = partial(self._timed, put_object)
+            put_object(
+                Bucket=self.bucket, Key=self.key(f),
+                Body=BufferReader(data), **kwargs)
+            self.progress.update(f, n)
+        finally:
+            self._buffers.put(buf)
+
+    def _skip_done(self, files):
+        for f in files:
+            if self.journal is not None and self.journal.is_done(f.id):
+                md5 = self.journal.digest(f.id)
+                if md5 is not None:
+                    self.digests[f.id] = md5
+                self.progress.start(f)
+                self.progress.update(f, f.size)
+                self.progress.done(f)
+            else:
+                yield f
+
+    def run(self, files):
+        """
+        Upload `files` and return a list of (file, exception) tuples for the
+        ones that failed.
+        """
+        if self.ordering is not None:
+            files = self.ordering(files)
+        if self.limiter is None:
+            return self._run(files)
+        # the client may be shared with other schedulers, so throttle its
+        # requests only while this one runs
+        events = self.client.meta.events
+        throttle_id = 'bigstash-throttle-{}'.format(id(self))
+        # throttle the bodies as they are sent, after botocore has read
+        # them for any checksums
+        events.register_first('before-send.s3', self._throttle,
+                              unique_id=throttle_id)
+        try:
+            return self._run(files)
+        finally:
+            events.unregister('before-send.s3', unique_id=throttle_id)
+
+    def _run(self, files):
+        log.info("multipart uploads: {}".format(self.tuner.describe()))
+        self._part_executor = get_executor(
+            self.workers * self.tuner.max_concurrency)
+        with self._part_executor:
+            with get_executor(self.small_workers) as small_executor:
+                with get_executor(self.workers) as executor:
+                    # small files go to the first lane, large to the second
+                    results = imap_routed(
+                        self._skip_done(files),
+                        lambda f: 0 if self.is_small(f) else 1,
+                        [(small_executor, self.upload_small_file,
+                          self.small_workers),
+                         (executor, self.upload_file, self.workers)])
+                    for f, _, error in results:
+                        self._file_done(f, error)
+        log.info("multipart uploads finished with {}".format(
+            self.tuner.describe()))
+        return self.failures
+
+    def _file_done(self, f, error):
+        if error is not None:
+            log.warning("error uploading {}: {}".format(
+                f.original_path, error))
+            self.failures.append((f, error))
+        elif self.journal is not None:
+            self.journal.file_done(f.id, self.digests.get(f.id))
+        self.progress.done(f, error)
@@ -0,0 +1,206 @@
+import time
+import logging
+import threading
+
+log = logging.getLogger('bigstash.tuning')
+
+MB = 1024 * 1024
+
+# S3 limits for multipart uploads
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * 1024 * MB
+
+DEFAULT_PART_SIZE = 8 * MB
+
+DEFAULT_CONCURRENCY = 4
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+# the auto tuner never grows parts beyond this, to bound memory use and the
+# amount of data sent again when a part fails
+MAX_TUNED_PART_SIZE = 128 * MB
+
+# parts should take at least this many round trips to send, so that the
+# per request latency is a small fraction of the transfer time
+PART_RTTS = 20
+
+# or at most this many seconds
+MAX_PART_SECONDS = 60.0
+
+# relative change of throughput that counts as better or worse
+THROUGHPUT_THRESHOLD = 0.05
+
+
+def fit_part_size(size, part_size):
+    """
+    Return the part size to use for a file of `size` bytes: `part_size`,
+    doubled as many times as needed for the file to fit in the maximum
+    number of parts.
+    """
+    part_size = max(part_size, MIN_PART_SIZE)
+    while part_size * MAX_PARTS < size:
+        part_size *= 2
+    return min(part_size, MAX_PART_SIZE)
+
+
+def _mb(size):
+    return '{:g}MB'.format(size / float(MB))
+
+
+class Tuner(object):
+    """
+    Chooses the part size and the number of parts in flight of multipart
+    uploads, given the outcome of the requests made so far. This one
+    keeps them fixed, except for raising the part size of files too large
+    for the maximum number of parts.
+    """
+
+    def __init__(self, part_size=DEFAULT_PART_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY):
+        """
+        :param part_size: the size of each part
+        :param concurrency: the number of parts of a file in flight
+        """
+        self.part_size = part_size
+        self.max_concurrency = concurrency
+        self._concurrency = concurrency
+
+    def part_size_for(self, size):
+        """
+        Return the part size for a new multipart upload of `size` bytes.
+        """
+        return fit_part_size(size, self.part_size)
+
+    def concurrency(self):
+        """
+        Return the number of parts of a file to keep in flight.
+        """
+        return self._concurrency
+
+    def request_done(self, elapsed):
+        """
+        Called with the duration of a request sending little or no data,
+        an estimate of the round trip time.
+        """
+        pass
+
+    def part_done(self, size, elapsed):
+        """
+        Called when a part of `size` bytes was sent in `elapsed` seconds.
+        """
+        pass
+
+    def describe(self):
+        return 'part size {}, {} parts in flight'.format(
+            _mb(self.part_size), self._concurrency)
+
+
+class AutoTuner(Tuner):
+    """
+    Adjusts the part size and the number of parts in flight to the link,
+    every `interval` seconds of uploading.
+
+    The number of parts in flight is hill climbed: it keeps moving in the
+    same direction while the throughput improves, turns back when it gets
+    worse, and stays put while it's about the same. Parts are doubled in
+    size while sending one takes less than `PART_RTTS` round trips, and
+    halved when it takes longer than `MAX_PART_SECONDS`.
+    """
+
+    def __init__(self, part_size=DEFAULT_PART_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 max_part_size=MAX_TUNED_PART_SIZE, tune_part_size=True,
+                 tune_concurrency=True, interval=5.0, clock=time.time):
+        """
+        :param part_size: the initial part size
+        :param concurrency: the initial number of parts in flight
+        :param max_concurrency: the maximum number of parts in flight
+        :param max_part_size: the maximum part size to grow to
+        :param tune_part_size: adjust the part size
+        :param tune_concurrency: adjust the number of parts in flight
+        :param interval: seconds between adjustments
+        :param clock: function returning the current time in seconds
+        """
+        super(AutoTuner, self).__init__(part_size, concurrency)
+        self.max_concurrency = max(max_concurrency, concurrency)
+        self.max_part_size = max(max_part_size, part_size)
+        self.min_part_size = min(part_size, MIN_PART_SIZE)
+        self.tune_part_size = tune_part_size
+        self.tune_concurrency = tune_concurrency
+        self.interval = interval
+        self.rtt = None
+        self.throughput = None
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._step = 1
+        self._reset(clock())
+
+    def _reset(self, now):
+        self._start = now
+        self._bytes = 0
+        self._parts = 0
+        self._part_time = 0.0
+
+    def request_done(self, elapsed):
+        with self._lock:
+            if self.rtt is None:
+                self.rtt = elapsed
+            else:
+                self.rtt = 0.8 * self.rtt + 0.2 * elapsed
+
+    def part_done(self, size, elapsed):
+        with self._lock:
+            self._bytes += size
+            self._parts += 1
+            self._part_time += elapsed
+            now = self._clock()
+            if now - self._start >= self.interval and self._parts > 1:
+                self._adjust(now)
+
+    def _adjust(self, now):
+        throughput = self._bytes / (now - self._start)
+        part_time = self._part_time / self._parts
+        before = (self.part_size, self._concurrency)
+        if self.tune_concurrency:
+            self._climb(throughput)
+        if self.tune_part_size and self.rtt is not None:
+            if (part_time < PART_RTTS * self.rtt and
+                    self.part_size * 2 <= self.max_part_size):
+                self.part_size *= 2
+            elif (part_time > MAX_PART_SECONDS and
+                    self.part_size // 2 >= self.min_part_size):
+                self.part_size //= 2
+        self.throughput = throughput
+        self._reset(now)
+        if (self.part_size, self._concurrency) != before:
+            log.info("tuning: {} ({}/s, {:.1f}s per part, rtt {})".format(
+                self.describe(), _mb(throughput), part_time,
+                '?' if self.rtt is None else
+                '{:.0f}ms'.format(self.rtt * 1000)))
+
+    def _climb(self, throughput):
+        last = self.throughput
+        if last is not None:
+            if throughput < last * (1 - THROUGHPUT_THRESHOLD):
+                self._step = -self._step
+            elif throughput < last * (1 + THROUGHPUT_THRESHOLD):
+                return
+        self._concurrency = min(
+            self.max_concurrency, max(1, self._concurrency + self._step))
+
+
+def from_settings(settings):
+    """
+    Create the tuner for the settings profile. Settings left to None are
+    tuned automatically.
+    """
+    part_size = settings['multipart_chunksize']
+    concurrency = settings['max_concurrency']
+    return AutoTuner(
+        part_size=part_size or DEFAULT_PART_SIZE,
+        concurrency=concurrency or DEFAULT_CONCURRENCY,
+        max_concurrency=concurrency or DEFAULT_MAX_CONCURRENCY,
+        tune_part_size=part_size is None,
+        tune_concurrency=concurrency is None)
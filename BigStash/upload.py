@@ -1,7 +1,13 @@
 """bgst is a command line client to BigStash.co
 
 Usage:
-  bgst put [--ignore-file IGNORE] [-t TITLE] [--silent] [--dont-wait] FILES...
+  bgst put [--ignore-file IGNORE] [-t TITLE] [--silent] [--dont-wait]
+           [--hash-jobs=NUMBER] [--no-hash-cache] [--upload-jobs=NUMBER]
+           [--stream] [--single-read] [--limit-rate=RATE]
+           [--progress=FORMAT] [--order=ORDER] FILES...
+  bgst resume [--silent] [--dont-wait] [--upload-jobs=NUMBER]
+              [--limit-rate=RATE] [--progress=FORMAT] [--order=ORDER]
+              UPLOAD_ID
   bgst settings [--user=USERNAME] [--password=PASSWORD]
   bgst settings --reset
   bgst list [--limit=NUMBER]
@@ -23,32 +29,62 @@ Options:
                                 authentication token.
   --limit=NUMBER                Show up to NUMBER results. [default: 10]
   --ignore-file=IGNORE           Path to a .gitignore like file.
+  --hash-jobs=NUMBER            Hash up to NUMBER files in parallel.
+                                [default: 4]
+  --no-hash-cache               Hash all files even if they are unchanged
+                                since a previous upload.
+  --upload-jobs=NUMBER          Upload up to NUMBER files at a time.
+                                [default: 4]
+  --stream                      Start uploading files while the rest are
+                                still being scanned and hashed.
+  --single-read                 Hash files while uploading them instead of
+                                reading them twice. Only with --stream.
+  --limit-rate=RATE             Upload at most RATE bytes per second, e.g.
+                                500k or 2M, or by time of day, e.g.
+                                09:00-18:00=1M,10M for 1M in office hours.
+  --progress=FORMAT             Show upload progress as text, or as one JSON
+                                object per line with jsonl. [default: text]
+  --order=ORDER                 Upload files in ORDER: largest first,
+                                as listed in the manifest, or by inode or
+                                extent for on-disk locality.
+                                [default: largest]
 """
 
 from __future__ import print_function
-import boto3
 import six
 import sys
 import os
 import errno
 import logging
-import posixpath
-import threading
-import inflect
 from wrapt import decorator
 from BigStash import __version__
 from BigStash.filename import setup_user_ignore
 from BigStash.auth import get_api_credentials
 from BigStash.conf import BigStashAPISettings
 from BigStash import BigStashAPI, BigStashError
-from BigStash.manifest import Manifest
-from boto3.s3.transfer import S3Transfer, TransferConfig
-from retrying import retry
+from BigStash.error import BigStashConnectionError
+from BigStash.manifest import Manifest, common_dir, scan
+from BigStash.models import Upload
+from BigStash.cache import DigestCache
+from BigStash.journal import TransferJournal
+from BigStash.pipeline import StreamingUpload, correct_digests
+from BigStash.ordering import get_ordering, ORDERINGS
+from BigStash.progress import ProgressReporter, RENDERERS
+from BigStash.ratelimit import Schedule
 from docopt import docopt
 
 log = logging.getLogger('bigstash.upload')
 
-peng = inflect.engine()
+_inflect = None
+
+
+def plural(word, count):
+    # inflect is slow to import, only the upload commands load it
+    global _inflect
+    if _inflect is None:
+        import inflect
+        _inflect = inflect.engine()
+    return _inflect.plural(word, count)
 
 
 def smart_str(s):
@@ -74,33 +110,6 @@ def handles_encoding_errors(wrapped, instance, args, kwargs):
         raise
 
 
-class ProgressPercentage(object):
-    def __init__(self, filename):
-        self._filename = smart_str(filename)
-        self._size = os.path.getsize(filename)
-        self._seen_so_far = 0
-        self._lock = threading.Lock()
-
-    def _write_progress(self, wrote, total):
-        percentage = 100
-        if total > 0:
-            percentage = (wrote / float(total)) * 100
-        sys.stdout.write(u"\r{} {} / {} ({:.2f}%)".format(
-            self._filename, wrote, total, percentage))
-        sys.stdout.flush()
-
-    def __call__(self, bytes_amount):
-        # To simplify we'll assume this is hooked up
-        # to a single filename.
-        with self._lock:
-            # because: https://github.com/boto/boto3/issues/98
-            if bytes_amount > 0 and self._seen_so_far == self._size:
-                # assume we are now only starting the actual transfer
-                self._seen_so_far = 0
-            self._seen_so_far += bytes_amount
-            self._write_progress(self._seen_so_far, self._size)
-
-
 def main():
     outenc = sys.stdout.encoding
     if not outenc or outenc.lower() not in ('utf-8', 'cp65001'):
@@ -118,6 +127,24 @@ def main():
 
     settings = BigStashAPISettings.load_settings()
     BigStashAPI.setup_logging(settings)
+    if args.get('--limit-rate'):
+        try:
+            Schedule.parse(args['--limit-rate'])
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        settings['limit_rate'] = args['--limit-rate']
+    if args.get('--progress') and args['--progress'] not in RENDERERS:
+        print("Invalid progress format: {}".format(args['--progress']))
+        sys.exit(1)
+    if args.get('--order') and args['--order'] not in ORDERINGS:
+        print("Invalid upload order: {}".format(args['--order']))
+        sys.exit(1)
+    if args.get('--single-read') and not args.get('--stream'):
+        # the digests are sent once the files are uploaded, with the same
+        # UpdateUploadFiles as the files found while streaming
+        print("--single-read can only be used with --stream")
+        sys.exit(1)
     if os.name == 'nt':
         try:
             import win_unicode_console
@@ -128,6 +155,8 @@ def main():
 
     if args['put']:
         bgst_put(args, settings)
+    elif args['resume']:
+        bgst_resume(args, settings)
     elif args['settings']:
         bgst_settings(args, settings)
     elif args['list']:
@@ -196,19 +225,27 @@ def bgst_settings(args, settings):
 def bgst_put(args, settings):
     try:
         title = args['--title'] if args['--title'] else None
-        opt_silent = False if not args['--silent'] else True
-        opt_dont_wait = False if not args['--dont-wait'] else True
+        opt_silent = quiet(args)
         upload = None
         filepaths = map(smart_str, args['FILES'])
         ignorefile = args['--ignore-file']
         if ignorefile:
             setup_user_ignore(ignorefile)
-        manifest, errors, ignored = Manifest.from_paths(
-            paths=filepaths, title=title)
-        ignored_msg = ''
-        if ignored:
-            ignored_msg = "({} {} ignored)".format(
-                len(ignored), peng.plural("file", len(ignored)))
+        cache = None
+        if not args['--no-hash-cache']:
+            cache = DigestCache.from_settings(settings)
+        try:
+            if args['--stream']:
+                put_streaming(args, settings, list(filepaths), title, cache)
+            manifest, errors, ignored = Manifest.from_paths(
+                paths=filepaths, title=title,
+                workers=int(args['--hash-jobs']), cache=cache)
+        finally:
+            if cache is not None:
+                cache.close()
+                log.info("digest cache: {} hits, {} misses".format(
+                    cache.hits, cache.misses))
+        ignored_msg = ignored_message(ignored)
         if len(manifest) == 0:
             print(" ".join(["No files found", ignored_msg]))
             sys.exit(5)
@@ -219,63 +256,194 @@ def bgst_put(args, settings):
         k, s = get_api_credentials(settings)
         bigstash = BigStashAPI(key=k, secret=s, settings=settings)
         upload = bigstash.CreateUpload(manifest=manifest)
+        journal = TransferJournal.create(settings, upload, manifest)
         filecount = len(manifest)
         if not opt_silent:
             msg = "Uploading {} {} as archive {}..".format(
-                filecount, peng.plural("file", filecount), upload.archive.key)
+                filecount, plural("file", filecount), upload.archive.key)
             print(" ".join([msg, ignored_msg]))
-        s3 = boto3.resource(
-            's3', region_name=upload.s3.region,
-            aws_access_key_id=upload.s3.token_access_key,
-            aws_secret_access_key=upload.s3.token_secret_key,
-            aws_session_token=upload.s3.token_session)
-        config = TransferConfig(
-            multipart_threshold=8 * 1024 * 1024,
-            max_concurrency=10,
-            num_download_attempts=10)
-        transfer = S3Transfer(s3.meta.client, config)
-
-        cb = None
-        for f in manifest:
-            if not opt_silent:
-                cb = ProgressPercentage(f.original_path)
-            transfer.upload_file(
-                f.original_path, upload.s3.bucket,
-                posixpath.join(upload.s3.prefix, f.path),
-                callback=cb)
-            if not opt_silent:
-                print("..OK")
-        bigstash.UpdateUploadStatus(upload, 'uploaded')
-        if opt_dont_wait:
-            sys.stdout.flush()
-            sys.exit(0)
-        if not opt_silent:
-            print("Waiting for {}..".format(upload.url), end="")
+        upload_and_wait(args, bigstash, upload, manifest, journal)
+    except OSError as e:
+        err = "error"
+        if e.filename is not None:
+            err = e.filename
+        msg = "{}: {}".format(err, e.strerror)
+        log.warn(msg, exc_info=True)
+        print(msg)
+        sys.exit(3)
+    except BigStashError as e:
+        log.warn("oops", exc_info=True)
+        print(e)
+        sys.exit(2)
+    except Exception as e:
+        log.error("error", exc_info=True)
+        sys.exit(1)
+
+
+def upload_id(upload):
+    return upload.url.rstrip('/').split('/')[-1]
+
+
+def quiet(args):
+    # messages would get in the way of programs reading jsonl progress
+    return bool(args['--silent']) or args['--progress'] == 'jsonl'
+
+
+def make_progress(args, files=0, size=0):
+    if args['--silent']:
+        return None
+    return ProgressReporter(RENDERERS[args['--progress']](), files, size)
+
+
+def ignored_message(ignored):
+    if not ignored:
+        return ''
+    return "({} {} ignored)".format(
+        len(ignored), plural("file", len(ignored)))
+
+
+def put_streaming(args, settings, paths, title, cache):
+    opt_silent = quiet(args)
+    k, s = get_api_credentials(settings)
+    bigstash = BigStashAPI(key=k, secret=s, settings=settings)
+    base = common_dir(paths)
+    manifest = Manifest(title=title, base=base)
+    errors = []
+    ignored = []
+    if not opt_silent:
+        print(u"Uploading {}..".format(smart_str(base)))
+    progress = make_progress(args)
+
+    def scheduler(upload, journal):
+        from BigStash.transfer import UploadScheduler
+        return UploadScheduler.for_upload(
+            upload, workers=int(args['--upload-jobs']), progress=progress,
+            journal=journal, single_read=args['--single-read'],
+            settings=settings, api=bigstash)
+    pipeline = StreamingUpload(
+        bigstash, manifest, scheduler, settings=settings, progress=progress,
+        ordering=get_ordering(args['--order']))
+    entries = scan(paths, errors, ignored, workers=int(args['--hash-jobs']),
+                   cache=cache, hashing=not args['--single-read'])
+    try:
+        pipeline.run(entries, errors)
+    finally:
+        if progress is not None:
+            progress.close()
+    upload = pipeline.upload
+    if errors:
+        if upload is not None:
+            bigstash.CancelUpload(upload_id(upload))
+            pipeline.journal.remove()
+        errtext = [": ".join(e) for e in errors]
+        print("\n".join(["There were errors:"] + errtext))
+        sys.exit(4)
+    if upload is None:
+        print(" ".join(["No files found", ignored_message(ignored)]))
+        sys.exit(5)
+    if not opt_silent:
+        filecount = len(manifest)
+        msg = "Uploaded {} {} as archive {}..".format(
+            filecount, plural("file", filecount), upload.archive.key)
+        print(" ".join([msg, ignored_message(ignored)]))
+    finish_upload(
+        args, bigstash, upload, manifest, pipeline.journal, pipeline.scheduler)
+
+
+def upload_and_wait(args, bigstash, upload, manifest, journal,
+                    single_read=False):
+    from BigStash.transfer import UploadScheduler
+    progress = make_progress(args, len(manifest), manifest.size)
+    scheduler = UploadScheduler.for_upload(
+        upload, workers=int(args['--upload-jobs']), progress=progress,
+        journal=journal, single_read=single_read,
+        settings=bigstash.settings, api=bigstash,
+        ordering=get_ordering(args['--order']))
+    try:
+        scheduler.run(manifest)
+    finally:
+        if progress is not None:
+            progress.close()
+        journal.close()
+    finish_upload(args, bigstash, upload, manifest, journal, scheduler)
+
+
+def finish_upload(args, bigstash, upload, manifest, journal, scheduler):
+    from retrying import retry
+    opt_silent = quiet(args)
+    opt_dont_wait = False if not args['--dont-wait'] else True
+    failures = scheduler.failures
+    if failures:
+        errtext = [u"{}: {}".format(smart_str(f.original_path), e)
+                   for f, e in failures]
+        print(u"\n".join(["There were errors uploading:"] + errtext))
+        print("Run 'bgst resume {}' to retry.".format(upload_id(upload)))
+        sys.exit(6)
+    corrected = correct_digests(bigstash, upload, manifest, scheduler.digests)
+    if corrected:
+        log.info("updated the digests of {} files".format(len(corrected)))
+    bigstash.UpdateUploadStatus(upload, 'uploaded')
+    journal.remove()
+    if opt_dont_wait:
         sys.stdout.flush()
-        retry_args = {
-            'wait': 'exponential_sleep',
-            'wait_exponential_multiplier': 1000,
-            'wait_exponential_max': 10000,
-            'retry_on_exception': lambda e: not isinstance(e, BigStashError),
-            'retry_on_result': lambda r: r.status not in ('completed', 'error')
-        }
-
-        @retry(**retry_args)
-        def refresh(u):
-            if not opt_silent:
-                print(".", end="")
-                sys.stdout.flush()
-            return bigstash.RefreshUploadStatus(u)
+        sys.exit(0)
+    if not opt_silent:
+        print("Waiting for {}..".format(upload.url), end="")
+    sys.stdout.flush()
+    retry_args = {
+        'wait': 'exponential_sleep',
+        'wait_exponential_multiplier': 1000,
+        'wait_exponential_max': 10000,
+        # keep waiting through timeouts, but not errors of the API
+        'retry_on_exception': lambda e: (
+            isinstance(e, BigStashConnectionError) or
+            not isinstance(e, BigStashError)),
+        'retry_on_result': lambda r: r.status not in ('completed', 'error')
+    }
+
+    @retry(**retry_args)
+    def refresh(u):
         if not opt_silent:
-            print("upload status: ", end="")
-        final_status = refresh(upload).status
-        if not opt_silent:
-            print(final_status)
-        if final_status != 'completed':
-            sys.exit(2)
-        else:
-            sys.exit(0)
+            print(".", end="")
+            sys.stdout.flush()
+        return bigstash.RefreshUploadStatus(u)
+    if not opt_silent:
+        print("upload status: ", end="")
+    final_status = refresh(upload).status
+    if not opt_silent:
+        print(final_status)
+    if final_status != 'completed':
+        sys.exit(2)
+    else:
+        sys.exit(0)
+
 
+@handles_encoding_errors
+def bgst_resume(args, settings):
+    try:
+        k, s = get_api_credentials(settings)
+        bigstash = BigStashAPI(key=k, secret=s, settings=settings)
+        # fetch the upload again for fresh S3 credentials
+        body, headers = bigstash.GetUpload(args['UPLOAD_ID'])
+        upload = Upload(meta=headers, **body)
+        journal = TransferJournal.load(settings, upload.url)
+        if journal is None:
+            print("No interrupted transfer found for upload {}".format(
+                args['UPLOAD_ID']))
+            sys.exit(5)
+        if journal.scanning:
+            print("Upload {} was interrupted before all of its files were "
+                  "found, run bgst put again".format(args['UPLOAD_ID']))
+            sys.exit(4)
+        manifest = journal.manifest()
+        if not quiet(args):
+            remaining = len(manifest) - journal.done_count
+            print("Resuming upload of {} {} to {}..".format(
+                remaining, plural("file", remaining), upload.url))
+        # continue hashing while uploading if the upload was started so
+        single_read = any(f.md5 is None for f in manifest)
+        upload_and_wait(args, bigstash, upload, manifest, journal,
+                        single_read=single_read)
     except OSError as e:
         err = "error"
         if e.filename is not None:
@@ -288,7 +456,7 @@ def bgst_put(args, settings):
         log.warn("oops", exc_info=True)
         print(e)
         sys.exit(2)
-    except Exception as e:
+    except Exception:
         log.error("error", exc_info=True)
         sys.exit(1)
 
@@ -0,0 +1,76 @@
+import os
+import stat
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class _DirEntry(object):
+    """
+    Minimal stand in for `os.DirEntry` on pythons without scandir.
+    """
+    __slots__ = ('name', 'path', '_stat')
+
+    def __init__(self, top, name):
+        self.name = name
+        self.path = os.path.join(top, name)
+        self._stat = None
+
+    def stat(self, follow_symlinks=False):
+        if self._stat is None:
+            self._stat = os.lstat(self.path)
+        return self._stat
+
+    def is_dir(self, follow_symlinks=False):
+        return stat.S_ISDIR(self.stat().st_mode)
+
+
+def _listdir(top):
+    return (_DirEntry(top, name) for name in os.listdir(top))
+
+
+def walk(top, onerror=None, include_dir=None):
+    """
+    Walk the tree under `top` and yield a (path, stat) tuple for each entry
+    that is not a directory, in the same order as a top down `os.walk`.
+
+    Each entry is stat-ed at most once, without following symbolic links,
+    and directory entries are recognized without a stat call where the
+    platform's scandir can do that.
+
+    :param top: the directory to walk
+    :param onerror: optional function called with an `OSError` for each
+                    directory that can't be listed
+    :param include_dir: optional function called with the path of each
+                        subdirectory, which is skipped unless it returns
+                        True
+    """
+    listdir = scandir or _listdir
+    stack = [top]
+    while stack:
+        path = stack.pop()
+        try:
+            entries = list(listdir(path))
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            continue
+        dirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if include_dir is None or include_dir(entry.path):
+                        dirs.append(entry.path)
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError as e:
+                if onerror is not None:
+                    onerror(e)
+                continue
+            yield (entry.path, st)
+        stack.extend(reversed(dirs))
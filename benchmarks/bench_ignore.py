@@ -0,0 +1,101 @@
+"""Benchmark gitignore matching.
+
+Usage:
+  bench_ignore.py [--patterns=NUMBER] [--paths=NUMBER] [--fnmatch=NUMBER]
+                  [--seed=SEED]
+
+Options:
+  --patterns=NUMBER     Number of generated patterns. [default: 2000]
+  --paths=NUMBER        Number of generated paths. [default: 1000000]
+  --fnmatch=NUMBER      Number of paths to also match with one fnmatch call
+                        per pattern and path component. [default: 1000]
+  --seed=SEED           Random seed. [default: 42]
+"""
+from __future__ import print_function, division
+import time
+import random
+import fnmatch
+from docopt import docopt
+from BigStash.ignore import GitIgnore
+
+WORDS = ['src', 'lib', 'build', 'node_modules', 'docs', 'test', 'photos',
+         'cache', 'tmp', 'vendor', 'assets', 'backup', 'data', 'logs']
+
+EXTS = ['.c', '.py', '.log', '.jpg', '.tmp', '.o', '.txt', '.tar.gz', '.bak']
+
+
+def make_patterns(rnd, count):
+    patterns = []
+    for i in range(count):
+        word = '{}{}'.format(rnd.choice(WORDS), i)
+        ext = rnd.choice(EXTS)
+        kind = rnd.random()
+        if kind < 0.3:
+            p = word
+        elif kind < 0.5:
+            p = '*{}{}'.format(i, ext)
+        elif kind < 0.6:
+            p = word + '/'
+        elif kind < 0.7:
+            p = '/{}/{}'.format(rnd.choice(WORDS), word)
+        elif kind < 0.8:
+            p = '{}/**/*{}'.format(word, ext)
+        elif kind < 0.9:
+            p = '{}?{}'.format(word, ext)
+        else:
+            p = '!{}{}'.format(word, ext)
+        patterns.append(p)
+    return patterns + ['*.log', 'node_modules/', '!keep.log']
+
+
+def make_paths(rnd, count):
+    for i in range(count):
+        depth = rnd.randint(1, 8)
+        parts = [rnd.choice(WORDS) for _ in range(depth - 1)]
+        parts.append('file{}{}'.format(rnd.randint(0, 5000),
+                                       rnd.choice(EXTS)))
+        yield '/'.join(parts)
+
+
+def bench_gitignore(patterns, paths):
+    start = time.time()
+    matcher = GitIgnore(patterns)
+    compiled = time.time()
+    ignored = sum(1 for p in paths if matcher(p))
+    done = time.time()
+    return compiled - start, done - compiled, ignored
+
+
+def bench_fnmatch(patterns, paths):
+    start = time.time()
+    ignored = 0
+    for path in paths:
+        for c in path.split('/'):
+            if any(fnmatch.fnmatch(c, p) for p in patterns):
+                ignored += 1
+                break
+    return time.time() - start, ignored
+
+
+def main():
+    args = docopt(__doc__)
+    rnd = random.Random(int(args['--seed']))
+    patterns = make_patterns(rnd, int(args['--patterns']))
+    paths = list(make_paths(rnd, int(args['--paths'])))
+    print("{} patterns, {} paths".format(len(patterns), len(paths)))
+
+    compile_time, match_time, ignored = bench_gitignore(patterns, paths)
+    print("GitIgnore: compile {:.3f}s, match {:.3f}s "
+          "({:.0f} paths/s, {} ignored)".format(
+              compile_time, match_time, len(paths) / match_time, ignored))
+
+    sample = paths[:int(args['--fnmatch'])]
+    if sample:
+        fn_time, _ = bench_fnmatch(patterns, sample)
+        print("fnmatch per component: {:.3f}s for {} paths "
+              "({:.0f} paths/s)".format(
+                  fn_time, len(sample), len(sample) / fn_time))
+
+
+if __name__ == '__main__':
+    main()
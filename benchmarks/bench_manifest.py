@@ -0,0 +1,72 @@
+"""Benchmark manifest memory use.
+
+Usage:
+  bench_manifest.py [--files=NUMBER] [--dirs=NUMBER]
+
+Options:
+  --files=NUMBER        Number of synthetic files. [default: 200000]
+  --dirs=NUMBER         Number of distinct directories. [default: 2000]
+"""
+from __future__ import print_function, division
+import gc
+import sys
+import time
+import hashlib
+from docopt import docopt
+from BigStash import models
+from BigStash.manifest import Manifest
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def records(files, dirs):
+    for i in range(files):
+        yield ('/home/user/archive/dir{:05d}/sub/file{:08d}.jpg'.format(
+            i % dirs, i), 200000 + i, 1400000000.0 + i,
+            hashlib.md5(str(i).encode('ascii')).hexdigest())
+
+
+def build_files(files, dirs):
+    # the way manifests used to be stored: a dict of File models
+    return dict(
+        (i, models.File(original_path=p, size=s, last_modified=m, md5=d))
+        for i, (p, s, m, d) in enumerate(records(files, dirs), start=1))
+
+
+def build_manifest(files, dirs):
+    manifest = Manifest()
+    for p, s, m, d in records(files, dirs):
+        manifest._add(p, s, m, d)
+    return manifest
+
+
+def measure(build, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    obj = build(*args)
+    elapsed = time.time() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size, elapsed
+
+
+def main():
+    args = docopt(__doc__)
+    if tracemalloc is None:
+        sys.exit("tracemalloc is required (python 3.4+)")
+    files, dirs = int(args['--files']), int(args['--dirs'])
+    print("{} files in {} directories".format(files, dirs))
+    for name, build in (('dict of File', build_files),
+                        ('Manifest', build_manifest)):
+        size, elapsed = measure(build, files, dirs)
+        print("{:<14} {:>8.1f} MB {:>8.0f} bytes/file {:>6.2f}s".format(
+            name, size / 2**20, size / files, elapsed))
+
+
+if __name__ == '__main__':
+    main()
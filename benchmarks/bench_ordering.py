@@ -0,0 +1,134 @@
+"""Benchmark the upload orderings on a synthetic tree.
+
+Uploads a tree of mostly small files plus a few large ones, listed
+last, to an in-process S3 stand-in whose requests are delayed as if
+each connection had a fixed bandwidth. Reports how long each ordering
+takes, and how far the disk would have to seek between files uploaded
+one after the other, where the file system tells where files are.
+
+Usage:
+  bench_ordering.py [--files=NUMBER] [--size=BYTES] [--large=NUMBER]
+                    [--large-size=BYTES] [--latency=SECONDS]
+                    [--bandwidth=BYTES] [--workers=NUMBER]
+                    [--orders=NAMES]
+
+Options:
+  --files=NUMBER        Number of small files. [default: 200]
+  --size=BYTES          Average size of the small files. [default: 100000]
+  --large=NUMBER        Number of large files. [default: 2]
+  --large-size=BYTES    Size of each large file. [default: 33554432]
+  --latency=SECONDS     Delay added to every S3 request. [default: 0.02]
+  --bandwidth=BYTES     Bytes per second of each connection.
+                        [default: 4194304]
+  --workers=NUMBER      Files to upload at a time. [default: 4]
+  --orders=NAMES        Comma separated orderings to compare.
+                        [default: manifest,largest,inode,extent]
+"""
+from __future__ import print_function, division
+import os
+import time
+import random
+import shutil
+import tempfile
+from docopt import docopt
+from BigStash import models
+from BigStash.manifest import Manifest
+from BigStash.ordering import get_ordering, physical_offset
+from BigStash.transfer import (
+    UploadScheduler, UploadProgress, get_s3_client)
+
+try:
+    from moto import mock_s3
+except ImportError:
+    from moto import mock_aws as mock_s3
+
+
+def make_tree(root, files, size, large, large_size):
+    rand = random.Random(0)
+    paths = []
+    for i in range(files):
+        d = os.path.join(root, 'd{:02d}'.format(i % 10))
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        path = os.path.join(d, 'f{:05d}'.format(i))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(int(rand.expovariate(1.0 / size))))
+            # allocate the file on disk, for its extents to be known
+            os.fsync(f.fileno())
+        paths.append(path)
+    for i in range(large):
+        path = os.path.join(root, 'large{}'.format(i))
+        with open(path, 'wb') as f:
+            for _ in range(large_size // 2**20):
+                f.write(os.urandom(2**20))
+            os.fsync(f.fileno())
+        paths.append(path)
+    return paths
+
+
+class StartOrder(UploadProgress):
+    def __init__(self):
+        self.paths = []
+
+    def start(self, f):
+        self.paths.append(f.original_path)
+
+
+def seek_distance(paths):
+    # empty files and those the file system can't locate don't count
+    offsets = [o for o in map(physical_offset, paths) if o is not None]
+    if not offsets:
+        return None
+    return sum(abs(b - a) for a, b in zip(offsets, offsets[1:]))
+
+
+def main():
+    args = docopt(__doc__)
+    latency = float(args['--latency'])
+    bandwidth = float(args['--bandwidth'])
+    workers = int(args['--workers'])
+    root = tempfile.mkdtemp()
+    mock = mock_s3()
+    mock.start()
+    try:
+        paths = make_tree(root, int(args['--files']), int(args['--size']),
+                          int(args['--large']), int(args['--large-size']))
+        manifest, _, _ = Manifest.from_paths(paths, workers=4)
+        token = models.BucketToken(
+            bucket='bench', prefix='upload/', region='us-east-1',
+            token_access_key='key', token_secret_key='secret',
+            token_session='session')
+        client = get_s3_client(token, max_pool_connections=64)
+        client.create_bucket(Bucket='bench')
+
+        def delay(request, **kwargs):
+            headers = request.headers
+            size = int(headers.get('X-Amz-Decoded-Content-Length') or
+                       headers.get('Content-Length') or 0)
+            time.sleep(latency + size / bandwidth)
+        client.meta.events.register('before-send.s3', delay)
+        print("{} files, {:.1f}MB, {:.0f}ms per request, {:.1f}MB/s "
+              "per connection".format(
+                  len(manifest), manifest.size / 2**20, latency * 1000,
+                  bandwidth / 2**20))
+        for name in args['--orders'].split(','):
+            progress = StartOrder()
+            scheduler = UploadScheduler(
+                client, token, workers=workers, progress=progress,
+                ordering=get_ordering(name))
+            start = time.time()
+            failures = scheduler.run(manifest)
+            elapsed = time.time() - start
+            assert not failures, failures
+            distance = seek_distance(progress.paths)
+            print("{:<10} {:>7.2f}s {:>7.1f} MB/s  seeks {}".format(
+                name, elapsed, manifest.size / elapsed / 2**20,
+                '?' if distance is None else
+                '{:.1f}GB'.format(distance / 2**30)))
+    finally:
+        mock.stop()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""Benchmark bgst put end to end against the stand-ins of fakes.py.
+
+Runs bgst put over synthetic trees with each set of options, in a child
+process per run so that the peak memory of each is measured on its own,
+and reports the median of the repeats of each. The S3 stand-in runs in
+the same process, so peak memory includes its copy of the data.
+
+Trees:
+  tiny    many files of a few KB each
+  huge    a few files of 64MB each
+  deep    small files in a deep hierarchy
+
+Usage:
+  bench_put.py [--trees=NAMES] [--options=SETS] [--repeat=NUMBER]
+               [--scale=FACTOR] [--api-latency=SECONDS]
+               [--s3-latency=SECONDS] [--bandwidth=BYTES] [--json]
+  bench_put.py run [--put=OPTIONS] [--api-latency=SECONDS]
+                   [--s3-latency=SECONDS] [--bandwidth=BYTES] ROOT
+
+Options:
+  --trees=NAMES           Comma separated trees to upload.
+                          [default: tiny,huge,deep]
+  --options=SETS          Semicolon separated sets of bgst put options to
+                          compare. [default: ;--stream;--single-read]
+  --repeat=NUMBER         Runs of each tree and set of options.
+                          [default: 3]
+  --scale=FACTOR          Multiply the number of files of each tree.
+                          [default: 1]
+  --api-latency=SECONDS   Delay added to every API request. [default: 0.01]
+  --s3-latency=SECONDS    Delay added to every S3 request. [default: 0.01]
+  --bandwidth=BYTES       Bytes per second of the link to S3, 0 for no
+                          limit. [default: 0]
+  --json                  Print the results as one JSON object per line.
+  --put=OPTIONS           Options for bgst put. [default: ]
+"""
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+from docopt import docopt
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+KB = 1024
+MB = 1024 * KB
+
+
+def _write(path, size, rand):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    with open(path, 'wb') as f:
+        # a random block repeated, much cheaper than random bytes throughout
+        block = bytes(bytearray(rand.getrandbits(8) for _ in range(KB)))
+        while size > 0:
+            f.write(block[:size])
+            size -= KB
+
+
+def tiny_tree(root, scale, rand):
+    for i in range(5000 * scale):
+        _write(os.path.join(root, 'd{:03d}'.format(i % 50),
+                            'f{:06d}.txt'.format(i)),
+               rand.randint(1 * KB, 4 * KB), rand)
+
+
+def huge_tree(root, scale, rand):
+    for i in range(3 * scale):
+        _write(os.path.join(root, 'huge{}.bin'.format(i)), 64 * MB, rand)
+
+
+def deep_tree(root, scale, rand):
+    for i in range(2000 * scale):
+        parts = ['l{}-{}'.format(level, rand.randint(0, 2))
+                 for level in range(10)]
+        _write(os.path.join(root, *parts + ['f{:06d}'.format(i)]),
+               16 * KB, rand)
+
+
+TREES = {
+    'tiny': tiny_tree,
+    'huge': huge_tree,
+    'deep': deep_tree,
+}
+
+
+def max_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return rss if sys.platform == 'darwin' else rss * KB
+
+
+def run(args):
+    from fakes import FakeBigStashAPI, FakeS3
+    bandwidth = float(args['--bandwidth']) or None
+    config = tempfile.mkdtemp()
+    try:
+        with FakeS3(latency=float(args['--s3-latency']),
+                    bandwidth=bandwidth) as s3:
+            with FakeBigStashAPI(
+                    s3, latency=float(args['--api-latency'])) as api:
+                os.environ.update({
+                    'BS_API_URL': api.base_url,
+                    'BS_CONFIG_ROOT': config,
+                    'BS_API_KEY': 'key',
+                    'BS_API_SECRET': 'secret',
+                })
+                from BigStash import upload
+                sys.argv = ['bgst', 'put', '--silent'] + \
+                    args['--put'].split() + [args['ROOT']]
+                stdout = sys.stdout
+                sys.stdout = open(os.devnull, 'w')
+                start = time.time()
+                try:
+                    upload.main()
+                    code = 0
+                except SystemExit as e:
+                    code = e.code
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                elapsed = time.time() - start
+        print(json.dumps({
+            'code': code,
+            'elapsed': elapsed,
+            'api_requests': api.requests,
+            's3_requests': s3.requests,
+            's3_bytes': s3.bytes,
+            'max_rss': max_rss(),
+        }))
+    finally:
+        shutil.rmtree(config)
+
+
+def run_child(args, root, options):
+    cmd = [sys.executable, os.path.abspath(__file__), 'run',
+           '--put=' + options, root]
+    for opt in ('--api-latency', '--s3-latency', '--bandwidth'):
+        cmd.append('{}={}'.format(opt, args[opt]))
+    out = subprocess.check_output(cmd)
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def tree_stats(root):
+    files = size = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(dirpath, name))
+    return files, size
+
+
+def main():
+    args = docopt(__doc__)
+    if args['run']:
+        return run(args)
+    scale = int(args['--scale'])
+    repeat = int(args['--repeat'])
+    if not args['--json']:
+        print("{:<6} {:<16} {:>8} {:>10} {:>8} {:>6} {:>6} {:>8}".format(
+            'tree', 'options', 'time', 'files/s', 'MB/s', 'api', 's3',
+            'rss MB'))
+    for name in args['--trees'].split(','):
+        root = tempfile.mkdtemp()
+        try:
+            TREES[name](root, scale, random.Random(0))
+            files, size = tree_stats(root)
+            for options in args['--options'].split(';'):
+                runs = [run_child(args, root, options)
+                        for _ in range(repeat)]
+                failed = [r for r in runs if r['code'] != 0]
+                if failed:
+                    raise SystemExit("bgst put {} of {} tree exited "
+                                     "with {}".format(options, name,
+                                                      failed[0]['code']))
+                result = dict(runs[0], tree=name, options=options,
+                              files=files, size=size,
+                              elapsed=median(r['elapsed'] for r in runs),
+                              max_rss=median(r['max_rss'] or 0
+                                             for r in runs))
+                if args['--json']:
+                    print(json.dumps(result, sort_keys=True))
+                    continue
+                elapsed = result['elapsed']
+                print("{:<6} {:<16} {:>7.2f}s {:>10.1f} {:>8.1f} {:>6} "
+                      "{:>6} {:>8.1f}".format(
+                          name, options or '(default)', elapsed,
+                          files / elapsed, size / elapsed / MB,
+                          result['api_requests'], result['s3_requests'],
+                          result['max_rss'] / MB))
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
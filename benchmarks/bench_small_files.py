@@ -0,0 +1,96 @@
+"""Benchmark uploading many small files to an in-process S3 stand-in.
+
+Compares the per-file S3Transfer loop bgst put used to run with the
+UploadScheduler small file path.
+
+Usage:
+  bench_small_files.py [--files=NUMBER] [--size=BYTES] [--latency=SECONDS]
+                       [--workers=NUMBER]
+
+Options:
+  --files=NUMBER        Number of files. [default: 500]
+  --size=BYTES          Size of each file. [default: 200000]
+  --latency=SECONDS     Delay added to every S3 request. [default: 0.02]
+  --workers=NUMBER      Small file workers for the scheduler. [default: 16]
+"""
+from __future__ import print_function, division
+import os
+import time
+import shutil
+import tempfile
+import posixpath
+from docopt import docopt
+from boto3.s3.transfer import S3Transfer, TransferConfig
+from BigStash import models
+from BigStash.manifest import Manifest
+from BigStash.transfer import (
+    UploadScheduler, get_s3_client, DEFAULT_TRANSFER_CONFIG)
+
+try:
+    from moto import mock_s3
+except ImportError:
+    from moto import mock_aws as mock_s3
+
+
+def make_tree(root, files, size):
+    for i in range(files):
+        d = os.path.join(root, 'd{:03d}'.format(i % 100))
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        with open(os.path.join(d, 'f{:06d}.jpg'.format(i)), 'wb') as f:
+            f.write(os.urandom(size))
+
+
+def per_file_loop(client, token, manifest):
+    transfer = S3Transfer(client, TransferConfig(**DEFAULT_TRANSFER_CONFIG))
+    for f in manifest:
+        transfer.upload_file(f.original_path, token.bucket,
+                             posixpath.join(token.prefix, f.path))
+
+
+def scheduler(client, token, manifest, workers):
+    failures = UploadScheduler(
+        client, token, small_workers=workers).run(manifest)
+    assert not failures, failures
+
+
+def main():
+    args = docopt(__doc__)
+    files, size = int(args['--files']), int(args['--size'])
+    latency = float(args['--latency'])
+    root = tempfile.mkdtemp()
+    mock = mock_s3()
+    mock.start()
+    try:
+        make_tree(root, files, size)
+        manifest, _, _ = Manifest.from_paths([root], workers=4)
+        token = models.BucketToken(
+            bucket='bench', prefix='upload/', region='us-east-1',
+            token_access_key='key', token_secret_key='secret',
+            token_session='session')
+        client = get_s3_client(token, max_pool_connections=64)
+        client.create_bucket(Bucket='bench')
+
+        def delay(**kwargs):
+            time.sleep(latency)
+        client.meta.events.register('before-send.s3', delay)
+        print("{} files of {} bytes, {:.0f}ms per request".format(
+            files, size, latency * 1000))
+        for name, run in (
+                ('per file loop', lambda: per_file_loop(
+                    client, token, manifest)),
+                ('scheduler', lambda: scheduler(
+                    client, token, manifest, int(args['--workers'])))):
+            start = time.time()
+            run()
+            elapsed = time.time() - start
+            print("{:<14} {:>7.2f}s {:>8.1f} files/s {:>7.1f} MB/s".format(
+                name, elapsed, files / elapsed,
+                files * size / elapsed / 2**20))
+    finally:
+        mock.stop()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
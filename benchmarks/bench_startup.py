@@ -0,0 +1,120 @@
+"""Benchmark the startup time of the bgst commands that don't upload.
+
+Runs each command against the API stand-in of fakes.py with python -X
+importtime, and reports the time spent importing modules, the number of
+modules imported and the total run time of the fastest run. Exits with
+an error if a command spends longer than the budget importing modules,
+or imports any of the modules only uploads need, like boto3.
+
+Needs Python 3.7 or later, for -X importtime.
+
+Usage:
+  bench_startup.py [--budget=MS] [--repeat=NUMBER] [--json]
+
+Options:
+  --budget=MS         Import time budget of each command in milliseconds.
+                      [default: 400]
+  --repeat=NUMBER     Runs of each command. [default: 5]
+  --json              Print the results as one JSON object per line.
+"""
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from docopt import docopt
+
+# only bgst put and bgst resume may import these
+UPLOAD_MODULES = ('boto3', 'botocore', 's3transfer', 'inflect', 'retrying')
+
+COMMANDS = [
+    ('version', ['--version']),
+    ('list', ['list']),
+    ('info', ['info', '1']),
+    ('files', ['files', '1']),
+    ('notifications', ['notifications']),
+]
+
+
+def import_times(stderr):
+    """
+    Parse the output of -X importtime into a dict of the time each module
+    took to import itself, in seconds.
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_us) / 1e6
+    return times
+
+
+def run_command(args, env):
+    cmd = [sys.executable, '-X', 'importtime', '-m', 'BigStash.upload']
+    start = time.time()
+    p = subprocess.Popen(cmd + args, env=env, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    out, err = p.communicate()
+    elapsed = time.time() - start
+    if p.returncode != 0:
+        raise SystemExit("bgst {} exited with {}:\n{}{}".format(
+            ' '.join(args), p.returncode, out, err))
+    return elapsed, import_times(err)
+
+
+def main():
+    args = docopt(__doc__)
+    if sys.version_info < (3, 7):
+        raise SystemExit("python -X importtime needs Python 3.7 or later")
+    from fakes import FakeBigStashAPI
+    budget = float(args['--budget']) / 1000
+    config = tempfile.mkdtemp()
+    failures = []
+    try:
+        with FakeBigStashAPI(None) as api:
+            for i in range(20):
+                api.add_upload('archive {}'.format(i), [
+                    {'id': str(n), 'path': 'f{}'.format(n), 'size': n}
+                    for n in range(50)], status='completed')
+            env = dict(os.environ, BS_API_URL=api.base_url,
+                       BS_CONFIG_ROOT=config, BS_API_KEY='key',
+                       BS_API_SECRET='secret', PYTHONIOENCODING='utf-8')
+            if not args['--json']:
+                print("{:<14} {:>10} {:>8} {:>10}".format(
+                    'command', 'imports', 'modules', 'total'))
+            for name, argv in COMMANDS:
+                runs = [run_command(argv, env)
+                        for _ in range(int(args['--repeat']))]
+                elapsed, times = min(
+                    runs, key=lambda run: sum(run[1].values()))
+                imports = sum(times.values())
+                heavy = sorted(set(m.split('.')[0] for m in times) &
+                               set(UPLOAD_MODULES))
+                if imports > budget:
+                    failures.append("{} spent {:.0f}ms importing".format(
+                        name, imports * 1000))
+                if heavy:
+                    failures.append("{} imported {}".format(
+                        name, ', '.join(heavy)))
+                if args['--json']:
+                    print(json.dumps({
+                        'command': name, 'imports': imports,
+                        'modules': len(times), 'elapsed': elapsed,
+                        'upload_modules': heavy}, sort_keys=True))
+                else:
+                    print("{:<14} {:>8.0f}ms {:>8} {:>8.0f}ms".format(
+                        name, imports * 1000, len(times), elapsed * 1000))
+    finally:
+        shutil.rmtree(config)
+    if failures:
+        raise SystemExit("\n".join(
+            ["Startup budget of {:.0f}ms exceeded:".format(budget * 1000)] +
+            failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""In-process stand-ins for the BigStash API and S3, for benchmarks.
+
+:class:`FakeBigStashAPI` serves the endpoints :class:`BigStashAPI` uses to
+upload over HTTP on localhost, so that requests, including the streamed
+manifest, go through the same session and sockets as against the real
+API. :class:`FakeS3` keeps the objects in memory with moto, and both can
+delay requests to simulate a slower link.
+"""
+from __future__ import division
+import re
+import json
+import time
+import threading
+import itertools
+from datetime import datetime, timedelta
+from six.moves import BaseHTTPServer, socketserver
+from BigStash import transfer
+from BigStash.ratelimit import TokenBucket
+
+try:
+    from moto import mock_s3
+except ImportError:
+    from moto import mock_aws as mock_s3
+
+_UPLOAD = re.compile(r'^uploads/(\d+)/$')
+
+_ARCHIVE = re.compile(r'^archives/(\d+)/$')
+
+_ARCHIVE_FILES = re.compile(r'^archives/(\d+)/files/$')
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    break
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def _handle(self):
+        path = self.path.split('?')[0]
+        prefix = self.api.path
+        if not path.startswith(prefix):
+            status, body = 404, {'detail': 'Not found.'}
+        else:
+            status, body = self.api.handle(
+                self.command, path[len(prefix):], self._body())
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+
+def _page(results):
+    return {'count': len(results), 'next': None, 'previous': None,
+            'results': results}
+
+
+class FakeBigStashAPI(object):
+    """
+    The upload endpoints of the BigStash API, and the archive and
+    notification lists. Uploads are marked completed as soon as the
+    client marks them uploaded, if every file of their manifest was
+    uploaded to `s3`, and as errors otherwise. Each upload has an
+    archive with the same id.
+    """
+
+    path = '/api/v1/'
+
+    def __init__(self, s3, latency=0.0, token_lifetime=3600):
+        """
+        :param s3: the :class:`FakeS3` uploads go to, None if nothing
+            will be uploaded
+        :param latency: seconds to delay every response by
+        :param token_lifetime: seconds until upload credentials expire
+        """
+        self.s3 = s3
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.uploads = {}
+        self.requests = 0
+        self.base_url = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        handler = type('Handler', (_Handler,), {'api': self})
+        self._server = _Server(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base_url = 'http://127.0.0.1:{}{}'.format(
+            self._server.server_address[1], self.path)
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _archive(self, upload):
+        return {
+            'key': 'BENCH{:05d}'.format(upload['id']),
+            'url': '{}archives/{}/'.format(self.base_url, upload['id']),
+            'title': upload['title'],
+            'size': sum(f['size'] for f in upload['files'].values()),
+            'status': 'uploading' if upload['status'] == 'pending' else
+                      upload['status'],
+            'created': upload['created'],
+            'files': '{}archives/{}/files/'.format(
+                self.base_url, upload['id']),
+        }
+
+    def _notification(self, upload):
+        return {
+            'id': upload['id'],
+            'created': upload['created'],
+            'status': 'info',
+            'verb': 'created archive',
+        }
+
+    def _upload(self, upload):
+        expiration = datetime.utcnow() + timedelta(
+            seconds=self.token_lifetime)
+        return {
+            'url': '{}uploads/{}/'.format(self.base_url, upload['id']),
+            'status': upload['status'],
+            'archive': self._archive(upload),
+            'comment': '',
+            's3': {
+                'bucket': self.s3.bucket if self.s3 else 'bench',
+                'prefix': upload['prefix'],
+                'region': self.s3.region if self.s3 else 'us-east-1',
+                'token_access_key': 'key',
+                'token_secret_key': 'secret',
+                'token_session': 'session',
+                'token_expiration': expiration.strftime(
+                    '%Y-%m-%dT%H:%M:%SZ'),
+            },
+        }
+
+    def _add_files(self, upload, files):
+        for f in files:
+            upload['files'][f['id']] = {'path': f['path'], 'size': f['size']}
+
+    def add_upload(self, title=None, files=(), status='pending'):
+        """
+        Add an upload of `files`, a list of dicts with the `id`, `path`
+        and `size` of each file, and return it.
+        """
+        upload = {
+            'id': next(self._ids),
+            'title': title,
+            'status': status,
+            'files': {},
+            'created': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+        upload['prefix'] = 'upload/{}/'.format(upload['id'])
+        self._add_files(upload, files)
+        self.uploads[upload['id']] = upload
+        return upload
+
+    def _create(self, manifest):
+        upload = self.add_upload(manifest.get('title'), manifest['files'])
+        return 201, self._upload(upload)
+
+    def _update(self, upload, patch):
+        if upload['status'] != 'pending':
+            return 400, {'detail': 'Upload is {}.'.format(upload['status'])}
+        self._add_files(upload, patch.get('files', ()))
+        if patch.get('status') == 'uploaded':
+            keys = self.s3.keys(upload['prefix'])
+            missing = [f['path'] for f in upload['files'].values()
+                       if upload['prefix'] + f['path'] not in keys]
+            upload['status'] = 'error' if missing else 'completed'
+        return 200, self._upload(upload)
+
+    def handle(self, method, path, body):
+        """
+        Return the status and JSON body of the response to a request.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            if path == '' and method == 'GET':
+                return 200, {
+                    'uploads': self.base_url + 'uploads/',
+                    'archives': self.base_url + 'archives/',
+                    'notifications': self.base_url + 'notifications/',
+                }
+            if path == 'uploads/' and method == 'POST':
+                return self._create(body)
+            uploads = [self.uploads[k] for k in sorted(self.uploads)]
+            if path == 'archives/' and method == 'GET':
+                return 200, _page([self._archive(u) for u in uploads])
+            if path == 'notifications/' and method == 'GET':
+                return 200, _page([self._notification(u) for u in uploads])
+            m = (_UPLOAD.match(path) or _ARCHIVE.match(path) or
+                 _ARCHIVE_FILES.match(path))
+            upload = self.uploads.get(int(m.group(1))) if m else None
+            if upload is None:
+                return 404, {'detail': 'Not found.'}
+            if m.re is _ARCHIVE and method == 'GET':
+                return 200, self._archive(upload)
+            if m.re is _ARCHIVE_FILES and method == 'GET':
+                return 200, _page(list(upload['files'].values()))
+            if m.re is _UPLOAD:
+                if method == 'GET':
+                    return 200, self._upload(upload)
+                if method == 'PATCH':
+                    return self._update(upload, body)
+                if method == 'DELETE':
+                    del self.uploads[upload['id']]
+                    return 204, None
+            return 405, {'detail': 'Method not allowed.'}
+
+
+class FakeS3(object):
+    """
+    An S3 bucket kept in memory by moto. Requests of the clients the
+    upload scheduler creates are delayed by `latency` and share a link of
+    `bandwidth` bytes per second.
+    """
+
+    def __init__(self, bucket='bench', region='us-east-1', latency=0.0,
+                 bandwidth=None):
+        """
+        :param bucket: the name of the bucket uploads go to
+        :param region: the region of the bucket
+        :param latency: seconds to delay every request by
+        :param bandwidth: bytes per second of all requests together, None
+            for no limit
+        """
+        self.bucket = bucket
+        self.region = region
+        self.latency = latency
+        self.link = None
+        if bandwidth:
+            self.link = TokenBucket(bandwidth)
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._mock = mock_s3()
+        self._client = None
+        self._get_s3_client = None
+
+    def _delay(self, request, **kwargs):
+        headers = request.headers
+        size = int(headers.get('X-Amz-Decoded-Content-Length') or
+                   headers.get('Content-Length') or 0)
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+        if self.latency:
+            time.sleep(self.latency)
+        if self.link is not None:
+            self.link.consume(size)
+
+    def start(self):
+        self._mock.start()
+        import boto3
+        self._client = boto3.client('s3', region_name=self.region)
+        self._client.create_bucket(Bucket=self.bucket)
+        self._get_s3_client = get_s3_client = transfer.get_s3_client
+
+        def delayed_client(*args, **kwargs):
+            client = get_s3_client(*args, **kwargs)
+            client.meta.events.register('before-send.s3', self._delay)
+            return client
+        transfer.get_s3_client = delayed_client
+        return self
+
+    def stop(self):
+        transfer.get_s3_client = self._get_s3_client
+        self._mock.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def keys(self, prefix=''):
+        """
+        Return the set of keys in the bucket starting with `prefix`.
+        """
+        pages = self._client.get_paginator('list_objects').paginate(
+            Bucket=self.bucket, Prefix=prefix)
+        return set(o['Key'] for page in pages
+                   for o in page.get('Contents', ()))
@@ -1,4 +1,5 @@
 import os
+import sys
 import versioneer
 
 versioneer.VCS = 'git'
@@ -7,6 +8,7 @@ versioneer.versionfile_build = 'BigStash/version.py'
 versioneer.tag_prefix = ''
 versioneer.parentdir_prefix = 'bigstash-'
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 
 def pep386adapt(version):
@@ -19,21 +21,47 @@ def pep386adapt(version):
 
 install_requires = [
     'six>=1.9, <2.0',
-    'requests>=2.5.1, <2.6',
+    # the urllib3 of requests 2.9 retries refused connections as
+    # connection errors
+    'requests>=2.9.1, <3.0',
     'retrying',
     'wrapt',
-    'boto3',
+    # botocore 1.11 for the before-send event the rate limit hooks into,
+    # besides client pool sizes, addressing styles and refreshable
+    # credentials
+    'boto3>=1.8.0',
+    'botocore>=1.11.0',
     'cached_property',
     'docopt',
     'inflect'
 ]
 
+if sys.version_info < (3, 2):
+    install_requires.append('futures')
+
 
 dev_requires = [
     'flake8',
 ]
 
 
+class build_py_aio(build_py):
+    """
+    Leave the asyncio client out of builds for Python 2, which can't
+    compile it. Wheels are built for each major version for this reason.
+    """
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info >= (3,):
+            return modules
+        return [m for m in modules if m[:2] != ('BigStash', 'aio')]
+
+
+cmdclass = versioneer.get_cmdclass()
+cmdclass['build_py'] = build_py_aio
+
+
 def read(fname):
     try:
         return open(os.path.join(os.path.dirname(__file__), fname)).read()
@@ -65,10 +93,12 @@ setup(version=pep386adapt(versioneer.get_version()),
           'Topic :: System :: Archiving',
           'Topic :: Utilities',
           ],
-      cmdclass=versioneer.get_cmdclass(),
+      cmdclass=cmdclass,
       install_requires=install_requires,
       extras_require={
-          'dev': dev_requires
+          'dev': dev_requires,
+          # the asyncio client in BigStash.aio, Python 3.6 or later
+          'aio': ['aiohttp>=3.0'],
           },
       entry_points={
           'console_scripts': ['bgst=BigStash.upload:main']